@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import os
+import io
+import mmap
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Files smaller than this are opened with open() as they always were.  Their
+# pages are few and may well be wanted again soon.
+LARGE_FILE = 64 * 1024 * 1024
+
+# Pages behind the current position are dropped from the page cache every
+# time this many bytes have been read or written.  O_DIRECT reads are made
+# this many bytes at a time.
+WINDOW = 16 * 1024 * 1024
+
+# O_DIRECT needs reads aligned in memory, in the file, and in size to the
+# logical block size of the disk.  4 KB covers the disks in use.
+BLOCK = 4096
+
+# posix_fadvise() is missing on macOS, where F_NOCACHE keeps a file out of
+# the cache instead.
+FADVISE = hasattr(os, 'posix_fadvise')
+F_NOCACHE = getattr(fcntl, 'F_NOCACHE', None)
+O_DIRECT = getattr(os, 'O_DIRECT', None)
+
+
+
+def open_file(filename=None, mode='rb', size=None, direct=False):
+    '''Open a file which is read or written once from start to end, such as
+    a file being encrypted, hashed, or uploaded.  Files of at least
+    LARGE_FILE bytes are opened as a StreamFile which keeps them from
+    filling the page cache.  Smaller files are opened with open().
+
+    The size of the file decides unless size is passed, which is needed to
+    open a new file for writing this way.
+    '''
+    if size == None:
+        size = 0
+        if 'r' in mode and os.path.exists(filename):
+            size = os.path.getsize(filename)
+    if size < LARGE_FILE: return open(filename, mode)
+    return StreamFile(filename, mode, direct)
+
+
+
+def drop_cache(filename=None):
+    '''Drop the pages of a file from the page cache.  Only pages already
+    written to disk are dropped.
+    '''
+    if not FADVISE: return
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return
+
+
+
+class StreamFile(object):
+    '''File object for streaming a large file through once without pushing
+    everything else out of the page cache.  The kernel is told access is
+    sequential so it reads ahead further, and every WINDOW bytes the pages
+    already passed are dropped with posix_fadvise(DONTNEED).  Written pages
+    can only be dropped once on disk.  Dropping a range starts writing it
+    back, so each drop covers the window before as well, which has been
+    written back by then.  Closing a written file flushes it to disk and
+    drops the rest.
+
+    With direct, a file opened for reading uses O_DIRECT where the system
+    has it and the page cache is not used at all.  Reads are then made
+    WINDOW bytes at a time into a buffer aligned for O_DIRECT.  File systems
+    which refuse O_DIRECT, such as tmpfs, are read the normal way.
+
+    On macOS F_NOCACHE is set on the file instead of either.
+
+    Anything not listed below is passed on to the underlying file object.
+
+    ATTRIBUTES
+        name               Name of the file.
+
+        mode               Mode the file was opened with.
+
+        direct             True if reads use O_DIRECT.
+
+    METHODS
+        read               Read up to size bytes.
+
+        readinto           Read into a buffer.
+
+        write              Write bytes.
+
+        seek               Move to a position in the file.
+
+        tell               Return the position in the file.
+
+        close              Close the file, dropping what is left of it from
+                           the page cache.
+
+    '''
+    def __init__(self, filename=None, mode='rb', direct=False):
+        self.name = filename
+        self.mode = mode
+        self.direct = False
+        self._writable = mode != 'rb'
+        self._fileobj = None
+        if direct == True and mode == 'rb' and O_DIRECT != None:
+            try:
+                fd = os.open(filename, os.O_RDONLY | O_DIRECT)
+                self._fileobj = io.FileIO(fd, 'rb', closefd=True)
+                self.direct = True
+            except OSError:
+                pass
+        if self._fileobj == None: self._fileobj = open(filename, mode)
+        if F_NOCACHE != None: fcntl.fcntl(self.fileno(), F_NOCACHE, 1)
+
+        # Start of the range not yet dropped from the cache, and of the one
+        # dropped before it for files being written.
+        self._mark = self._fileobj.tell()
+        self._last_mark = self._mark
+        self._advise(0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+        # Aligned buffer for O_DIRECT reads.  It holds count bytes of the file
+        # from offset base, and eof is set once it reached the end.
+        self._buffer = None
+        if self.direct:
+            self._buffer = mmap.mmap(-1, WINDOW)
+            self._pos = 0
+            self._base = 0
+            self._count = 0
+            self._eof = False
+        return
+
+
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+
+
+    def _advise(self, offset, length, advice):
+        if not FADVISE or length < 0: return
+        os.posix_fadvise(self.fileno(), offset, length, getattr(os, advice))
+        return
+
+
+
+    def _drop(self):
+        '''Drop the pages passed since the last drop once there are a
+        WINDOW of them.
+        '''
+        pos = self.tell()
+        if abs(pos - self._mark) < WINDOW: return
+        start = min(pos, self._mark)
+        if self._writable:
+            self._fileobj.flush()
+            start = min(start, self._last_mark)
+        self._advise(start, max(pos, self._mark) - start,
+                     'POSIX_FADV_DONTNEED')
+        self._last_mark = self._mark
+        self._mark = pos
+        return
+
+
+
+    def fileno(self):
+        return self._fileobj.fileno()
+
+
+
+    def tell(self):
+        if self.direct: return self._pos
+        return self._fileobj.tell()
+
+
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if not self.direct: return self._fileobj.seek(offset, whence)
+        if whence == os.SEEK_CUR: offset += self._pos
+        if whence == os.SEEK_END: offset += os.fstat(self.fileno()).st_size
+        if offset < 0: raise ValueError('Negative seek position {}'.format(offset))
+        self._pos = offset
+        return self._pos
+
+
+
+    def write(self, data):
+        n = self._fileobj.write(data)
+        self._drop()
+        return n
+
+
+
+    def read(self, size=-1):
+        if not self.direct:
+            data = self._fileobj.read(size)
+            self._drop()
+            return data
+        if size == None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(WINDOW)
+                if not chunk: return b''.join(chunks)
+                chunks.append(chunk)
+        buf = bytearray(size)
+        n = self.readinto(buf)
+        del buf[n:]
+        return bytes(buf)
+
+
+
+    def readinto(self, buf):
+        if not self.direct:
+            n = self._fileobj.readinto(buf)
+            self._drop()
+            return n
+        view = memoryview(buf).cast('B')
+        filled = 0
+        while filled < len(view):
+            if not self._base <= self._pos < self._base + self._count:
+                if self._eof and self._pos >= self._base + self._count: break
+                self._fill()
+                continue
+            start = self._pos - self._base
+            n = min(self._count - start, len(view) - filled)
+            view[filled:filled + n] = self._buffer[start:start + n]
+            filled += n
+            self._pos += n
+        return filled
+
+
+
+    def _fill(self):
+        '''Read the WINDOW of the file around the current position into the
+        aligned buffer.
+        '''
+        base = self._pos - self._pos % BLOCK
+        if self._fileobj.tell() != base: self._fileobj.seek(base)
+        self._base = base
+        self._count = self._fileobj.readinto(self._buffer) or 0
+        self._eof = self._count < len(self._buffer)
+        return
+
+
+
+    def close(self):
+        if self._fileobj.closed: return
+        try:
+            if self._writable:
+                self._fileobj.flush()
+                os.fsync(self.fileno())
+            self._advise(0, 0, 'POSIX_FADV_DONTNEED')
+        finally:
+            self._fileobj.close()
+            if self._buffer != None: self._buffer.close()
+        return
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs : https://github.com/MartyCombs/public/blob/main/create_metadata/README.md
+# Ticket       :
+# Source Ctl   : https://github.com/MartyCombs/public/blob/main/create_metadata/bin/checksum_cache.py
+#=============================================================================#
+
+import time
+import sqlite3
+import threading
+from mylog import MyLog
+
+class ChecksumCache(object):
+    '''SQLite cache of the checksums already calculated, so running
+    create_metadata.py again over the same files does not read them again.
+
+    A checksum is found by the device, inode, size, and modification time
+    of the file.  Changing the file changes its size or modification time
+    and the old checksum is no longer found.  A file copied or restored to
+    a new place has a new inode and is read again.
+
+    Once the cache holds more than max_entries checksums, those used least
+    recently are removed.
+
+    The cache may be used from several threads at once.
+
+    ATTRIBUTES
+        debug                Enable debug mode.
+
+        loglevel             Set the python log level.
+
+        filename             SQLite file holding the cache.
+
+        max_entries          Most checksums kept.
+
+    METHODS
+        get                  Return the cached checksum of a file or None.
+
+        put                  Add the checksum of a file.
+
+        close                Close the cache.
+
+    '''
+
+    def __init__(self,
+                 debug=False,
+                 loglevel='WARNING',
+                 filename=None,
+                 max_entries=100000):
+        self.debug = debug
+        self.loglevel = loglevel
+        program=__class__.__name__
+        l = MyLog(program=program, debug=debug, loglevel=loglevel)
+        self.log = l.log
+        if filename == None: raise Exception('Cache file not set')
+        self.filename = filename
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS checksums (
+            dev        INTEGER NOT NULL,
+            ino        INTEGER NOT NULL,
+            size       INTEGER NOT NULL,
+            mtime_ns   INTEGER NOT NULL,
+            method     TEXT NOT NULL,
+            checksum   TEXT NOT NULL,
+            used       REAL NOT NULL,
+            PRIMARY KEY (dev, ino, size, mtime_ns, method))''')
+        self._db.execute('''CREATE INDEX IF NOT EXISTS checksums_used
+            ON checksums (used)''')
+        self._db.commit()
+        return
+
+
+
+    def _key(self, st, method):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, method)
+
+
+
+    def get(self, st=None, method='sha512'):
+        '''Return the checksum cached for the os.stat() result of a file, or
+        None if there is none.
+        '''
+        key = self._key(st, method)
+        with self._lock:
+            row = self._db.execute('''SELECT checksum FROM checksums
+                WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?
+                AND method = ?''', key).fetchone()
+            if row == None: return None
+            self._db.execute('''UPDATE checksums SET used = ?
+                WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?
+                AND method = ?''', (time.time(),) + key)
+            self._db.commit()
+        return row[0]
+
+
+
+    def put(self, st=None, method='sha512', checksum=None):
+        '''Add the checksum of a file given its os.stat() result.  Pass the
+        result from before the file was read, and only if the file did not
+        change while it was read.
+        '''
+        key = self._key(st, method)
+        with self._lock:
+            self._db.execute('''INSERT OR REPLACE INTO checksums
+                (dev, ino, size, mtime_ns, method, checksum, used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                key + (checksum, time.time()))
+            count = self._db.execute(
+                'SELECT COUNT(*) FROM checksums').fetchone()[0]
+            if count > self.max_entries:
+                self.log.debug('Removing {} least recently used checksums'.format(
+                    count - self.max_entries))
+                self._db.execute('''DELETE FROM checksums WHERE rowid IN
+                    (SELECT rowid FROM checksums ORDER BY used LIMIT ?)''',
+                    (count - self.max_entries,))
+            self._db.commit()
+        return
+
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        return
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
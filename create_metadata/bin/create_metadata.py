@@ -9,7 +9,9 @@ import sys
 import os
 import argparse
 import time
+from concurrent.futures import ThreadPoolExecutor
 from metadata import MetaData
+from checksum_cache import ChecksumCache
 from metadata_conf import MetadataConf
 from mylog import MyLog
 
@@ -36,6 +38,20 @@ def parse_arguments():
     parser.add_argument('--showprogress', action='store_true',
         default=False,
         help='Enable progress bar for large files.')
+    parser.add_argument('--use-stats', action='store_true',
+        default=False,
+        help='''Use the size and checksums in FILENAME.stats, written when
+        the file was encrypted, instead of reading the whole file.  Files
+        without a matching stats file, or one lacking any of
+        extra_checksums, are still read.''')
+    parser.add_argument('--jobs', action='store', type=int,
+        default=os.cpu_count(),
+        help='''Number of files to checksum at the same time.  Hashing runs
+        outside the python GIL, so each job can keep a core busy.''')
+    parser.add_argument('--no-cache', action='store_true',
+        default=False,
+        help='''Read every file instead of using checksums cached from
+        earlier runs, and do not cache the new ones.''')
 
     # Metadata file settings
     parser.add_argument('--backup_source', action='store',
@@ -56,10 +72,31 @@ def parse_arguments():
     return parser.parse_args()
 
 
+
+def report_throughput(md=None, log=None):
+    '''Log how fast the checksum of a file was calculated.
+    '''
+    name = os.path.basename(md.filename)
+    if md.checksum_source == 'stats':
+        log.info('Took checksum of "{}" from its stats file'.format(name))
+        return
+    if md.checksum_source == 'cache':
+        log.info('Took checksum of "{}" from the cache'.format(name))
+        return
+    mbytes = md.file_size_bytes / (1024 * 1024)
+    seconds = max(md.checksum_seconds, 0.000001)
+    log.info('Hashed "{}" {:.1f} MB in {:.2f}s at {:.1f} MB/s'.format(
+        name, mbytes, md.checksum_seconds, mbytes / seconds))
+    return
+
+
+
 def main():
     args = parse_arguments()
     l = MyLog(program=__name__, debug=args.debug, loglevel=args.loglevel)
     log = l.log
+    if args.jobs == None or args.jobs < 1:
+        raise Exception('Invalid number of jobs "{}"'.format(args.jobs))
 
     # Sort through the list of files passed.  We have some restrictions
     # regarding what we will or will not do.
@@ -92,13 +129,25 @@ def main():
     if args.s3_url:          cfg.set_s3_url(args.s3_url)
     if args.s3_url_metadata: cfg.set_s3_url_metadata(args.s3_url_metadata)
 
+    cache = None
+    if not args.no_cache:
+        cache = ChecksumCache(debug=args.debug,
+                              loglevel=args.loglevel,
+                              filename=cfg.checksum_cache,
+                              max_entries=cfg.checksum_cache_entries)
+
     # Build a dictionary of MetaData() class instances for each file.
     md_files = {}
     for file in clean_list:
         md = MetaData(debug=args.debug,
                       loglevel=args.loglevel,
                       showprogress=args.showprogress,
-                      filename=file)
+                      filename=file,
+                      use_stats=args.use_stats,
+                      cache=cache,
+                      extra_checksums=cfg.extra_checksums,
+                      mp_threshold=cfg.mp_threshold,
+                      mp_chunksize=cfg.mp_chunksize)
         md.set_backup_source(cfg.backup_source)
         backup_time = time.strftime('%Y-%m-%d %H:%M:%S %z', time.gmtime())
         md.set_backup_date(backup_time)
@@ -108,9 +157,24 @@ def main():
         full_md_s3_url = cfg.s3_url_metadata + (
             '/' + os.path.basename(md.metadata_filename))
         md.set_s3_url_metadata(full_md_s3_url)
-        md.add_file_stats()
         md_files[file] = md
 
+    # Checksum the files in parallel.  Results are collected in the order the
+    # files were passed, and the first failure is raised as before.
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(md.add_file_stats) for md in md_files.values()]
+        for (md, future) in zip(md_files.values(), futures):
+            future.result()
+            report_throughput(md, log)
+    if cache != None: cache.close()
+    read = [md for md in md_files.values() if md.checksum_source == 'file']
+    total_mbytes = sum([md.file_size_bytes for md in read]) / (1024 * 1024)
+    seconds = max(time.time() - start, 0.000001)
+    if len(read) > 0:
+        log.info('Checksummed {} files {:.1f} MB with {} jobs at {:.1f} MB/s'.format(
+            len(read), total_mbytes, args.jobs, total_mbytes / seconds))
+
     # Write each of the metadta files.
     for file in md_files.keys():
         log.info('Writing metadata file for "{}"'.format(os.path.basename(file)))
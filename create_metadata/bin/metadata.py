@@ -6,10 +6,12 @@
 #=============================================================================#
 
 import os
-import hashlib
+import time
 from tqdm import tqdm
 import json
 from mylog import MyLog
+from cache_io import open_file
+from multi_hash import MultiHash, s3_part_size, check_method
 
 class MetaData(object):
     '''Manages the metadata structure of files backed up to S3.
@@ -21,6 +23,23 @@ class MetaData(object):
 
         showprogress             Show progress via tqdm.
 
+        use_stats                Take the file size and checksum from a
+                                 'FILENAME.stats' file written while the file
+                                 was encrypted instead of reading the file.
+                                 The stats file is only used if the size and
+                                 modification time still match the file and
+                                 it has every one of extra_checksums.
+
+        extra_checksums          List of checksums calculated along with the
+                                 sha512 while the file is read.  Any of 'md5',
+                                 'sha256', 'crc32c', or 's3_etag'.
+
+        mp_threshold             File size in bytes above which s3_upload uses
+                                 multipart upload.  Needed for 's3_etag'.
+
+        mp_chunksize             Part size s3_upload asks for in a multipart
+                                 upload.  Needed for 's3_etag'.
+
         filename                 File name.
 
         metadata_filename        Metadata file name.
@@ -30,6 +49,19 @@ class MetaData(object):
                                  all metadata file attributes and running the
                                  format() method.
 
+        cache                    ChecksumCache consulted by add_file_stats()
+                                 before reading the file, and given the
+                                 checksums it calculates.  None to always
+                                 read the file.
+
+        checksum_source          Where add_file_stats() took the checksum
+                                 from.  One of 'file', 'stats', or 'cache'.
+
+        checksum_seconds         Seconds spent reading and hashing the file in
+                                 add_file_stats().  None if the checksum came
+                                 from a stats file or the cache.  Not written
+                                 to the metadata file.
+
 
     DATA STRUCTURE
         This will become the contents of 'FILENAME.meta'
@@ -43,8 +75,16 @@ class MetaData(object):
             'encryption_key'       : Encryption key used on the file.
             's3_url'               : S3 URL to file.
             's3_url_metadata'      : S3 URL to metadata file.
+            'file_md5'             : MD5 of backup file.
+            'file_sha256'          : SHA256 of backup file.
+            'file_crc32c'          : CRC32C of backup file.
+            's3_etag'              : ETag S3 gives the backup file when it is
+                                     uploaded by s3_upload.
         }
 
+        The last four are only written when asked for in extra_checksums.
+        All checksums are hex.  S3 shows SHA256 and CRC32C checksums in base64.
+
 
     METHODS
         set_filename             Set the file name.
@@ -80,18 +120,44 @@ class MetaData(object):
         's3_url_metadata' : None        # S3 URL of metadata file
     }
 
+    # Attribute set by each of the extra checksums.
+    EXTRA_CHECKSUMS = {
+        'md5' : 'file_md5',
+        'sha256' : 'file_sha256',
+        'crc32c' : 'file_crc32c',
+        's3_etag' : 's3_etag'
+    }
+    STATS_EXTENSION = '.stats'
+
 
     def __init__(self,
                  debug=None,
                  loglevel='INFO',
                  showprogress=False,
-                 filename=None):
+                 filename=None,
+                 use_stats=False,
+                 cache=None,
+                 extra_checksums=None,
+                 mp_threshold=32 * (1024 ** 2),
+                 mp_chunksize=32 * 1024):
         self.debug = debug
         self.loglevel = loglevel
         program=__class__.__name__
         l = MyLog(program=program, debug=debug, loglevel=loglevel)
         self.log = l.log
         self.showprogress = showprogress
+        self.use_stats = use_stats
+        self.cache = cache
+        self.extra_checksums = []
+        if extra_checksums != None:
+            for method in extra_checksums:
+                if method not in self.EXTRA_CHECKSUMS:
+                    raise Exception('Extra checksum "{}" not understood'.format(
+                        method))
+                check_method(method)
+            self.extra_checksums = list(extra_checksums)
+        self.mp_threshold = mp_threshold
+        self.mp_chunksize = mp_chunksize
 
         if filename != None:
             self.set_filename(filename)
@@ -107,7 +173,10 @@ class MetaData(object):
         self.encryption_key = self.DEFAULT_SETTINGS['encryption_key']
         self.s3_url = self.DEFAULT_SETTINGS['s3_url']
         self.s3_url_metadata = self.DEFAULT_SETTINGS['s3_url_metadata']
+        for attr in self.EXTRA_CHECKSUMS.values(): setattr(self, attr, None)
         self.metadata_filecontents = None
+        self.checksum_source = None
+        self.checksum_seconds = None
         return
 
 
@@ -150,40 +219,143 @@ class MetaData(object):
             file_size_bytes
             file_checksum
             file_checksum_method
+        and those in extra_checksums.  All are taken from one read of the
+        file.
         '''
         if not os.path.isfile(self.fullpath):
             raise Exception('File does not exist "{}"'.format(self.fullpath))
         self.log.debug('Adding file stats')
-        self.file_size_bytes = os.path.getsize(self.fullpath)
+        self.checksum_seconds = None
+        for attr in self.EXTRA_CHECKSUMS.values(): setattr(self, attr, None)
+        if self.use_stats == True and self._load_stats() == True:
+            self.checksum_source = 'stats'
+            return
+        st = os.stat(self.fullpath)
+        self.file_size_bytes = st.st_size
         self.file_checksum_method = 'sha512'
-        self._calculate_checksum()
+
+        # The ETag depends on the part size as well as the contents.
+        keys = {}
+        for method in [self.file_checksum_method] + self.extra_checksums:
+            keys[method] = method
+        if 's3_etag' in keys:
+            keys['s3_etag'] = 's3_etag-{}'.format(s3_part_size(
+                st.st_size, self.mp_threshold, self.mp_chunksize))
+
+        if self.cache != None:
+            checksums = {}
+            for method in keys.keys():
+                checksums[method] = self.cache.get(st, keys[method])
+            if None not in checksums.values():
+                self.log.debug('Using cached checksums of "{}"'.format(
+                    self.filename))
+                self._set_checksums(checksums)
+                self.checksum_source = 'cache'
+                return
+        start = time.time()
+        checksums = self._calculate_checksum()
+        self.checksum_seconds = time.time() - start
+        self._set_checksums(checksums)
+        self.checksum_source = 'file'
+
+        # A file written to while it was read has a checksum of neither the
+        # old nor the new contents, so it is not cached.
+        if self.cache != None:
+            after = os.stat(self.fullpath)
+            if (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                for method in keys.keys():
+                    self.cache.put(st, keys[method], checksums[method])
+            else:
+                self.log.warning('"{}" changed while it was read'.format(
+                    self.filename))
+        return
+
+
+
+    def _load_stats(self):
+        '''Load the file size and checksums from the stats file written when
+        the file was encrypted.  Each of extra_checksums must be in it too,
+        and an s3_etag must be for the part size of this file.  Otherwise
+        the file is read for them.
+
+        RETURN
+                True if the stats file exists, matches the file, and has
+                every checksum wanted.
+        '''
+        stats_file = self.fullpath + self.STATS_EXTENSION
+        if not os.path.isfile(stats_file): return False
+        with open(stats_file, 'r') as f:
+            stats = json.load(f)
+        f.close()
+        st = os.stat(self.fullpath)
+        if (stats.get('file_size_bytes') != st.st_size
+            or stats.get('file_mtime_ns') != st.st_mtime_ns
+            or stats.get('file_checksum_method') != 'sha512'
+            or not stats.get('file_checksum')):
+            self.log.warning('Ignoring stale stats file "{}"'.format(
+                os.path.basename(stats_file)))
+            return False
+        if ('s3_etag' in self.extra_checksums and
+            stats.get('s3_part_size') != s3_part_size(
+                st.st_size, self.mp_threshold, self.mp_chunksize)):
+            stats.pop('s3_etag', None)
+        missing = [method for method in self.extra_checksums
+                   if not stats.get(self.EXTRA_CHECKSUMS[method])]
+        if len(missing) > 0:
+            self.log.debug('Stats file "{}" lacks {}.  Reading the file.'.format(
+                os.path.basename(stats_file), ', '.join(missing)))
+            return False
+        self.log.debug('Using file stats from "{}"'.format(
+            os.path.basename(stats_file)))
+        self.file_size_bytes = stats['file_size_bytes']
+        self.file_checksum_method = stats['file_checksum_method']
+        self.file_checksum = stats['file_checksum']
+        for method in self.extra_checksums:
+            setattr(self, self.EXTRA_CHECKSUMS[method],
+                    stats[self.EXTRA_CHECKSUMS[method]])
+        return True
+
+
+
+    def _set_checksums(self, checksums=None):
+        self.file_checksum = checksums[self.file_checksum_method]
+        for method in self.extra_checksums:
+            setattr(self, self.EXTRA_CHECKSUMS[method], checksums[method])
         return
 
 
 
     def _calculate_checksum(self):
-        self.log.debug('Calculating SHA512 sum of "{}"'.format(self.filename))
+        '''Read the file once and return a dictionary of the sha512 and any
+        extra checksums by method.
+        '''
+        methods = [self.file_checksum_method] + self.extra_checksums
+        self.log.debug('Calculating {} of "{}"'.format(
+            ', '.join(methods), self.filename))
 
         # Set up a progress bar to let the user know we're still doing something.
         readbuff = 64 * 1024  # 64KB
-        hasher = hashlib.sha512()
+        filesize = os.path.getsize(self.fullpath)
+        hasher = MultiHash(methods=methods,
+                           size=filesize,
+                           mp_threshold=self.mp_threshold,
+                           mp_chunksize=self.mp_chunksize)
         if self.showprogress == True:
-            filesize = os.path.getsize(self.fullpath)
             progress_bar = tqdm(total=filesize,
                                 ascii=" >>>>>>>>>=",
                                 unit='B',
                                 unit_scale=True,
                                 desc=self.filename)
 
-        with open(self.fullpath, 'rb') as f:
+        # Large files are kept from filling the page cache.
+        with open_file(self.fullpath, 'rb') as f:
             while True:
                 buff = f.read(readbuff)
                 if not buff: break
                 hasher.update(buff)
                 if self.showprogress == True: progress_bar.update(len(buff))
         if self.showprogress == True: progress_bar.close()
-        self.file_checksum = '{}'.format(hasher.hexdigest())
-        return
+        return hasher.checksums()
 
 
 
@@ -222,7 +394,7 @@ class MetaData(object):
         # Build the JSON file from the nested python dictionary.
         self.metadata_filecontents = {}
 
-        stats = self.DEFAULT_SETTINGS
+        stats = dict(self.DEFAULT_SETTINGS)
         stats['backup_source'] = self.backup_source
         stats['backup_date'] = self.backup_date
         stats['file_size_bytes'] = self.file_size_bytes
@@ -231,6 +403,9 @@ class MetaData(object):
         stats['encryption_key'] = self.encryption_key
         stats['s3_url'] = self.s3_url
         stats['s3_url_metadata'] = self.s3_url_metadata
+        # Extra checksums are only written when they were calculated.
+        for attr in self.EXTRA_CHECKSUMS.values():
+            if getattr(self, attr) != None: stats[attr] = getattr(self, attr)
 
         self.metadata_filecontents[self.filename] = stats
         json_file_contents = json.dumps(self.metadata_filecontents,
@@ -285,6 +460,8 @@ class MetaData(object):
                     self.set_s3_url(md_contents[k1][k2])
                 elif k2 == 's3_url_metadata':
                     self.set_s3_url_metadata(md_contents[k1][k2])
+                elif k2 in self.EXTRA_CHECKSUMS.values():
+                    setattr(self, k2, md_contents[k1][k2])
         return
 
 
@@ -10,6 +10,7 @@ import os
 import re
 import configparser
 from mylog import MyLog
+from multi_hash import check_method, read_part_settings
 
 
 class MetadataConf(object):
@@ -32,6 +33,18 @@ class MetadataConf(object):
 
         set_s3_url_metadata    S3 URL for the metadata file.
 
+        set_checksum_cache     SQLite file caching the checksums already
+                               calculated.
+
+        set_checksum_cache_entries
+                               Most checksums kept in the cache.
+
+        set_extra_checksums    Checksums stored along with the sha512.
+
+        set_s3_upload_config   aws_s3.cfg of s3_upload, which sets the
+                               mp_threshold and mp_chunksize attributes the
+                               s3_etag is calculated for.
+
         print                  Print the values of the configuration for
                                debug logging.
 
@@ -46,8 +59,13 @@ class MetadataConf(object):
         'backup_source'            : 'personal',
         'encryption_key'           : 'GPG',
         's3_url'                   : 's3://BUCKET_NAME/PATH',
-        's3_url_metadata'          : 's3://BUCKET_NAME/PATH'
+        's3_url_metadata'          : 's3://BUCKET_NAME/PATH',
+        'checksum_cache'           : 'etc/checksum_cache.sqlite',
+        'checksum_cache_entries'   : 100000,
+        'extra_checksums'          : 'md5, sha256, s3_etag',
+        's3_upload_config'         : '../s3_upload/etc/aws_s3.cfg'
     }
+    EXTRA_CHECKSUMS = ['md5', 'sha256', 'crc32c', 's3_etag']
     BACKUP_SOURCES = ['personal', 'work']
     S3_URL = re.compile(r's3://.*')
 
@@ -66,6 +84,12 @@ class MetadataConf(object):
         self.encryption_key = self.DEF_CONFIG['encryption_key']
         self.s3_url = self.DEF_CONFIG['s3_url']
         self.s3_url_metadata = self.DEF_CONFIG['s3_url_metadata']
+        self.checksum_cache = self._add_path(self.DEF_CONFIG['checksum_cache'])
+        self.checksum_cache_entries = self.DEF_CONFIG['checksum_cache_entries']
+        self.extra_checksums = []
+        self.set_extra_checksums(self.DEF_CONFIG['extra_checksums'])
+        self.set_s3_upload_config(
+            self._add_path(self.DEF_CONFIG['s3_upload_config']))
         return
 
 
@@ -84,10 +108,49 @@ class MetadataConf(object):
             cfg.get('DEFAULT', 's3_url'))
         self.set_s3_url_metadata(
             cfg.get('DEFAULT', 's3_url_metadata'))
+        self.set_checksum_cache(self._add_path(
+            cfg.get('DEFAULT', 'checksum_cache',
+                    fallback=self.DEF_CONFIG['checksum_cache'])))
+        self.set_checksum_cache_entries(
+            cfg.get('DEFAULT', 'checksum_cache_entries',
+                    fallback=self.DEF_CONFIG['checksum_cache_entries']))
+        self.set_extra_checksums(
+            cfg.get('DEFAULT', 'extra_checksums',
+                    fallback=self.DEF_CONFIG['extra_checksums']))
+        self.set_s3_upload_config(self._add_path(
+            cfg.get('DEFAULT', 's3_upload_config',
+                    fallback=self.DEF_CONFIG['s3_upload_config'])))
         return
 
 
 
+    def _add_path(self, path=None):
+        '''If first character of a path is os.sep, assume the full path is
+        specified.  Otherwise ASSUME that the path specified is relative
+        to the top level directory.
+        '''
+        if path[0] == os.sep: return path
+        return self.TOP_DIR + os.sep + path
+
+
+
+    def _join(self, checksums=None):
+        '''Reverse of set_extra_checksums().
+        '''
+        if len(checksums) == 0: return 'none'
+        return ', '.join(checksums)
+
+
+
+    def _strip_path(self, path=None):
+        '''Reverse of _add_path().
+        '''
+        if path.startswith(self.TOP_DIR + os.sep):
+            return path[len(self.TOP_DIR + os.sep):]
+        return path
+
+
+
     def set_backup_source(self, source=None):
         if source == None: return
         if source not in self.BACKUP_SOURCES:
@@ -119,12 +182,69 @@ class MetadataConf(object):
         return
 
 
+    def set_checksum_cache(self, filename=None):
+        if filename == None: return
+        self.checksum_cache = filename
+        return
+
+
+    def set_checksum_cache_entries(self, entries=None):
+        if entries == None: return
+        entries = int(entries)
+        if entries < 1:
+            raise Exception('Checksum cache must hold at least 1 entry not "{}"'.format(
+                entries))
+        self.checksum_cache_entries = entries
+        return
+
+
+    def set_extra_checksums(self, checksums=None):
+        '''Set the checksums stored along with the sha512 from a comma
+        separated list.  'none' stores no others.
+        '''
+        if checksums == None: return
+        methods = [c.strip() for c in checksums.split(',') if c.strip() != '']
+        if methods == ['none']: methods = []
+        for method in methods:
+            if method not in self.EXTRA_CHECKSUMS:
+                raise Exception('Extra checksum "{}" not in accepted list\n"{}"'.format(
+                    method, self.EXTRA_CHECKSUMS))
+            check_method(method)
+        self.extra_checksums = methods
+        return
+
+
+    def set_s3_upload_config(self, s3_upload_config=None):
+        '''Set aws_s3.cfg of s3_upload and take mp_threshold and
+        mp_chunksize from it.  Without it the s3_etag cannot be calculated
+        and is left out of extra_checksums.
+        '''
+        if s3_upload_config == None: return
+        self.s3_upload_config = s3_upload_config
+        (self.mp_threshold, self.mp_chunksize) = (None, None)
+        settings = read_part_settings(s3_upload_config)
+        if settings != None:
+            (self.mp_threshold, self.mp_chunksize) = settings
+        elif 's3_etag' in self.extra_checksums:
+            self.log.warning('Cannot read "{}".  Leaving out s3_etag.'.format(
+                s3_upload_config))
+            self.extra_checksums.remove('s3_etag')
+        return
+
+
     def print(self):
         report = '{}\n'.format('='*76)
         report += '{:<25} {}\n'.format('backup_source', self.backup_source)
         report += '{:<25} {}\n'.format('encryption_key', self.encryption_key)
         report += '{:<25} {}\n'.format('s3_url', self.s3_url)
         report += '{:<25} {}\n'.format('s3_url_metadata', self.s3_url_metadata)
+        report += '{:<25} {}\n'.format('checksum_cache', self.checksum_cache)
+        report += '{:<25} {}\n'.format('checksum_cache_entries',
+                                       self.checksum_cache_entries)
+        report += '{:<25} {}\n'.format('extra_checksums',
+                                       self._join(self.extra_checksums))
+        report += '{:<25} {}\n'.format('s3_upload_config',
+                                       self.s3_upload_config)
         report += '{}\n'.format('='*76)
         return report
 
@@ -144,6 +264,13 @@ class MetadataConf(object):
         cfg += 'encryption_key = {}\n'.format(self.encryption_key)
         cfg += 's3_url = {}\n'.format(self.s3_url)
         cfg += 's3_url_metadata = {}\n'.format(self.s3_url_metadata)
+        cfg += 'checksum_cache = {}\n'.format(
+            self._strip_path(self.checksum_cache))
+        cfg += 'checksum_cache_entries = {}\n'.format(
+            self.checksum_cache_entries)
+        cfg += 'extra_checksums = {}\n'.format(self._join(self.extra_checksums))
+        cfg += 's3_upload_config = {}\n'.format(
+            self._strip_path(self.s3_upload_config))
         cfg += '\n{}\n# END\n{}\n'.format(div, div)
         return cfg
 
@@ -173,6 +300,40 @@ class MetadataConf(object):
 # s3_url_metadata              S3 URL for the metadata file
 #                              [DEFAULT: {}]
 #       '''.format(self.DEF_CONFIG['s3_url_metadata'])
+        header += '''
+# checksum_cache               SQLite file caching the checksums already
+#                              calculated, found by device, inode, size and
+#                              modification time of the file.  Relative to
+#                              the top level directory unless it starts
+#                              with '/'.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['checksum_cache'])
+        header += '''
+# checksum_cache_entries       Most checksums kept in the cache.  Those used
+#                              least recently are removed first.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['checksum_cache_entries'])
+        header += '''
+# extra_checksums              Comma separated checksums calculated along
+#                              with the sha512 in the same read of the file,
+#                              or 'none'.  Any of
+#                                  md5      MD5 of the file.
+#                                  sha256   SHA256 of the file.
+#                                  crc32c   CRC32C of the file.  Needs the
+#                                           crc32c package.
+#                                  s3_etag  ETag S3 gives the file once
+#                                           uploaded by s3_upload.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['extra_checksums'])
+        header += '''
+# s3_upload_config             aws_s3.cfg of s3_upload.  The s3_etag is
+#                              calculated for the part size its
+#                              mp_threshold and mp_chunksize give.  If it
+#                              cannot be read s3_etag is left out.
+#                              Relative to the top level directory unless it
+#                              starts with '/'.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['s3_upload_config'])
         return header
 
 
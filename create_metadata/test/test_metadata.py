@@ -7,7 +7,12 @@
 
 import sys
 import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from metadata import MetaData
+from checksum_cache import ChecksumCache
+from multi_hash import MultiHash, s3_part_size
 from mylog import MyLog
 
 l = MyLog(debug=True)
@@ -32,6 +37,13 @@ if m.metadata_filename != 'testfile.txt.meta':
         {} != {}\n'''.format( m.metadata_filename, 'testfile.txt.meta'))
 else:
     log.debug('\nPASSED: Correct anticipated name for metatdata file\n')
+
+# Extra checksums not asked for are left out of the file.
+if set(json.loads(filecontents)[testfile].keys()) != set(
+        MetaData.DEFAULT_SETTINGS.keys()):
+    log.debug('\nFAILED: Keys not asked for written to the metadata file\n')
+else:
+    log.debug('\nPASSED: Only the keys asked for written\n')
 m.write()
 
 log.debug('Reading "{}"'.format(testfile2))
@@ -46,6 +58,179 @@ else:
     log.debug(
     '\nPASSED: Checksum for {} matches expected value.\n'.format(testfile2))
 
+
+log.debug('Using a stats file written while encrypting "{}"'.format(testfile))
+stats_file = testfile + MetaData.STATS_EXTENSION
+st = os.stat(testfile)
+stats = { 'file_size_bytes' : st.st_size,
+          'file_checksum' : 'precomputed',
+          'file_checksum_method' : 'sha512',
+          'file_mtime_ns' : st.st_mtime_ns }
+with open(stats_file, 'w') as f:
+    f.write(json.dumps(stats))
+m3 = MetaData(debug=True, filename=testfile, use_stats=True)
+m3.add_file_stats()
+if m3.file_checksum != 'precomputed':
+    log.debug('\nFAILED: Checksum not taken from {}\n'.format(stats_file))
+else:
+    log.debug('\nPASSED: Checksum taken from {}\n'.format(stats_file))
+
+# A stats file which no longer matches the file is ignored.
+stats['file_mtime_ns'] += 1
+with open(stats_file, 'w') as f:
+    f.write(json.dumps(stats))
+m3.add_file_stats()
+if m3.file_checksum != m.file_checksum:
+    log.debug('\nFAILED: Stale {} was used\n'.format(stats_file))
+else:
+    log.debug('\nPASSED: Stale {} was ignored\n'.format(stats_file))
+
+# As create_metadata.py --use-stats runs with the default extra_checksums.
+# Stats files without them, such as those from older runs, are read for
+# them.  Those written by aes_encrypt.sh --write-stats include them.
+stats['file_mtime_ns'] = st.st_mtime_ns
+with open(stats_file, 'w') as f:
+    f.write(json.dumps(stats))
+extras = ['md5', 'sha256', 's3_etag']
+with open(testfile, 'rb') as f:
+    md5 = hashlib.md5(f.read()).hexdigest()
+m3 = MetaData(debug=True, filename=testfile, use_stats=True,
+              extra_checksums=extras)
+m3.add_file_stats()
+if m3.checksum_source != 'file' or m3.s3_etag != md5:
+    log.debug('\nFAILED: Missing checksums not read from the file\n')
+else:
+    log.debug('\nPASSED: Missing checksums read from the file\n')
+stats.update({ 'file_md5' : 'precomputed md5',
+               'file_sha256' : 'precomputed sha256',
+               's3_etag' : 'precomputed etag',
+               's3_part_size' : 0 })
+with open(stats_file, 'w') as f:
+    f.write(json.dumps(stats))
+m3.add_file_stats()
+m3.write()
+with open(m3.metadata_filename, 'r') as f:
+    written = json.load(f)[testfile]
+if (m3.checksum_source != 'stats' or written['s3_etag'] != 'precomputed etag'
+    or written['file_sha256'] != 'precomputed sha256'):
+    log.debug('\nFAILED: Extra checksums not taken from {}\n'.format(
+        stats_file))
+else:
+    log.debug('\nPASSED: Extra checksums taken from {}\n'.format(stats_file))
+
+# An ETag for another part size than s3_upload uses is not trusted.
+stats['s3_part_size'] = 5 * 1024 * 1024
+with open(stats_file, 'w') as f:
+    f.write(json.dumps(stats))
+m3.add_file_stats()
+if m3.checksum_source != 'file' or m3.s3_etag != md5:
+    log.debug('\nFAILED: ETag for another part size used\n')
+else:
+    log.debug('\nPASSED: ETag for another part size ignored\n')
+os.remove(stats_file)
+
+
+log.debug('Calculating checksums in parallel as create_metadata.py --jobs does')
+if m.checksum_seconds == None:
+    log.debug('\nFAILED: Time to calculate the checksum not recorded\n')
+else:
+    log.debug('\nPASSED: Time to calculate the checksum recorded\n')
+md_list = [MetaData(debug=True, filename=testfile) for i in range(4)]
+with ThreadPoolExecutor(max_workers=4) as pool:
+    futures = [pool.submit(md.add_file_stats) for md in md_list]
+    for future in futures: future.result()
+if [md.file_checksum for md in md_list] != [m.file_checksum] * len(md_list):
+    log.debug('\nFAILED: Checksums calculated in parallel do not match\n')
+else:
+    log.debug('\nPASSED: Checksums calculated in parallel match\n')
+
+
+log.debug('Caching checksums by device, inode, size and modification time')
+cache_file = 'checksum_cache.sqlite'
+if os.path.exists(cache_file): os.remove(cache_file)
+cache = ChecksumCache(debug=True, filename=cache_file, max_entries=2)
+m4 = MetaData(debug=True, filename=testfile, cache=cache)
+m4.add_file_stats()
+m5 = MetaData(debug=True, filename=testfile, cache=cache)
+m5.add_file_stats()
+if m5.checksum_source != 'cache' or m5.file_checksum != m.file_checksum:
+    log.debug('\nFAILED: Checksum not taken from the cache\n')
+else:
+    log.debug('\nPASSED: Checksum taken from the cache\n')
+
+# A newer modification time is a different file to the cache.
+st = os.stat(testfile)
+os.utime(testfile, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+m5.add_file_stats()
+os.utime(testfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+if m5.checksum_source != 'file':
+    log.debug('\nFAILED: Cached checksum of a modified file was used\n')
+else:
+    log.debug('\nPASSED: Modified file was read again\n')
+
+# Three files in a cache of two removes the least recently used.
+m5.add_file_stats()
+m6 = MetaData(debug=True, filename=testfile2, cache=cache)
+m6.add_file_stats()
+if cache.get(os.stat(testfile), 'sha512') == None:
+    log.debug('\nFAILED: Recently used checksum was removed\n')
+elif cache.get(os.stat(testfile2), 'sha512') == None:
+    log.debug('\nFAILED: Newest checksum was removed\n')
+else:
+    log.debug('\nPASSED: Least recently used checksum was removed\n')
+cache.close()
+os.remove(cache_file)
+
+
+log.debug('Calculating extra checksums in the same read as the sha512')
+m7 = MetaData(debug=True, filename=testfile,
+              extra_checksums=['md5', 'sha256', 's3_etag'])
+m7.add_file_stats()
+with open(testfile, 'rb') as f:
+    data = f.read()
+if (m7.file_checksum != m.file_checksum
+    or m7.file_md5 != hashlib.md5(data).hexdigest()
+    or m7.file_sha256 != hashlib.sha256(data).hexdigest()
+    or m7.s3_etag != hashlib.md5(data).hexdigest()):
+    log.debug('\nFAILED: Extra checksums do not match hashlib\n')
+else:
+    log.debug('\nPASSED: Extra checksums match hashlib\n')
+m7.write()
+m8 = MetaData(debug=True)
+m8.load(m7.metadata_filename)
+if m8.s3_etag != m7.s3_etag or m8.file_sha256 != m7.file_sha256:
+    log.debug('\nFAILED: Extra checksums not read back from {}\n'.format(
+        m7.metadata_filename))
+else:
+    log.debug('\nPASSED: Extra checksums read back from {}\n'.format(
+        m7.metadata_filename))
+
+# Parts are raised to the 5 MB minimum of S3, and doubled to stay within
+# 10000 parts.
+mb = 1024 * 1024
+if (s3_part_size(32 * mb, 32 * mb, 32 * 1024) != 0
+    or s3_part_size(11 * mb, mb, 1024) != 5 * mb
+    or s3_part_size(100000 * mb, mb, 8 * mb) != 16 * mb):
+    log.debug('\nFAILED: Multipart part size not the one boto3 uses\n')
+else:
+    log.debug('\nPASSED: Multipart part size is the one boto3 uses\n')
+
+# A multipart ETag is the MD5 of the part MD5s and the number of parts, fed
+# in blocks which do not line up with the parts.
+data = os.urandom(11 * mb)
+parts = [data[i:i + 5 * mb] for i in range(0, len(data), 5 * mb)]
+etag = '{}-{}'.format(hashlib.md5(b''.join(
+    [hashlib.md5(p).digest() for p in parts])).hexdigest(), len(parts))
+hasher = MultiHash(methods=['s3_etag'], size=len(data),
+                   mp_threshold=mb, mp_chunksize=1024)
+for i in range(0, len(data), 3 * mb + 7):
+    hasher.update(data[i:i + 3 * mb + 7])
+if hasher.checksums()['s3_etag'] != etag:
+    log.debug('\nFAILED: Multipart ETag {} != {}\n'.format(
+        hasher.checksums()['s3_etag'], etag))
+else:
+    log.debug('\nPASSED: Multipart ETag matches\n')
+
 sys.exit()
 
 
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import os
+import time
+import json
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from mylog import MyLog
+from aes_crypt import AESCrypt
+
+
+
+# Each worker process holds a single AESCrypt instance for the life of the
+# pool along with the queue used to report progress back to the parent.
+_worker = { 'crypt' : None, 'progress' : None }
+
+
+
+class QueueProgress(object):
+    '''Progress callback for AESCrypt within a worker process.  Bytes are
+    accumulated and only sent to the parent through the queue once every
+    'interval' bytes to keep the traffic between processes low.
+    '''
+    def __init__(self, queue, interval=1024 ** 2):
+        self._queue = queue
+        self._interval = interval
+        self._pending = 0
+        return
+
+    def __call__(self, bytes_amount):
+        self._pending += bytes_amount
+        if self._pending >= self._interval: self.flush()
+        return
+
+    def flush(self):
+        if self._pending > 0:
+            self._queue.put(self._pending)
+            self._pending = 0
+        return
+
+
+
+def _init_worker(debug, loglevel, queue, threads, write_stats, config):
+    '''Initialize the worker process.
+    '''
+    progress = None
+    if queue is not None: progress = QueueProgress(queue)
+    _worker['progress'] = progress
+    _worker['crypt'] = AESCrypt(debug=debug,
+                                loglevel=loglevel,
+                                progress_callback=progress,
+                                threads=threads,
+                                write_stats=write_stats,
+                                config=config)
+    return
+
+
+
+def _run_job(action, filename):
+    '''Run a single encrypt, decrypt, or verify within a worker process.
+
+    RETURN
+            (seconds taken, statistics of the file from AESCrypt.stats())
+    '''
+    crypt = _worker['crypt']
+    crypt.set_filename(filename)
+    start = time.time()
+    try:
+        getattr(crypt, action)()
+    finally:
+        if _worker['progress'] != None: _worker['progress'].flush()
+    return (time.time() - start, crypt.stats())
+
+
+
+class AESBatch(object):
+    '''Encrypt, decrypt, or verify many files at once with AESCrypt using a
+    pool of worker processes.  A single progress bar is shared across the
+    pool and a result is kept for each file whether it succeeded or failed.
+
+    ATTRIBUTES
+        debug              Enable debug mode.
+
+        loglevel           Set the python log level.
+
+        showprogress       Show a single progress bar via tqdm for all files.
+
+        jobs               Number of worker processes.
+                           [DEFAULT: number of cores]
+
+        write_stats        Write the size and checksum of each encrypted file
+                           to FILENAME.enc.stats.  See AESCrypt.
+
+        config             EncConf instance passed on to every AESCrypt
+                           instead of reading the configuration file.
+
+        results            Dictionary of per file results after run().
+
+                           FILENAME {
+                               'status'  : 'OK' or 'FAILED'
+                               'size'    : Size of the input file in bytes.
+                               'seconds' : Time spent on the file.
+                               'error'   : Error message if the file failed.
+                               'stats'   : Statistics and timing of each
+                                           phase from AESCrypt.stats() if
+                                           the file succeeded.
+                           }
+
+    METHODS
+        run                Run an action against a list of files.
+
+        failed             Return the list of files which failed.
+
+        report             Return a formatted report of the results.
+
+        append_stats_file  Append the statistics of each file as a line of
+                           JSON to a file.
+
+    '''
+    ACTIONS = ['encrypt', 'decrypt', 'verify']
+
+    def __init__(self, debug=False, loglevel='WARNING', showprogress=False,
+                 jobs=None, write_stats=False, config=None):
+        self.debug = debug
+        self.loglevel = loglevel
+        program=__class__.__name__
+        l = MyLog(program=program, debug=debug, loglevel=loglevel)
+        self.log = l.log
+        self.showprogress = showprogress
+        if jobs == None: jobs = os.cpu_count() or 1
+        if int(jobs) < 1:
+            raise Exception('Number of jobs must be at least 1 not "{}"'.format(
+                jobs))
+        self.jobs = int(jobs)
+        self.write_stats = write_stats
+        self.config = config
+        self.results = {}
+        return
+
+
+
+    def run(self, action=None, files=None):
+        '''Run the action - 'encrypt', 'decrypt', or 'verify' - against all
+        files.  Failures do not stop the rest of the batch.  Check failed()
+        afterwards.  A file listed more than once, by any path, is only run
+        once under the first name given.
+        '''
+        if action not in self.ACTIONS:
+            raise Exception('Unknown action "{}"'.format(action))
+        files = self._unique(files)
+        self.results = {}
+        sizes = {}
+        for f in files:
+            sizes[f] = os.path.getsize(f)
+            self.results[f] = { 'status' : None, 'size' : sizes[f],
+                                'seconds' : None, 'error' : None,
+                                'stats' : None }
+        jobs = min(self.jobs, len(files))
+        self.log.debug('Running {} on {} files with {} jobs'.format(
+            action, len(files), jobs))
+
+        bar = None
+        if self.showprogress == True:
+            bar = tqdm(total=sum(sizes.values()),
+                       ascii=" >>>>>>>>>=",
+                       unit='B',
+                       unit_scale=True,
+                       desc='{} files'.format(len(files)))
+        try:
+            if jobs <= 1:
+                self._run_serial(action, files, bar)
+            else:
+                self._run_pool(action, files, jobs, bar)
+        finally:
+            if bar is not None: bar.close()
+        return
+
+
+
+    def _unique(self, files):
+        '''Drop files already in the list under the same or another path,
+        keeping the order.  Two workers writing the same output would
+        clobber each other and share one entry in the results.
+        '''
+        seen = {}
+        unique = []
+        for f in files:
+            path = os.path.realpath(f)
+            if path in seen:
+                self.log.warning('Skipping "{}" listed more than once as '
+                                 '"{}"'.format(f, seen[path]))
+                continue
+            seen[path] = f
+            unique.append(f)
+        return unique
+
+
+
+    def _run_serial(self, action, files, bar):
+        '''Run everything within this process.
+        '''
+        callback = None
+        if bar is not None: callback = bar.update
+        crypt = AESCrypt(debug=self.debug,
+                         loglevel=self.loglevel,
+                         progress_callback=callback,
+                         write_stats=self.write_stats,
+                         config=self.config)
+        for f in files:
+            crypt.set_filename(f)
+            start = time.time()
+            try:
+                getattr(crypt, action)()
+                self._set_result(f, 'OK', time.time() - start, None,
+                                 crypt.stats())
+            except Exception as e:
+                self._set_result(f, 'FAILED', time.time() - start, e)
+        return
+
+
+
+    def _run_pool(self, action, files, jobs, bar):
+        '''Hand the files to a pool of worker processes.  A thread drains the
+        progress queue from the workers into the progress bar.  The cores are
+        split between the workers for encrypting segments of each file.
+        '''
+        threads = max(1, (os.cpu_count() or 1) // jobs)
+        queue = None
+        drain = None
+        if bar is not None:
+            queue = multiprocessing.Queue()
+            drain = threading.Thread(target=self._drain, args=(queue, bar))
+            drain.start()
+        try:
+            with ProcessPoolExecutor(max_workers=jobs,
+                                     initializer=_init_worker,
+                                     initargs=(self.debug,
+                                               self.loglevel,
+                                               queue,
+                                               threads,
+                                               self.write_stats,
+                                               self.config)) as pool:
+                futures = {}
+                for f in files:
+                    futures[pool.submit(_run_job, action, f)] = f
+                for future in as_completed(futures):
+                    f = futures[future]
+                    try:
+                        (seconds, stats) = future.result()
+                        self._set_result(f, 'OK', seconds, None, stats)
+                    except Exception as e:
+                        self._set_result(f, 'FAILED', None, e)
+        finally:
+            if queue is not None:
+                queue.put(None)
+                drain.join()
+        return
+
+
+
+    def _drain(self, queue, bar):
+        while True:
+            bytes_amount = queue.get()
+            if bytes_amount == None: break
+            bar.update(bytes_amount)
+        return
+
+
+
+    def _set_result(self, filename, status, seconds, error=None, stats=None):
+        self.results[filename]['status'] = status
+        self.results[filename]['seconds'] = seconds
+        self.results[filename]['stats'] = stats
+        if error != None:
+            self.results[filename]['error'] = str(error)
+            self.log.error('Failed "{}": {}'.format(
+                os.path.basename(filename), error))
+        return
+
+
+
+    def failed(self):
+        '''Return the list of files which failed.
+        '''
+        return [f for f in self.results.keys()
+                if self.results[f]['status'] != 'OK']
+
+
+
+    def report(self):
+        '''Return a report of the status of each file.
+        '''
+        rpt = '\n{}\n'.format('='*76)
+        rpt += '{:<8} {:>15} {:>10}  {}\n'.format('Status', 'Bytes',
+                                                 'Seconds', 'File')
+        rpt += '{:<8} {:>15} {:>10}  {}\n'.format('-'*8, '-'*15, '-'*10, '-'*20)
+        for f in self.results.keys():
+            r = self.results[f]
+            seconds = '-'
+            if r['seconds'] != None: seconds = '{:0.2f}'.format(r['seconds'])
+            rpt += '{:<8} {:>15} {:>10}  {}\n'.format(r['status'], r['size'],
+                                                     seconds,
+                                                     os.path.basename(f))
+            if r['error'] != None:
+                rpt += '{:<8} {}\n'.format('', r['error'])
+        rpt += '{}\n'.format('='*76)
+        rpt += '{} OK, {} FAILED\n'.format(
+            len(self.results) - len(self.failed()), len(self.failed()))
+        return rpt
+
+
+
+    def append_stats_file(self, stats_file=None):
+        '''Append a line of JSON for each file of the last run() to
+        stats_file.  Files which failed have their status and error but no
+        timing.
+        '''
+        with open(stats_file, 'a') as f:
+            for filename in self.results.keys():
+                r = self.results[filename]
+                line = { 'file' : filename, 'status' : r['status'],
+                         'seconds' : r['seconds'], 'error' : r['error'] }
+                if r['stats'] != None: line.update(r['stats'])
+                f.write(json.dumps(line, sort_keys=True) + '\n')
+        f.close()
+        return
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
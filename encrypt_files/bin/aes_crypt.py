@@ -6,23 +6,244 @@
 #=============================================================================#
 
 import os
+import io
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap
 from tqdm import tqdm
-from base64 import b64encode
+from base64 import b64encode, b64decode
 from enc_conf import EncConf
+from enc_header import EncHeader
+from chunk_io import ChunkReader, ChunkWriter
+from cache_io import open_file
+from compression import CompressingReader, DecompressingWriter, should_compress
+from multi_hash import MultiHash, s3_part_size
 from mylog import MyLog
 
+# Ciphers of the segmented format by the name recorded in the header.
+AEADS = { 'AES-GCM' : AESGCM, 'ChaCha20-Poly1305' : ChaCha20Poly1305 }
+
+# The cipher picked by the 'auto' encryption method is benchmarked once per
+# process and kept here.
+_fastest = { 'cipher' : None }
+
+class HashingWriter(object):
+    '''File object wrapper which hashes everything written through it so the
+    checksum of an output file is known without reading it back.  A
+    MultiHash also calculating the sha512 may be passed to calculate other
+    checksums at the same time.
+    '''
+    def __init__(self, fileobj, hasher=None):
+        self._fileobj = fileobj
+        self.method = 'sha512'
+        self.size = 0
+        self._hasher = hasher
+        if hasher == None: self._hasher = MultiHash([self.method])
+        return
+
+    def write(self, data):
+        self._hasher.update(data)
+        self.size += len(data)
+        return self._fileobj.write(data)
+
+    def seen(self, data):
+        '''Hash data already in the file without writing it again.
+        '''
+        self._hasher.update(data)
+        self.size += len(data)
+        return
+
+    def flush(self):
+        return self._fileobj.flush()
+
+    def hexdigest(self):
+        return self._hasher.checksums()[self.method]
+
+    def checksums(self):
+        return self._hasher.checksums()
+
+
+
+class NullWriter(object):
+    '''File object which discards everything written to it.  Used to
+    authenticate a file without writing the plaintext anywhere.
+    '''
+    def write(self, data):
+        return len(data)
+
+
+
+class PhaseTimer(object):
+    '''Add up the seconds and bytes spent in each phase of encrypting or
+    decrypting a file.  Phases are timed on whichever thread runs them, so
+    reading, the cipher, and writing overlap and their seconds added
+    together can be more than the total.
+    '''
+    PHASES = ['kdf', 'read', 'cipher', 'write', 'finalize']
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.nbytes = dict.fromkeys(self.PHASES, 0)
+        self._lock = threading.Lock()
+        return
+
+    def add(self, phase, seconds, nbytes=0):
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.nbytes[phase] += nbytes
+        return
+
+    @contextmanager
+    def phase(self, phase, nbytes=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, nbytes)
+
+    def timed(self, phase, func):
+        '''Return func wrapped to time each call.  The length of the second
+        argument is counted as the bytes handled.
+        '''
+        def wrapper(index, data, *args):
+            with self.phase(phase, len(data)):
+                return func(index, data, *args)
+        return wrapper
+
+
+
+class TimedFile(object):
+    '''File object wrapper which times every read and write against a phase
+    of a PhaseTimer.  Everything else is passed through to the file object.
+    '''
+    def __init__(self, fileobj, timer, phase):
+        self._fileobj = fileobj
+        self._timer = timer
+        self._phase = phase
+        return
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self._fileobj.read(size)
+        self._timer.add(self._phase, time.perf_counter() - start, len(data))
+        return data
+
+    def readinto(self, buf):
+        start = time.perf_counter()
+        n = self._fileobj.readinto(buf)
+        self._timer.add(self._phase, time.perf_counter() - start, n or 0)
+        return n
+
+    def write(self, data):
+        start = time.perf_counter()
+        n = self._fileobj.write(data)
+        self._timer.add(self._phase, time.perf_counter() - start, len(data))
+        return n
+
+
+
 class AESCrypt(object):
-    '''Methods for encrypting and decrypting files using AES-GCM encryption.
-    The encrypted file will have within it at the beginning, tag, salt, and
-    nonce.
+    '''Methods for encrypting and decrypting files using AES-GCM or
+    ChaCha20-Poly1305 encryption.
+
+    FILE FORMATS
+        1    Single stream.  The encrypted file will have within it at the
+             beginning, tag, salt, and nonce followed by one GCM stream
+             over the whole file.
+
+        2    Segmented.  A versioned header is followed by fixed size
+             segments, each with its own nonce and tag.  Segments are
+             encrypted and decrypted in parallel by a pool of threads.
+             See enc_header.py for the layout.
+
+    New files are written in the format set by 'file_format_version' in the
+    configuration file.  The decrypt() method reads both formats.
+
+    CIPHERS
+        Format 1 files are always AES-GCM.  Format 2 files are encrypted with
+        the cipher named by 'encryption_method' in the configuration file,
+        either AES-GCM or ChaCha20-Poly1305, and the cipher is recorded in
+        the header.  ChaCha20-Poly1305 is much faster than AES-GCM on CPUs
+        without AES instructions, or where a VM hides them.  It always uses
+        a 32 byte key and needs a 12 byte nonce.  With 'auto' both are timed
+        on a buffer in memory the first time a file is encrypted in the
+        process and the faster is used.  Decrypting reads the cipher from
+        the header whatever the configuration.
+
+    KEY DERIVATION
+        Format 1 files always derive the key with PBKDF2 for every file.
+        Format 2 files use the 'kdf' setting of the configuration file.  With
+        HKDF the 100,000 round PBKDF2 stretch of the master key happens once
+        per AESCrypt instance and each file key is derived from it with
+        HKDF, which makes small files much cheaper to encrypt in bulk.  The
+        stretched keys are cached by their salt so decrypting a batch of files
+        written by the same run also stretches the master key only once.
+
+    ENVELOPE ENCRYPTION
+        With 'envelope' set in the configuration file the segments of each
+        format 2 file are encrypted with a random data key.  The key derived
+        from the master key only wraps the data key, which is stored in the
+        header.  To change the master key, rewrap() rewrites the wrapped key
+        in the header of each file in place and leaves the segments alone.
+
+    COMPRESSION
+        With 'compression' set in the configuration file, format 2 files are
+        compressed before they are encrypted and the method is recorded in
+        the header.  Samples of each file are read first and files which
+        look already compressed are encrypted as they are.  Streams are
+        always compressed as they cannot be sampled.  decrypt() reads the
+        method from the header whatever the configuration.
 
-    WARNING
-    The decrypt() method expects the file to be in this format with the
-    same number of bytes allocated for each.
+    CHECKPOINTS
+        Large format 2 files are encrypted with a checkpoint.  Every
+        'checkpoint_segments' segments the output is flushed to disk and
+        FILENAME.enc.checkpoint records how many segments are complete along
+        with the header and the device, inode, size, modification time, and
+        change time of the input.  If encrypting stops part way, encrypting
+        the same unchanged file again carries on from the last checkpoint
+        and the checkpoint is removed once the file is done.  Resuming
+        writes the remaining segments with the same key and nonces as
+        before, which is only safe because the plaintext is unchanged, so a
+        file where any of these differ starts over with a new header.  The
+        change time is set by the system on every write, so it catches a
+        file rewritten with its size and modification time kept, such as by
+        'rsync -t', 'tar -x', or 'touch -r'.  Compressed files cannot be
+        resumed and are not checkpointed.  When encrypting fails and there
+        is no checkpoint, such as for a small file cut short by a full disk,
+        the partial output is removed.
+
+    TIMING
+        Each encrypt, decrypt, or verify records in its statistics the
+        seconds spent deriving the key, reading, in the cipher, writing,
+        and finalizing, along with the total and the MB/s of each.  Reads,
+        the cipher, and writes run on their own threads at the same time,
+        so the busiest of them shows what limits the file.  Files read with
+        use_mmap are read by the cipher touching the map and show no reads.
+
+    PAGE CACHE
+        Files of 64 MB or more are opened through cache_io.py, which drops
+        them from the page cache as they are read and written so backing up
+        a large file does not push out what the rest of the host is using.
+        With 'direct_io' set in the configuration file they are read with
+        O_DIRECT instead.
 
     ATTRIBUTES
         debug              Enable debug mode.
@@ -31,6 +252,42 @@ class AESCrypt(object):
 
         showprogress       Show progress via tqdm.
 
+        progress_callback  Optional callable passed the number of bytes read
+                           after each chunk.  Used to report progress when
+                           several files are processed at once.
+
+        threads            Number of threads encrypting or decrypting segments
+                           of a single file.
+                           [DEFAULT: number of cores]
+
+        write_stats        Write the size and checksums of each encrypted
+                           file to FILENAME.enc.stats for create_metadata.
+                           Those in the 'stats_checksums' setting are
+                           calculated as well as the sha512.
+
+        config             EncConf instance to take settings from instead of
+                           reading the configuration file.
+
+        file_stats         Size and SHA512 checksum of the last encrypted
+                           file, hashed while it was written.  Only files in
+                           format 2 are hashed since format 1 rewrites its tag
+                           at the beginning of the file.  Otherwise None.
+
+                           {
+                               'file_size_bytes'      : Size in bytes.
+                               'file_checksum'        : Checksum.
+                               'file_checksum_method' : 'sha512'
+                           }
+
+                           With write_stats any of 'file_md5',
+                           'file_sha256', 'file_crc32c', and 's3_etag'
+                           along with the 's3_part_size' it was calculated
+                           for are added.  The part size depends on the
+                           size of the output, which is only known at the
+                           end, so the s3_etag is calculated for the part
+                           size of a file the size of the input and left
+                           out if the output needs another.
+
     METHODS
         set_filename       Set the filename before performing the encrypt()
                            or decrypt() methods.
@@ -39,25 +296,97 @@ class AESCrypt(object):
 
         decrypt            Decrypt the file.
 
+        verify             Authenticate the file without writing the
+                           plaintext anywhere.
+
+        decrypt_range      Decrypt part of a file in the segmented format
+                           without decrypting the whole file.
+
+        rewrap             Wrap the data key of a file with a new master key.
+
+        encrypt_stream     Encrypt from one file object to another.  Neither
+                           needs to be seekable so pipes work.
+
+        decrypt_stream     Decrypt a stream written by encrypt_stream().
+
+        encrypt_bytes      Encrypt bytes in memory and return the result.
+
+        decrypt_bytes      Decrypt bytes in memory and return the plaintext.
+
+        encrypt_fileobj    Encrypt from one file object to another in the
+                           configured format where the output allows.
+
+        decrypt_fileobj    Decrypt from one file object to another.
+
+        derive_key         Return a key for another purpose derived from the
+                           master key.
+
+        stats              Return the statistics and timing of the last file
+                           without any key material.
+
+        append_stats_file  Append stats() as a line of JSON to a file.
+
     '''
-    def __init__(self, debug=False, loglevel='WARNING', showprogress=False):
+    PBKDF2_ITERATIONS = 100000
+    STATS_EXTENSION = '.stats'
+    CHECKPOINT_EXTENSION = '.checkpoint'
+    # Key in the stats file of each of the 'stats_checksums'.
+    STATS_CHECKSUMS = { 'md5' : 'file_md5', 'sha256' : 'file_sha256',
+                        'crc32c' : 'file_crc32c', 's3_etag' : 's3_etag' }
+    SECRET_STATS = ['key', 'salt', 'nonce', 'tag']
+    TIMING_STATS = ([phase + '_seconds' for phase in PhaseTimer.PHASES] +
+                    ['total_seconds', 'mbps', 'read_mbps', 'cipher_mbps',
+                     'write_mbps'])
+
+    def __init__(self, debug=False, loglevel='WARNING', showprogress=False,
+                 progress_callback=None, threads=None, write_stats=False,
+                 config=None):
         self.debug = debug
         self.loglevel = loglevel
         program=__class__.__name__
         l = MyLog(program=program, debug=debug, loglevel=loglevel)
         self.log = l.log
         self.showprogress = showprogress
+        self.progress_callback = progress_callback
+        if threads == None: threads = os.cpu_count() or 1
+        self.threads = max(1, int(threads))
+        self.write_stats = write_stats
+        self.file_stats = None
 
         self._filename = None
         self._salt_size = 16
-        self._stats = { 'salt' : None, 'nonce' : None, 'key' : None, 'tag' : None,
-                        'infile_size' : 0, 'outfile_size' : 0 }
-        cfg = EncConf(debug=self.debug, loglevel=self.loglevel)
-        cfg.read()
+        self._master_key = None
+        self._kdf_salt = None
+        self._stretched_keys = {}
+        self._stats = { 'format' : None, 'salt' : None, 'nonce' : None,
+                        'key' : None, 'tag' : None, 'segments' : None,
+                        'cipher' : None, 'kdf' : None, 'compression' : None,
+                        'infile_size' : 0, 'outfile_size' : 0,
+                        'action' : None, 'file' : None }
+        self._timer = PhaseTimer()
+        cfg = config
+        if cfg == None:
+            cfg = EncConf(debug=self.debug, loglevel=self.loglevel)
+            cfg.read()
         self._keyfile = cfg.keyfile
         self._chunk_size = int(cfg.chunk_size_kbytes * 1024)
         self._key_size = int(cfg.key_size_bytes)
         self._nonce_size = int(cfg.nonce_size_bytes)
+        self._format_version = int(cfg.file_format_version)
+        self._segment_size = int(cfg.segment_size_kbytes * 1024)
+        self._kdf = cfg.kdf
+        self._encryption_method = cfg.encryption_method
+        self._io_buffers = int(cfg.io_buffers)
+        self._use_mmap = cfg.use_mmap
+        self._auto_chunk_size = cfg.auto_chunk_size
+        self._compression = cfg.compression
+        self._compression_max_entropy = cfg.compression_max_entropy
+        self._checkpoint_segments = int(cfg.checkpoint_segments)
+        self._envelope = cfg.envelope
+        self._direct_io = cfg.direct_io
+        self._stats_checksums = cfg.stats_checksums
+        self._mp_threshold = cfg.mp_threshold
+        self._mp_chunksize = cfg.mp_chunksize
         return
 
 
@@ -74,47 +403,127 @@ class AESCrypt(object):
 
 
 
-    def _generate_key(self, master_key: bytes, salt: bytes) -> bytes:
+    def _generate_key(self, master_key: bytes, salt: bytes,
+                      length: int = None) -> bytes:
         '''Take a master key and salt and return a key for encryption or
-        decryption.
+        decryption.  The key size from the configuration is used unless a
+        length is passed.
         '''
+        if length == None: length = self._key_size
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
-            length=self._key_size,
+            length=length,
             salt=salt,
-            iterations=100000,
+            iterations=self.PBKDF2_ITERATIONS,
             backend=default_backend()
         )
         return kdf.derive(master_key)
 
 
 
+    def _derive_file_key(self, header=None, master_key=None) -> bytes:
+        '''Return the key for a segmented file using the key derivation
+        recorded in its header.  With envelope encryption this is the key
+        which wraps the data key.  The configured master key is used unless
+        another is passed.
+        '''
+        if master_key == None: master_key = self._read_master_key()
+        if header.kdf == 'PBKDF2':
+            return self._generate_key(master_key, header.salt, header.key_size)
+        if not (master_key, header.kdf_salt) in self._stretched_keys:
+            self.log.debug('Stretching master key')
+            self._stretched_keys[(master_key, header.kdf_salt)] = (
+                self._generate_key(master_key, header.kdf_salt, 32))
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=header.key_size,
+            salt=header.salt,
+            info=b'encrypt_files segmented file key',
+            backend=default_backend()
+        )
+        return hkdf.derive(self._stretched_keys[(master_key, header.kdf_salt)])
+
+
+
+    def _file_key(self, header=None) -> bytes:
+        '''Return the key the segments of a file are encrypted with.  With
+        envelope encryption a new header without a wrapped key is given a
+        random data key, otherwise the data key is unwrapped.
+        '''
+        key = self._derive_file_key(header)
+        if not header.envelope(): return key
+        if header.wrapped_key == b'':
+            data_key = os.urandom(header.key_size)
+            header.wrapped_key = aes_key_wrap(key, data_key)
+            return data_key
+        try:
+            return aes_key_unwrap(key, header.wrapped_key)
+        except InvalidUnwrap:
+            raise Exception('Cannot unwrap the data key.  Wrong master key?')
+
+
+
+    def derive_key(self, info=None, length=32) -> bytes:
+        '''Return a key derived from the master key with HKDF-SHA256 for a
+        purpose other than encrypting files, named by the info bytes.  The
+        same info always gives the same key for the same master key.
+        '''
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=length,
+            salt=None,
+            info=info,
+            backend=default_backend()
+        )
+        return hkdf.derive(self._read_master_key())
+
+
+
     def _read_master_key(self):
-        '''Read the master key and convert it to bytes.
+        '''Read the master key and convert it to bytes.  The key is read once
+        and kept for the life of the instance.
         '''
-        if os.path.getsize(self._keyfile) == 0:
+        if self._master_key != None: return self._master_key
+        self._master_key = self._read_key_file(self._keyfile)
+        return self._master_key
+
+
+
+    def _read_key_file(self, keyfile=None):
+        '''Read a master key from a file and convert it to bytes.
+        '''
+        if os.path.getsize(keyfile) == 0:
             raise Exception(
-                'Master key file is empty "{}"'.format(self._keyfile))
-        with open(self._keyfile, 'r') as f:
+                'Master key file is empty "{}"'.format(keyfile))
+        with open(keyfile, 'r') as f:
             key = f.read().strip()
         f.close()
-        master_key_bytes = key.encode("utf-8")
-        return master_key_bytes
+        return key.encode("utf-8")
 
 
 
-    def _setup_progressbar(self):
+    def _setup_progressbar(self, desc=None):
         '''Enable the progress bar based on filesize.
         '''
+        if desc == None: desc = os.path.basename(self._filename)
         bar = tqdm(total=self._stats['infile_size'],
                    ascii=" >>>>>>>>>=",
                    unit='B',
                    unit_scale=True,
-                   desc=os.path.basename(self._filename))
+                   desc=desc)
         return bar
 
 
 
+    def _progress(self, bar=None, nbytes=0):
+        '''Update the progress bar and progress callback if either is set.
+        '''
+        if bar is not None: bar.update(nbytes)
+        if self.progress_callback: self.progress_callback(nbytes)
+        return
+
+
+
     def _print_stats(self):
         '''Print the internal statistics of the file from __init__().  This
         includes salt, nonce, key, etc.
@@ -128,6 +537,66 @@ class AESCrypt(object):
 
 
 
+    def _start_timing(self, action=None, filename=None):
+        '''Start timing a new file.  Streams are named '-'.
+        '''
+        self._timer = PhaseTimer()
+        self._stats['action'] = action
+        self._stats['file'] = filename
+        for k in self.TIMING_STATS: self._stats.pop(k, None)
+        return
+
+
+
+    def _finish_timing(self):
+        '''Add the seconds spent in each phase, the total, and the MB/s of
+        each to the statistics.  MB/s is left as None for a phase which took
+        no time.
+        '''
+        timer = self._timer
+        total = time.perf_counter() - timer.start
+        for phase in PhaseTimer.PHASES:
+            self._stats[phase + '_seconds'] = round(timer.seconds[phase], 6)
+        self._stats['total_seconds'] = round(total, 6)
+        nbytes = self._stats['infile_size']
+        if nbytes == None: nbytes = timer.nbytes['read']
+        self._stats['mbps'] = self._mbps(nbytes, total)
+        for phase in ['read', 'cipher', 'write']:
+            self._stats[phase + '_mbps'] = self._mbps(timer.nbytes[phase],
+                                                      timer.seconds[phase])
+        return
+
+
+
+    def _mbps(self, nbytes, seconds):
+        if seconds <= 0: return None
+        return round(nbytes / seconds / 1024 ** 2, 2)
+
+
+
+    def stats(self):
+        '''Return the statistics of the last file processed, including the
+        timing of each phase, without the key, salt, nonce, or tag.
+        '''
+        stats = {}
+        for k in self._stats.keys():
+            if k in self.SECRET_STATS: continue
+            stats[k] = self._stats[k]
+        return stats
+
+
+
+    def append_stats_file(self, stats_file=None):
+        '''Append the statistics of the last file processed to stats_file as
+        a line of JSON.
+        '''
+        with open(stats_file, 'a') as f:
+            f.write(json.dumps(self.stats(), sort_keys=True) + '\n')
+        f.close()
+        return
+
+
+
     def encrypt(self):
         '''Encrypt the file set by set_filename() method.  The encrypted file
         will have '.enc' appended to the name and will end up in the same
@@ -139,6 +608,145 @@ class AESCrypt(object):
         output_file = self._filename + '.enc'
         self.log.debug('Encrypting "{}"'.format(os.path.basename(input_file)))
 
+        # Set up the progress bar.
+        self._start_timing('encrypt', input_file)
+        self._stats['infile_size'] = os.path.getsize(input_file)
+        bar = None
+        if self.showprogress == True: bar = self._setup_progressbar()
+
+        # Large files are kept from filling the page cache.  The output is
+        # about the size of the input.
+        size = self._stats['infile_size']
+        self.file_stats = None
+
+        # A failed run must not leave an output which looks complete, such
+        # as one cut short by a full disk.  The output is only kept along
+        # with a checkpoint which says how much of it can be resumed.
+        writing = False
+        try:
+            if self._format_version == 1:
+                writing = True
+                with open_file(output_file, 'wb', size) as out_file:
+                    with open_file(input_file, 'rb', size,
+                                   self._direct_io) as in_file:
+                        self._encrypt_single(in_file, out_file, bar)
+                    in_file.close()
+                out_file.close()
+            else:
+                compression = self._compression_for_file(input_file)
+                checkpoint = None
+                if (compression == 'none' and self._checkpoint_segments > 0
+                    and self._stats['infile_size'] >
+                        self._checkpoint_segments * self._segment_size):
+                    checkpoint = output_file + self.CHECKPOINT_EXTENSION
+                # A checkpoint is only any use along with the output it
+                # describes.
+                stale = output_file + self.CHECKPOINT_EXTENSION
+                if os.path.exists(stale) and (checkpoint == None or
+                                              not os.path.exists(output_file)):
+                    os.remove(stale)
+                mode = 'wb'
+                if checkpoint != None and os.path.exists(checkpoint):
+                    mode = 'r+b'
+                writing = True
+                with open_file(output_file, mode, size) as out_file:
+                    with open_file(input_file, 'rb', size,
+                                   self._direct_io) as in_file:
+                        self._encrypt_segmented(in_file, out_file, bar,
+                                                compression, checkpoint)
+                    in_file.close()
+                out_file.close()
+                if checkpoint != None: os.remove(checkpoint)
+        except BaseException:
+            if (writing and os.path.exists(output_file) and
+                not os.path.exists(output_file + self.CHECKPOINT_EXTENSION)):
+                self.log.debug('Removing partial "{}"'.format(
+                    os.path.basename(output_file)))
+                os.remove(output_file)
+            if bar is not None: bar.close()
+            raise
+
+        if bar is not None: bar.close()
+        self._stats['outfile_size'] = os.path.getsize(output_file)
+        if self.write_stats == True and self.file_stats != None:
+            self._write_stats_file(output_file)
+        self._finish_timing()
+        if self.debug: self.log.debug('{}'.format(self._print_stats()))
+        return
+
+
+
+    def _write_stats_file(self, output_file):
+        '''Write the size and checksum of the encrypted file next to it.  The
+        modification time is included so a stats file left over from an
+        older copy of the file is not trusted.
+        '''
+        stats = dict(self.file_stats)
+        stats['file_mtime_ns'] = os.stat(output_file).st_mtime_ns
+        stats_file = output_file + self.STATS_EXTENSION
+        self.log.debug('Writing "{}"'.format(os.path.basename(stats_file)))
+        with open(stats_file, 'w') as f:
+            f.write(json.dumps(stats, indent=4, sort_keys=True))
+        f.close()
+        return
+
+
+
+    def _compression_for_file(self, filename=None):
+        '''Return the configured compression method if the file looks
+        compressible, otherwise 'none'.
+        '''
+        if self._compression == 'none': return 'none'
+        if should_compress(filename, self._compression_max_entropy):
+            return self._compression
+        self.log.debug('Not compressing "{}"'.format(os.path.basename(filename)))
+        return 'none'
+
+
+
+    def _size_for_file(self, configured=None, file_size=None, parts=1):
+        '''Return the chunk or segment size to use for a file.  Unless
+        auto_chunk_size is set in the configuration this is the configured
+        size.  Otherwise it is the smallest power of two, from 64 KB up to
+        the configured size, which splits the file into no more than 'parts'
+        pieces.  Small files then do not allocate large buffers and, with
+        parts set to the number of threads, mid sized files in the segmented
+        format keep every thread busy.
+        '''
+        if self._auto_chunk_size != True or file_size == None:
+            return configured
+        size = 64 * 1024
+        while size < configured and size * parts < file_size: size *= 2
+        return min(size, configured)
+
+
+
+    def _read_chunks(self, in_file, chunk_size):
+        '''Return an iterator over chunks of in_file for the single stream
+        format.
+        '''
+        return ChunkReader(in_file, chunk_size, self._io_buffers,
+                           use_mmap=self._use_mmap)
+
+
+
+    def _chunk_buffer_size(self, chunk_size):
+        '''Size of an output buffer for update_into().  The cipher may need
+        up to one AES block less one byte more than the chunk.
+        '''
+        return chunk_size + algorithms.AES.block_size // 8 - 1
+
+
+
+    def _encrypt_single(self, in_file, out_file, bar):
+        '''Encrypt in_file as a single GCM stream (file format 1) to
+        out_file, which must be seekable as the tag is written at the
+        beginning once the rest is done.
+        '''
+        self._stats['format'] = 1
+        self._stats['cipher'] = 'AES-GCM'
+        self._stats['kdf'] = 'PBKDF2'
+
         # Generate a random salt and nonce
         salt = os.urandom(self._salt_size)
         nonce = os.urandom(self._nonce_size)
@@ -146,8 +754,9 @@ class AESCrypt(object):
         self._stats['nonce'] = b64encode(nonce).decode('utf-8')
 
         # Derive a key from the master key and salt
-        master_key = self._read_master_key()
-        key = self._generate_key(master_key, salt)
+        with self._timer.phase('kdf'):
+            master_key = self._read_master_key()
+            key = self._generate_key(master_key, salt)
         self._stats['key'] = b64encode(key).decode('utf-8')
 
         # Initialize cipher with AES alrorithm and GCM mode (with the nonce)
@@ -159,43 +768,404 @@ class AESCrypt(object):
             backend=default_backend()
         ).encryptor()
 
-        # Set up the progress bar.
-        self._stats['infile_size'] = os.path.getsize(input_file)
-        if self.showprogress == True: bar = self._setup_progressbar()
+        chunk_size = self._size_for_file(self._chunk_size,
+                                         self._stats['infile_size'])
 
         # Set aside the first 16 bytes for the encryption tag and then
         # write salt and nonce to the beginning of the output file
-        with open(output_file, 'wb') as out_file:
-            out_file.write(b'\x00' * 16)  # Reserved for encyryptor tag.
-            out_file.write(salt)
-            out_file.write(nonce)
-
-            # Encrypt the file in chunks
-            with open(input_file, 'rb') as in_file:
-                while chunk := in_file.read(self._chunk_size):
-                    encrypted_chunk = encryptor.update(chunk)
-                    out_file.write(encrypted_chunk)
-                    if self.showprogress == True: bar.update(len(chunk))
-
-
-            # Finalize encryption and write the authentication tag to the
-            # beginning of the file.
-            out_file.write(encryptor.finalize())
+        start = out_file.tell()
+        out_file.write(b'\x00' * 16)  # Reserved for encyryptor tag.
+        out_file.write(salt)
+        out_file.write(nonce)
+
+        # Encrypt the file in chunks.  The next chunk is read and the last
+        # one written on other threads while the cipher runs.  Input and
+        # output buffers are allocated once and reused.
+        with ChunkWriter(TimedFile(out_file, self._timer, 'write'),
+                         self._io_buffers,
+                         self._chunk_buffer_size(chunk_size)) as writer:
+            for chunk in self._read_chunks(
+                    TimedFile(in_file, self._timer, 'read'), chunk_size):
+                buf = writer.buffer()
+                with self._timer.phase('cipher', len(chunk)):
+                    n = encryptor.update_into(chunk, buf)
+                writer.write_buffer(buf, n)
+                self._progress(bar, len(chunk))
+
+            # Finalize encryption
+            with self._timer.phase('finalize'):
+                writer.write(encryptor.finalize())
+                writer.finish()
+
+        # Write the authentication tag to the beginning of the file and
+        # leave the file positioned at its end.
+        with self._timer.phase('finalize'):
             self._stats['tag'] = b64encode(encryptor.tag).decode('utf-8')
-            out_file.seek(0)
+            end = out_file.tell()
+            out_file.seek(start)
             out_file.write(encryptor.tag)
-            in_file.close()
-        if self.showprogress == True: bar.close()
-        out_file.close()
-        self._stats['outfile_size'] = os.path.getsize(output_file)
+            out_file.seek(end)
+        return
+
+
+
+    def encrypt_stream(self, in_fileobj=None, out_fileobj=None):
+        '''Encrypt everything read from in_fileobj and write it to
+        out_fileobj in the segmented format (file format 2) whatever the
+        configured format.  Segments are written in order with their tags
+        after them, and the end of the input is found by reading ahead, so
+        neither file object needs to be seekable.  For example:
+
+            tar -c DIR | aes_encrypt.py - | aws s3 cp - s3://BUCKET/DIR.tar.enc
+        '''
+        self.log.debug('Encrypting stream')
+        self._start_timing('encrypt_stream', '-')
+        self._stats['infile_size'] = None
+        bar = None
+        if self.showprogress == True: bar = self._setup_progressbar('stream')
+        self._encrypt_segmented(in_fileobj, out_fileobj, bar, self._compression)
+        if bar is not None: bar.close()
+        self._stats['outfile_size'] = self.file_stats['file_size_bytes']
+        self._finish_timing()
         if self.debug: self.log.debug('{}'.format(self._print_stats()))
         return
 
 
 
+    def _encrypt_segmented(self, in_file, out_file, bar, compression='none',
+                           checkpoint=None):
+        '''Encrypt in_file in segments (file format 2) to out_file,
+        compressing it first unless compression is 'none'.  With checkpoint
+        set to the name of a checkpoint file, progress is saved there and a
+        previous run recorded in it is resumed.  out_file must then be opened
+        for both reading and writing if the checkpoint exists.
+        '''
+        self._stats['format'] = EncHeader.VERSION
+        in_file = TimedFile(in_file, self._timer, 'read')
+        resume = None
+        if checkpoint != None: resume = self._read_checkpoint(checkpoint, in_file)
+        if resume != None:
+            (header, done) = resume
+        else:
+            (header, done) = (self._new_header(compression), 0)
+        self._stats['cipher'] = header.cipher
+        self._stats['kdf'] = header.kdf
+        self._stats['compression'] = header.compression
+        self._stats['salt'] = b64encode(header.salt).decode('utf-8')
+        self._stats['nonce'] = b64encode(header.nonce_prefix).decode('utf-8')
+
+        # Derive a key from the master key and salt
+        with self._timer.phase('kdf'):
+            key = self._file_key(header)
+        self._stats['key'] = b64encode(key).decode('utf-8')
+
+        # The header, apart from any wrapped key, is authenticated along with
+        # every segment.
+        aad = header.aad()
+        aead = AEADS[header.cipher](key)
+        def encrypt_segment(index, segment, last):
+            return aead.encrypt(header.segment_nonce(index, last), segment, aad)
+
+        # Progress counts the bytes read before they are compressed.
+        progress = True
+        if compression != 'none':
+            in_file = CompressingReader(in_file, compression,
+                                        lambda n: self._progress(bar, n))
+            progress = False
+
+        # The ciphertext is hashed on its way out.  When resuming, the
+        # segments already written are hashed and the rest of the output
+        # thrown away.
+        hasher = self._output_hasher()
+        writer = HashingWriter(TimedFile(out_file, self._timer, 'write'),
+                               hasher)
+        if done > 0:
+            done = self._resume(in_file, out_file, writer, header, aead, done)
+            self._progress(bar, done * header.segment_size)
+        else:
+            if resume != None:
+                out_file.seek(0)
+                out_file.truncate()
+            writer.write(header.pack())
+
+        save = None
+        if checkpoint != None:
+            save = functools.partial(self._save_checkpoint, out_file,
+                                     checkpoint, in_file, header)
+            save(done)
+        self._stats['segments'] = self._process_segments(
+            in_file, writer, encrypt_segment, header.segment_size, bar,
+            progress, done, save)
+        checksums = writer.checksums()
+        self.file_stats = { 'file_size_bytes' : writer.size,
+                            'file_checksum' : checksums[writer.method],
+                            'file_checksum_method' : writer.method }
+        for method in checksums.keys():
+            if method in self.STATS_CHECKSUMS:
+                self.file_stats[self.STATS_CHECKSUMS[method]] = checksums[method]
+        if 's3_etag' in checksums:
+            part_size = s3_part_size(writer.size, self._mp_threshold,
+                                     self._mp_chunksize)
+            if part_size == hasher.part_size:
+                self.file_stats['s3_part_size'] = part_size
+            else:
+                del self.file_stats['s3_etag']
+        return
+
+
+
+    def _output_hasher(self):
+        '''Return the MultiHash for the output of _encrypt_segmented().  The
+        checksums other than the sha512 are only calculated when they are
+        written to a stats file.
+        '''
+        methods = ['sha512']
+        size = self._stats['infile_size']
+        if self.write_stats == True:
+            methods += self._stats_checksums
+            if size == None and 's3_etag' in methods: methods.remove('s3_etag')
+        return MultiHash(methods, size, self._mp_threshold, self._mp_chunksize)
+
+
+
+    def _new_header(self, compression='none'):
+        '''Return the header for a new file in format 2.
+        '''
+        # Generate a random salt and nonce prefix for the segment nonces.  The
+        # salt for stretching the master key is shared by every file.
+        if self._kdf == 'HKDF' and self._kdf_salt == None:
+            self._kdf_salt = os.urandom(self._salt_size)
+        cipher = self._cipher()
+        key_size = self._key_size
+        if cipher == 'ChaCha20-Poly1305': key_size = 32
+        flags = 0
+        if self._envelope: flags |= EncHeader.FLAG_ENVELOPE
+        return EncHeader(cipher=cipher,
+                         kdf=self._kdf,
+                         flags=flags,
+                         key_size=key_size,
+                         salt=os.urandom(self._salt_size),
+                         nonce_size=self._nonce_size,
+                         nonce_prefix=os.urandom(
+                             self._nonce_size - EncHeader.COUNTER_SIZE),
+                         segment_size=self._size_for_file(
+                             self._segment_size,
+                             self._stats['infile_size'],
+                             self.threads),
+                         kdf_salt=self._kdf_salt or b'',
+                         compression=compression)
+
+
+
+    def _cipher(self):
+        '''Return the name of the cipher for new format 2 files.
+        '''
+        method = self._encryption_method
+        if method == 'auto':
+            if self._nonce_size != 12: return 'AES-GCM'
+            if _fastest['cipher'] == None:
+                _fastest['cipher'] = self._benchmark_ciphers()
+            return _fastest['cipher']
+        if method not in AEADS: return 'AES-GCM'
+        if method == 'ChaCha20-Poly1305' and self._nonce_size != 12:
+            raise Exception('ChaCha20-Poly1305 needs a 12 byte nonce not {}'.format(
+                self._nonce_size))
+        return method
+
+
+
+    def _benchmark_ciphers(self, size=1024 * 1024, rounds=4):
+        '''Time each cipher encrypting a buffer in memory.
+
+        RETURN
+                Name of the fastest cipher.
+        '''
+        # Throwaway keys, so reusing the nonce does no harm.
+        data = bytes(size)
+        nonce = bytes(12)
+        fastest = None
+        for name in AEADS.keys():
+            aead = AEADS[name](os.urandom(32))
+            aead.encrypt(nonce, data[:4096], None)
+            start = time.perf_counter()
+            for i in range(rounds):
+                aead.encrypt(nonce, data, None)
+            seconds = time.perf_counter() - start
+            self.log.debug('{} encrypts at {:0.1f} MB/s'.format(
+                name, size * rounds / seconds / 1024 ** 2))
+            if fastest == None or seconds < fastest[1]:
+                fastest = (name, seconds)
+        self.log.info('Using the faster cipher {}'.format(fastest[0]))
+        return fastest[0]
+
+
+
+    def _read_checkpoint(self, checkpoint=None, in_file=None):
+        '''Read a checkpoint left by an earlier run.
+
+        RETURN
+                (header, segments done) if the checkpoint belongs to the
+                unchanged input file, otherwise None.
+        '''
+        if not os.path.exists(checkpoint): return None
+        with open(checkpoint, 'r') as f:
+            saved = json.load(f)
+        f.close()
+        st = os.fstat(in_file.fileno())
+        header = EncHeader()
+        header.read(io.BytesIO(b64decode(saved['header'])))
+        if (saved['infile_size'] != st.st_size or
+            saved['infile_mtime_ns'] != st.st_mtime_ns or
+            saved.get('infile_ctime_ns') != st.st_ctime_ns or
+            saved.get('infile_dev') != st.st_dev or
+            saved.get('infile_ino') != st.st_ino or
+            saved['segments'] * header.segment_size >= st.st_size):
+            self.log.warning('Input changed since checkpoint "{}".  '
+                             'Starting over.'.format(checkpoint))
+            return (self._new_header(), 0)
+        self.log.info('Resuming "{}" from segment {}'.format(
+            os.path.basename(in_file.name), saved['segments']))
+        return (header, saved['segments'])
+
+
+
+    def _save_checkpoint(self, out_file, checkpoint, in_file, header,
+                         segments):
+        '''Flush the output to disk and then record the segments done.
+        '''
+        out_file.flush()
+        os.fsync(out_file.fileno())
+        self._write_checkpoint(checkpoint, in_file, header, segments)
+        return
+
+
+
+    def _write_checkpoint(self, checkpoint=None, in_file=None, header=None,
+                          segments=0):
+        '''Record that the first segments of the output are on disk.  The
+        checkpoint is replaced in one step so it is never half written.
+        '''
+        st = os.fstat(in_file.fileno())
+        saved = { 'header' : b64encode(header.pack()).decode('utf-8'),
+                  'segments' : segments,
+                  'infile_size' : st.st_size,
+                  'infile_mtime_ns' : st.st_mtime_ns,
+                  'infile_ctime_ns' : st.st_ctime_ns,
+                  'infile_dev' : st.st_dev,
+                  'infile_ino' : st.st_ino }
+        with open(checkpoint + '.tmp', 'w') as f:
+            f.write(json.dumps(saved, indent=4, sort_keys=True))
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+        os.replace(checkpoint + '.tmp', checkpoint)
+        self.log.debug('Checkpoint at segment {}'.format(segments))
+        return
+
+
+
+    def _resume(self, in_file, out_file, writer, header, aead, done):
+        '''Position both files after the segments already done.  The output
+        up to there is hashed and the last segment done is authenticated.
+
+        RETURN
+                Number of segments to carry on from.  0 if the output is not
+                as the checkpoint says and everything must be done again.
+        '''
+        block_size = header.segment_size + header.TAG_SIZE
+        offset = header.size() + done * block_size
+        out_file.seek(offset - block_size)
+        try:
+            aead.decrypt(header.segment_nonce(done - 1),
+                         out_file.read(block_size), header.aad())
+        except InvalidTag:
+            self.log.warning('Output does not match the checkpoint.  '
+                             'Starting over.')
+            out_file.seek(0)
+            out_file.truncate()
+            writer.write(header.pack())
+            return 0
+        out_file.seek(0)
+        remaining = offset
+        while remaining > 0:
+            data = out_file.read(min(remaining, 16 * 1024 * 1024))
+            writer.seen(data)
+            remaining -= len(data)
+        out_file.truncate(offset)
+        in_file.seek(done * header.segment_size)
+        return done
+
+
+
+    def _process_segments(self, in_file, out_file, func, block_size, bar,
+                          progress=True, start=0, checkpoint=None):
+        '''Read in_file in blocks of block_size and run func(index, block,
+        last) on each block in a pool of threads.  Results are written to
+        out_file in order.  At most two blocks per thread are held in memory.
+        Progress is reported for each block read unless progress is False.
+        Block numbers begin at start.
+
+        With checkpoint set, every 'checkpoint_segments' blocks the output is
+        flushed and checkpoint(blocks written) is called.  The last block is
+        never included so a resumed file always has a last block to write.
+
+        The next block is always read before the current one is handed off so
+        the last block is known without needing the size of the input.  Blocks
+        are written on their own thread so reading carries on meanwhile.
+
+        RETURN
+                Number of segments processed.
+        '''
+        func = self._timer.timed('cipher', func)
+        pending = deque()
+        index = start
+        written = start
+        with ThreadPoolExecutor(max_workers=self.threads) as pool, \
+             ChunkWriter(out_file, self._io_buffers) as writer:
+            block = self._read_block(in_file, block_size)
+            while True:
+                next_block = self._read_block(in_file, block_size)
+                last = len(next_block) == 0
+                pending.append(pool.submit(func, index, block, last))
+                if progress: self._progress(bar, len(block))
+                while len(pending) > 2 * self.threads:
+                    writer.write(pending.popleft().result())
+                    written += 1
+                    if (checkpoint != None and
+                        written % self._checkpoint_segments == 0):
+                        writer.flush()
+                        checkpoint(written)
+                if last: break
+                block = next_block
+                index += 1
+            with self._timer.phase('finalize'):
+                while len(pending) > 0:
+                    writer.write(pending.popleft().result())
+                writer.finish()
+        return index + 1 - start
+
+
+
+    def _read_block(self, in_file, size):
+        '''Read exactly size bytes unless the end of the file is reached.
+        '''
+        block = in_file.read(size)
+        if len(block) in (0, size): return block
+        parts = [block]
+        remaining = size - len(block)
+        while remaining > 0:
+            part = in_file.read(remaining)
+            if not part: break
+            parts.append(part)
+            remaining -= len(part)
+        return b''.join(parts)
+
+
+
     def decrypt(self):
         '''Decrypt the file set by set_filename() method.  The file must end
-        in '.enc'.  The end result will end up in the same directory.
+        in '.enc'.  The end result will end up in the same directory.  Both
+        the single stream and the segmented file formats are understood.
         '''
         if self._filename == None:
             raise Exception('Set filename with set_filename() method first')
@@ -206,50 +1176,426 @@ class AESCrypt(object):
         output_file = basename
         self.log.debug('Decrypting "{}"'.format(os.path.basename(input_file)))
 
+        self._start_timing('decrypt', input_file)
         self._stats['infile_size'] = os.path.getsize(input_file)
+        bar = None
         if self.showprogress == True: bar = self._setup_progressbar()
 
-        with open(input_file, 'rb') as in_file:
-            # Read salt, nonce, and tag from the input file
-            tag = in_file.read(16)
-            salt = in_file.read(self._salt_size)
-            nonce = in_file.read(self._nonce_size)
-            self._stats['tag'] = b64encode(tag).decode('utf-8')
-            self._stats['salt'] = b64encode(salt).decode('utf-8')
-            self._stats['nonce'] = b64encode(nonce).decode('utf-8')
-
-            # Derive the same key using the master key and salt
-            master_key = self._read_master_key()
-            key = self._generate_key(master_key, salt)
-            self._stats['key'] = b64encode(key).decode('utf-8')
-
-            # Initialize decipher with AES alrorithm and GCM mode (with the nonce)
-            # backend=default_backend() normally implies use of the normal
-            # cryptographic backend - i.e. openssl
-            decryptor = Cipher(
-                algorithms.AES(key),
-                modes.GCM(nonce, tag),
-                backend=default_backend()
-            ).decryptor()
-
-            # Decrypt the file in chunks
-            with open(output_file, 'wb') as out_file:
-                while chunk := in_file.read(self._chunk_size):
-                    decrypted_chunk = decryptor.update(chunk)
-                    out_file.write(decrypted_chunk)
-                    if self.showprogress == True: bar.update(len(chunk))
-
-                # Finalize decryption (verifies integrity)
-                decryptor.finalize()
+        size = self._stats['infile_size']
+        with open_file(input_file, 'rb', size, self._direct_io) as in_file:
+            with open_file(output_file, 'wb', size) as out_file:
+                self._decrypt_file(in_file, out_file, bar)
             out_file.close()
+        in_file.close()
         self._stats['outfile_size'] = os.path.getsize(output_file)
-        if self.showprogress == True: bar.close()
+        if bar is not None: bar.close()
+        self._finish_timing()
+        if self.debug: self.log.debug('{}'.format(self._print_stats()))
+        return
+
+
+
+    def verify(self):
+        '''Authenticate the file set by set_filename() method by decrypting
+        it and throwing the plaintext away.  Nothing is written to disk.  An
+        exception is raised if the file fails authentication.
+        '''
+        if self._filename == None:
+            raise Exception('Set filename with set_filename() method first')
+        input_file = self._filename
+        self.log.debug('Verifying "{}"'.format(os.path.basename(input_file)))
+
+        self._start_timing('verify', input_file)
+        self._stats['infile_size'] = os.path.getsize(input_file)
+        bar = None
+        if self.showprogress == True: bar = self._setup_progressbar()
+
+        with open_file(input_file, 'rb', direct=self._direct_io) as in_file:
+            self._decrypt_file(in_file, NullWriter(), bar)
         in_file.close()
+        self._stats['outfile_size'] = 0
+        if bar is not None: bar.close()
+        self._finish_timing()
         if self.debug: self.log.debug('{}'.format(self._print_stats()))
         return
 
 
 
+    def _decrypt_file(self, in_file, out_file, bar):
+        '''Decrypt a seekable in_file in either file format to out_file,
+        starting from the current position of in_file.
+        '''
+        # Files in the segmented format start with a magic number.
+        start = in_file.tell()
+        segmented = EncHeader().is_segmented(in_file.read(len(EncHeader.MAGIC)))
+        in_file.seek(start)
+        if segmented:
+            self._decrypt_segmented(in_file, out_file, bar)
+        else:
+            self._decrypt_single(in_file, out_file, bar)
+        return
+
+
+
+    def _decrypt_single(self, in_file, out_file, bar):
+        '''Decrypt a file in the single stream format (file format 1).
+        '''
+        self._stats['format'] = 1
+        self._stats['cipher'] = 'AES-GCM'
+        self._stats['kdf'] = 'PBKDF2'
+
+        # Read salt, nonce, and tag from the input file
+        tag = in_file.read(16)
+        salt = in_file.read(self._salt_size)
+        nonce = in_file.read(self._nonce_size)
+        self._stats['tag'] = b64encode(tag).decode('utf-8')
+        self._stats['salt'] = b64encode(salt).decode('utf-8')
+        self._stats['nonce'] = b64encode(nonce).decode('utf-8')
+
+        # Derive the same key using the master key and salt
+        with self._timer.phase('kdf'):
+            master_key = self._read_master_key()
+            key = self._generate_key(master_key, salt)
+        self._stats['key'] = b64encode(key).decode('utf-8')
+
+        # Initialize decipher with AES alrorithm and GCM mode (with the nonce)
+        # backend=default_backend() normally implies use of the normal
+        # cryptographic backend - i.e. openssl
+        decryptor = Cipher(
+            algorithms.AES(key),
+            modes.GCM(nonce, tag),
+            backend=default_backend()
+        ).decryptor()
+
+        # Decrypt the file in chunks.  The next chunk is read and the last
+        # one written on other threads while the cipher runs.  Input and
+        # output buffers are allocated once and reused.
+        chunk_size = self._size_for_file(self._chunk_size,
+                                         self._stats['infile_size'])
+        with ChunkWriter(TimedFile(out_file, self._timer, 'write'),
+                         self._io_buffers,
+                         self._chunk_buffer_size(chunk_size)) as writer:
+            for chunk in self._read_chunks(
+                    TimedFile(in_file, self._timer, 'read'), chunk_size):
+                buf = writer.buffer()
+                with self._timer.phase('cipher', len(chunk)):
+                    n = decryptor.update_into(chunk, buf)
+                writer.write_buffer(buf, n)
+                self._progress(bar, len(chunk))
+
+            # Finalize decryption (verifies integrity)
+            with self._timer.phase('finalize'):
+                decryptor.finalize()
+                writer.finish()
+        return
+
+
+
+    def decrypt_stream(self, in_fileobj=None, out_fileobj=None):
+        '''Decrypt a stream in the segmented format (file format 2) read from
+        in_fileobj and write the plaintext to out_fileobj.  Neither file
+        object needs to be seekable.  Each segment is authenticated before it
+        is written, and a stream cut short fails on its last segment.
+        '''
+        self.log.debug('Decrypting stream')
+        self._start_timing('decrypt_stream', '-')
+        self._stats['infile_size'] = None
+        bar = None
+        if self.showprogress == True: bar = self._setup_progressbar('stream')
+        self._decrypt_segmented(in_fileobj, out_fileobj, bar)
+        if bar is not None: bar.close()
+        self._finish_timing()
+        if self.debug: self.log.debug('{}'.format(self._print_stats()))
+        return
+
+
+
+    def encrypt_bytes(self, data=None) -> bytes:
+        '''Encrypt bytes held in memory and return them encrypted in the
+        configured file format.  Nothing is written to disk.
+        '''
+        out_fileobj = io.BytesIO()
+        self._encrypt_fileobj(io.BytesIO(data), out_fileobj, len(data),
+                              'encrypt_bytes')
+        return out_fileobj.getvalue()
+
+
+
+    def decrypt_bytes(self, data=None) -> bytes:
+        '''Decrypt bytes in either file format held in memory and return the
+        plaintext.  Nothing is returned unless the whole of the data is
+        authenticated.
+        '''
+        out_fileobj = io.BytesIO()
+        self._decrypt_fileobj(io.BytesIO(data), out_fileobj, len(data),
+                              'decrypt_bytes')
+        return out_fileobj.getvalue()
+
+
+
+    def encrypt_fileobj(self, in_fileobj=None, out_fileobj=None):
+        '''Encrypt everything read from in_fileobj, from its current
+        position, and write it to out_fileobj in the configured file format.
+        Format 1 seeks back to write its tag, so if out_fileobj cannot seek,
+        such as a socket or a pipe, the segmented format is written instead
+        as with encrypt_stream().  As with streams, the configured
+        compression is used without sampling the input first.
+        '''
+        self._encrypt_fileobj(in_fileobj, out_fileobj, None, 'encrypt_fileobj')
+        return
+
+
+
+    def decrypt_fileobj(self, in_fileobj=None, out_fileobj=None):
+        '''Decrypt in_fileobj, from its current position, and write the
+        plaintext to out_fileobj.  Both file formats are understood if
+        in_fileobj can seek.  Otherwise it must be in the segmented format
+        as with decrypt_stream().
+        '''
+        self._decrypt_fileobj(in_fileobj, out_fileobj, None, 'decrypt_fileobj')
+        return
+
+
+
+    def _seekable(self, fileobj):
+        try:
+            return fileobj.seekable()
+        except (AttributeError, OSError, ValueError):
+            return False
+
+
+
+    def _encrypt_fileobj(self, in_fileobj, out_fileobj, size, action):
+        '''Encrypt one file object to another for encrypt_bytes() and
+        encrypt_fileobj().  size is the size of the input if known.
+        '''
+        self.log.debug('Encrypting file object')
+        self._start_timing(action, '-')
+        self._stats['infile_size'] = size
+        bar = None
+        if self.showprogress == True: bar = self._setup_progressbar('stream')
+        self.file_stats = None
+        if self._format_version == 1 and self._seekable(out_fileobj):
+            start = out_fileobj.tell()
+            self._encrypt_single(in_fileobj, out_fileobj, bar)
+            self._stats['outfile_size'] = out_fileobj.tell() - start
+        else:
+            self._encrypt_segmented(in_fileobj, out_fileobj, bar,
+                                    self._compression)
+            self._stats['outfile_size'] = self.file_stats['file_size_bytes']
+        if bar is not None: bar.close()
+        self._finish_timing()
+        if self.debug: self.log.debug('{}'.format(self._print_stats()))
+        return
+
+
+
+    def _decrypt_fileobj(self, in_fileobj, out_fileobj, size, action):
+        '''Decrypt one file object to another for decrypt_bytes() and
+        decrypt_fileobj().  size is the size of the input if known.
+        '''
+        self.log.debug('Decrypting file object')
+        self._start_timing(action, '-')
+        self._stats['infile_size'] = size
+        self._stats['outfile_size'] = None
+        bar = None
+        if self.showprogress == True: bar = self._setup_progressbar('stream')
+        if self._seekable(in_fileobj):
+            self._decrypt_file(in_fileobj, out_fileobj, bar)
+        else:
+            self._decrypt_segmented(in_fileobj, out_fileobj, bar)
+        if bar is not None: bar.close()
+        self._finish_timing()
+        if self.debug: self.log.debug('{}'.format(self._print_stats()))
+        return
+
+
+
+    def _decrypt_segmented(self, in_file, out_file, bar):
+        '''Decrypt a file in the segmented format (file format 2).  Each
+        segment is authenticated before it is written.
+        '''
+        in_file = TimedFile(in_file, self._timer, 'read')
+        out_file = TimedFile(out_file, self._timer, 'write')
+        (header, decrypt_segment) = self._open_segmented(in_file)
+        if header.compression != 'none':
+            out_file = DecompressingWriter(out_file, header.compression)
+        self._stats['segments'] = self._process_segments(
+            in_file, out_file, decrypt_segment,
+            header.segment_size + header.TAG_SIZE, bar)
+        if header.compression != 'none':
+            with self._timer.phase('finalize'):
+                out_file.finish()
+        return
+
+
+
+    def _open_segmented(self, in_file):
+        '''Read the header of a segmented file and derive its key.
+
+        RETURN
+                (header, decrypt_segment) where decrypt_segment(index,
+                segment, last) returns the authenticated plaintext of a
+                segment.
+        '''
+        header = EncHeader()
+        aad = header.read(in_file)
+        self._stats['format'] = header.version
+        self._stats['cipher'] = header.cipher
+        self._stats['kdf'] = header.kdf
+        self._stats['compression'] = header.compression
+        self._stats['salt'] = b64encode(header.salt).decode('utf-8')
+        self._stats['nonce'] = b64encode(header.nonce_prefix).decode('utf-8')
+
+        # Derive the same key using the master key and salt
+        with self._timer.phase('kdf'):
+            key = self._file_key(header)
+        self._stats['key'] = b64encode(key).decode('utf-8')
+
+        aead = AEADS[header.cipher](key)
+        def decrypt_segment(index, segment, last):
+            try:
+                return aead.decrypt(header.segment_nonce(index, last),
+                                    segment, aad)
+            except InvalidTag:
+                raise Exception('Authentication failed for segment {}'.format(
+                    index))
+        return (header, decrypt_segment)
+
+
+
+    def decrypt_range(self, start=0, end=None, out_fileobj=None):
+        '''Decrypt only the bytes from start up to, but not including, end of
+        the plaintext of the file set by set_filename() and write them to
+        out_fileobj.  Only the segments covering the range are read and
+        authenticated.  An end of None reads to the end of the file.
+
+        Only files in the segmented format (file format 2) without
+        compression can be read this way.
+
+        RETURN
+                Number of bytes written.
+        '''
+        if self._filename == None:
+            raise Exception('Set filename with set_filename() method first')
+        if start < 0 or (end != None and end < start):
+            raise Exception('Invalid range {}:{}'.format(start, end))
+        input_file = self._filename
+        self._start_timing('decrypt_range', input_file)
+        self._stats['infile_size'] = os.path.getsize(input_file)
+        self.log.debug('Decrypting bytes {}:{} of "{}"'.format(
+            start, end, os.path.basename(input_file)))
+
+        with open(input_file, 'rb') as in_file:
+            if not EncHeader().is_segmented(in_file.read(len(EncHeader.MAGIC))):
+                raise Exception(
+                    'Range decryption requires the segmented file format')
+            in_file.seek(0)
+            (header, decrypt_segment) = self._open_segmented(in_file)
+            if header.compression != 'none':
+                raise Exception(
+                    'Range decryption is not possible with compression')
+
+            # Every segment is full except the last which holds the rest.
+            block_size = header.segment_size + header.TAG_SIZE
+            body = self._stats['infile_size'] - header.size()
+            segments = max(1, -(-body // block_size))
+            plaintext_size = body - segments * header.TAG_SIZE
+            if plaintext_size < 0:
+                raise Exception('Truncated file "{}"'.format(input_file))
+            if end == None or end > plaintext_size: end = plaintext_size
+            if start >= end: return 0
+            first = start // header.segment_size
+            last = (end - 1) // header.segment_size
+            self._stats['segments'] = last - first + 1
+
+            def read_segment(index):
+                in_file.seek(header.size() + index * block_size)
+                return in_file.read(block_size)
+
+            def write_segment(index, future):
+                offset = index * header.segment_size
+                plaintext = future.result()[max(0, start - offset):
+                                            end - offset]
+                out_fileobj.write(plaintext)
+                return len(plaintext)
+
+            written = 0
+            pending = deque()
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                for index in range(first, last + 1):
+                    pending.append((index, pool.submit(decrypt_segment,
+                                                       index,
+                                                       read_segment(index),
+                                                       index == segments - 1)))
+                    while len(pending) > 2 * self.threads:
+                        written += write_segment(*pending.popleft())
+                while len(pending) > 0:
+                    written += write_segment(*pending.popleft())
+        in_file.close()
+        self._stats['outfile_size'] = written
+        self._finish_timing()
+        if self.debug: self.log.debug('{}'.format(self._print_stats()))
+        return written
+
+
+
+    def rewrap(self, new_keyfile=None):
+        '''Wrap the data key of the file set by set_filename() with the master
+        key in new_keyfile instead of the configured one.  Only the wrapped
+        key in the header is rewritten, in place, so this takes the same
+        time whatever the size of the file.  A file already wrapped with the
+        new master key is left alone, so a run which was interrupted can
+        simply be run again.
+
+        Only files in format 2 written with envelope encryption can be
+        rewrapped.  The checksum of the file changes, so any
+        FILENAME.enc.stats left by encrypt() is removed.
+
+        RETURN
+                True if the file was rewritten.  False if it was already
+                wrapped with the new master key.
+        '''
+        if self._filename == None:
+            raise Exception('Set filename with set_filename() method first')
+        input_file = self._filename
+        if os.path.exists(input_file + self.CHECKPOINT_EXTENSION):
+            raise Exception('Cannot rewrap a file still being encrypted "{}"'.format(
+                input_file))
+        new_master_key = self._read_key_file(new_keyfile)
+        self.log.debug('Rewrapping "{}"'.format(os.path.basename(input_file)))
+
+        with open(input_file, 'r+b') as f:
+            header = EncHeader()
+            if not header.is_segmented(f.read(len(EncHeader.MAGIC))):
+                raise Exception('Only files in format 2 can be rewrapped "{}"'.format(
+                    input_file))
+            f.seek(0)
+            header.read(f)
+            if not header.envelope():
+                raise Exception('Not written with envelope encryption "{}"'.format(
+                    input_file))
+            new_key = self._derive_file_key(header, new_master_key)
+            try:
+                aes_key_unwrap(new_key, header.wrapped_key)
+                self.log.debug('Already rewrapped "{}"'.format(
+                    os.path.basename(input_file)))
+                return False
+            except InvalidUnwrap:
+                pass
+            wrapped_key = aes_key_wrap(new_key, self._file_key(header))
+            f.seek(header.size() - len(wrapped_key))
+            f.write(wrapped_key)
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+
+        stats_file = input_file + self.STATS_EXTENSION
+        if os.path.exists(stats_file): os.remove(stats_file)
+        return True
+
+
+
 #=============================================================================#
 # END
 #=============================================================================#
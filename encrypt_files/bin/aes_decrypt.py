@@ -10,6 +10,8 @@ import os
 import argparse
 from mylog import MyLog
 from aes_crypt import AESCrypt
+from aes_batch import AESBatch
+from dedup_store import DedupStore
 
 
 
@@ -27,15 +29,48 @@ def parse_arguments():
     parser.add_argument('--showprogress', action='store_true',
         default=False,
         help='Enable progress bar with large files.')
+    parser.add_argument('--verify-only', action='store_true',
+        default=False,
+        help='''Authenticate the files without writing anything to disk.
+        Files are verified in parallel and a report of each is printed.''')
+    parser.add_argument('--jobs', action='store', type=int,
+        default=os.cpu_count(),
+        help='Number of files to verify at the same time.')
+    parser.add_argument('--range', action='store', type=str,
+        default=None, metavar='START:END',
+        help='''Decrypt only bytes START up to END of a single file and
+        write them to STDOUT.  Either START or END may be left out.  Only
+        the segments covering the range are decrypted.''')
+    parser.add_argument('--stats-file', action='store', type=str,
+        default=None,
+        help='''Append a line of JSON per file to this file with the sizes
+        and the seconds spent deriving the key, reading, decrypting,
+        writing, and finalizing, along with the MB/s of each.''')
     parser.add_argument('files', action='store', nargs='+',
         type=str, default=None,
-        help='Files to process.')
+        help='''Files to process.  A single "-" decrypts STDIN in the
+        segmented format to STDOUT.''')
     return parser.parse_args()
 
 
 
+def parse_range(byte_range):
+    '''Convert 'START:END' into a tuple of (start, end).  A missing start is
+    the beginning of the file and a missing end is the end of the file.
+    '''
+    if ':' not in byte_range:
+        raise Exception('Range must be START:END not "{}"'.format(byte_range))
+    (start, end) = byte_range.split(':', 1)
+    start = int(start) if start != '' else 0
+    end = int(end) if end != '' else None
+    return (start, end)
+
+
+
 def check_file(filename):
     (decrypted_name, ext) = os.path.splitext(filename)
+    if filename.endswith(DedupStore.RECIPE_EXTENSION):
+        decrypted_name = filename[:-len(DedupStore.RECIPE_EXTENSION)]
     if os.path.exists(decrypted_name):
         raise Exception('Cannot decrypt!  Target file already exists "{}"'.format(
             decrypted_name))
@@ -51,14 +86,60 @@ def main():
                       loglevel=args.loglevel,
                       showprogress=args.showprogress)
 
+    # Decrypt STDIN straight to STDOUT.
+    if args.files == ['-']:
+        aesgcm.decrypt_stream(in_fileobj=sys.stdin.buffer,
+                              out_fileobj=sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+        if args.stats_file != None: aesgcm.append_stats_file(args.stats_file)
+        return
+
+    # Authenticate every file in parallel without decrypting to disk.
+    if args.verify_only == True:
+        batch = AESBatch(debug=args.debug,
+                         loglevel=args.loglevel,
+                         showprogress=args.showprogress,
+                         jobs=args.jobs)
+        batch.run(action='verify', files=args.files)
+        if args.stats_file != None: batch.append_stats_file(args.stats_file)
+        if len(batch.failed()) > 0:
+            log.error('Failed to verify files{}'.format(batch.report()))
+            return 1
+        log.info('Verified files{}'.format(batch.report()))
+        return
+
+    # A range of bytes is decrypted straight to STDOUT.
+    if args.range != None:
+        if len(args.files) != 1:
+            raise Exception('Only one file can be passed with --range')
+        (start, end) = parse_range(args.range)
+        aesgcm.set_filename(args.files[0])
+        aesgcm.decrypt_range(start=start, end=end,
+                             out_fileobj=sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+        if args.stats_file != None: aesgcm.append_stats_file(args.stats_file)
+        return
+
     # Confirm that a file of the same name as the decrypted file does not
     # already exist within the same directory.
     for file in args.files:
         check_file(os.path.realpath(file))
 
+    # Recipes written with dedup are rebuilt from the chunk files next to
+    # them.  Chunk files on their own are skipped.
+    store = None
     for file in args.files:
+        if os.path.basename(file).startswith(DedupStore.CHUNK_PREFIX):
+            continue
+        if file.endswith(DedupStore.RECIPE_EXTENSION):
+            if store == None:
+                store = DedupStore(debug=args.debug, loglevel=args.loglevel)
+            store.restore(file)
+            continue
         aesgcm.set_filename(file)
         aesgcm.decrypt()
+        if args.stats_file != None: aesgcm.append_stats_file(args.stats_file)
+    if store != None: store.close()
     return
 
 
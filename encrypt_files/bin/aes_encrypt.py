@@ -7,9 +7,14 @@
 
 import sys
 import os
+import time
+import json
 import argparse
 from mylog import MyLog
+from aes_batch import AESBatch
 from aes_crypt import AESCrypt
+from enc_conf import EncConf
+from dedup_store import DedupStore
 
 
 
@@ -27,15 +32,37 @@ def parse_arguments():
     parser.add_argument('--showprogress', action='store_true',
         default=False,
         help='Enable progress bar with large files.')
+    parser.add_argument('--jobs', action='store', type=int,
+        default=os.cpu_count(),
+        help='Number of files to encrypt at the same time.')
+    parser.add_argument('--write-stats', action='store_true',
+        default=False,
+        help='''Write the size, SHA512 checksum, and stats_checksums of each
+        encrypted file, hashed while encrypting, to FILENAME.enc.stats so
+        create_metadata does not need to read the file again.''')
+    parser.add_argument('--dedup', action='store_true',
+        default=False,
+        help='''Store each file as FILENAME.recipe.enc plus a chunk-ID.enc
+        file for each chunk not stored before.  Also turned on by
+        "dedup = True" in the configuration file.''')
+    parser.add_argument('--stats-file', action='store', type=str,
+        default=None,
+        help='''Append a line of JSON per file to this file with the sizes
+        and the seconds spent deriving the key, reading, encrypting,
+        writing, and finalizing, along with the MB/s of each.''')
     parser.add_argument('files', action='store', nargs='+',
         type=str, default=None,
-        help='Files to process.')
+        help='''Files to process.  A single "-" encrypts STDIN to STDOUT in
+        the segmented format so the output can be piped.''')
     return parser.parse_args()
 
 
 
-def check_file(filename):
-    encrypted_name = filename + '.enc'
+def check_file(filename, extension='.enc'):
+    encrypted_name = filename + extension
+    # A file left part way through with a checkpoint is resumed.
+    if os.path.exists(encrypted_name + AESCrypt.CHECKPOINT_EXTENSION):
+        return
     if os.path.exists(encrypted_name):
         raise Exception('Cannot encrypt!  Target file already exists "{}"'.format(
             encrypted_name))
@@ -47,19 +74,91 @@ def main():
     args = parse_arguments()
     l = MyLog(debug=args.debug, loglevel=args.loglevel)
     log = l.log
-    aesgcm = AESCrypt(debug=args.debug,
-                      loglevel=args.loglevel,
-                      showprogress=args.showprogress)
+
+    # Encrypt STDIN straight to STDOUT.
+    if args.files == ['-']:
+        aesgcm = AESCrypt(debug=args.debug,
+                          loglevel=args.loglevel,
+                          showprogress=args.showprogress)
+        aesgcm.encrypt_stream(in_fileobj=sys.stdin.buffer,
+                              out_fileobj=sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+        if args.stats_file != None: aesgcm.append_stats_file(args.stats_file)
+        return
+
+    cfg = EncConf(debug=args.debug, loglevel=args.loglevel)
+    cfg.read()
+    if args.dedup == True or cfg.dedup == True:
+        return dedup(args, cfg, log)
+
+    batch = AESBatch(debug=args.debug,
+                     loglevel=args.loglevel,
+                     showprogress=args.showprogress,
+                     jobs=args.jobs,
+                     write_stats=args.write_stats,
+                     config=cfg)
 
     # Confirm that a file of the same name as the encrypted one does not
     # already exist within the same directory.
     for file in args.files:
         check_file(os.path.realpath(file))
 
-    for file in args.files:
-        aesgcm.set_filename(file)
-        aesgcm.encrypt()
+    # Files are encrypted in parallel by a pool of worker processes.  Each
+    # file is reported on whether it succeeded or not.
+    batch.run(action='encrypt', files=args.files)
+    if args.stats_file != None: batch.append_stats_file(args.stats_file)
+    if len(batch.failed()) > 0:
+        log.error('Failed to encrypt files{}'.format(batch.report()))
+        return 1
+    log.info('Encrypted files{}'.format(batch.report()))
+    return
 
+
+
+def dedup(args, cfg, log):
+    '''Store the files one after another as recipes and new chunks.
+    '''
+    for file in args.files:
+        check_file(os.path.realpath(file), DedupStore.RECIPE_EXTENSION)
+    if args.write_stats == True:
+        log.warning('Option not implemented with dedup. Ignoring "--write-stats".')
+
+    # As with AESBatch, carry on past files which fail and report on each.
+    store = DedupStore(debug=args.debug, loglevel=args.loglevel, config=cfg)
+    total = { 'chunks' : 0, 'new' : 0, 'size' : 0, 'new_bytes' : 0 }
+    results = []
+    try:
+        for file in args.files:
+            start = time.time()
+            try:
+                counts = store.store(file)
+            except Exception as e:
+                log.error('Failed to store "{}": {}'.format(file, e))
+                results.append({ 'file' : file, 'status' : 'FAILED',
+                                 'seconds' : None, 'error' : str(e) })
+                continue
+            log.info('Stored "{}": {} of {} chunks new, {} of {} bytes'.format(
+                file, counts['new'], counts['chunks'], counts['new_bytes'],
+                counts['size']))
+            for k in total.keys(): total[k] += counts[k]
+            result = { 'file' : file, 'status' : 'OK',
+                       'seconds' : time.time() - start, 'error' : None }
+            result.update(counts)
+            results.append(result)
+    finally:
+        store.close()
+        if args.stats_file != None:
+            with open(args.stats_file, 'a') as f:
+                for result in results:
+                    f.write(json.dumps(result, sort_keys=True) + '\n')
+            f.close()
+    failed = [r for r in results if r['status'] != 'OK']
+    log.info('Stored {} files: {} of {} chunks new, {} of {} bytes'.format(
+        len(results) - len(failed), total['new'], total['chunks'],
+        total['new_bytes'], total['size']))
+    if len(failed) > 0:
+        log.error('Failed to store {} files'.format(len(failed)))
+        return 1
     return
 
 
@@ -19,7 +19,8 @@ if [[ ! -d "${TOP_DIR}/ve3" ]]; then
     python3 -m venv ve3
     [[ -s requirements.txt ]] && OPTS="-r requirements.txt"
     OPTS="${OPTS:=''}"
-    ./ve3/bin/pip3 install --upgrade pip ${OPTS}
+    # STDOUT may be carrying a stream, so keep the install output off it.
+    ./ve3/bin/pip3 install --upgrade pip ${OPTS} 1>&2
     unset OPTS
     popd 1>/dev/null 2>/dev/null
 fi
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import argparse
+from mylog import MyLog
+from aes_crypt import AESCrypt
+
+
+
+def parse_arguments():
+    '''Parse arguments.
+    '''
+    parser = argparse.ArgumentParser(description='''Change the master key of
+    files written with envelope encryption.  The data key in the header of
+    each file is unwrapped with the configured master key and wrapped again
+    with the new one.  Only the header is rewritten, so large files take no
+    longer than small ones.  Once every file is done, replace the configured
+    key file with the new key.''')
+    parser.add_argument('--debug', action='store_true',
+        default=False,
+        help='Verbose output.')
+    parser.add_argument('--loglevel', action='store', default='WARNING',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level.')
+    parser.add_argument('--new-keyfile', action='store', type=str,
+        required=True,
+        help='File containing the new master key.')
+    parser.add_argument('files', action='store', nargs='+',
+        type=str, default=None,
+        help='''Files to rewrap.  Files already wrapped with the new master
+        key are skipped.''')
+    return parser.parse_args()
+
+
+
+def main():
+    args = parse_arguments()
+    l = MyLog(debug=args.debug, loglevel=args.loglevel)
+    log = l.log
+    aesgcm = AESCrypt(debug=args.debug, loglevel=args.loglevel)
+
+    # Carry on past files which fail so one bad file does not leave the rest
+    # on the old master key.
+    counts = { 'rewrapped' : 0, 'skipped' : 0 }
+    failed = []
+    for file in args.files:
+        aesgcm.set_filename(file)
+        try:
+            if aesgcm.rewrap(new_keyfile=args.new_keyfile):
+                counts['rewrapped'] += 1
+            else:
+                counts['skipped'] += 1
+        except Exception as e:
+            log.error('Failed to rewrap "{}": {}'.format(file, e))
+            failed.append(file)
+    log.info('Rewrapped {} files, {} already done, {} failed'.format(
+        counts['rewrapped'], counts['skipped'], len(failed)))
+    if len(failed) > 0: return 1
+    return
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
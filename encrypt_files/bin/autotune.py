@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import os
+import time
+import copy
+import shutil
+import tempfile
+import argparse
+from mylog import MyLog
+from enc_conf import EncConf
+from aes_crypt import AESCrypt
+
+
+
+def parse_arguments():
+    '''Parse arguments.
+    '''
+    parser = argparse.ArgumentParser(description='''Benchmark AESCrypt on the
+    local disk across chunk sizes and pick the fastest.  For file format 2
+    the segment size is tuned and for file format 1 the chunk size.  The
+    best size is written back to the configuration file with --write.''')
+    parser.add_argument('--debug', action='store_true',
+        default=False,
+        help='Verbose output.')
+    parser.add_argument('--loglevel', action='store', default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level.')
+    parser.add_argument('--dir', action='store', type=str,
+        default=os.getcwd(),
+        help='''Directory on the disk to benchmark.  A temporary directory is
+        created and removed within it.  [DEFAULT: current directory]''')
+    parser.add_argument('--size', action='store', type=int,
+        default=256,
+        help='Size of the test file in MB. [DEFAULT: 256]')
+    parser.add_argument('--sizes', action='store', type=str,
+        default='16,64,256,1024,4096,8192',
+        help='''Comma separated chunk sizes in KB to try.
+        [DEFAULT: 16,64,256,1024,4096,8192]''')
+    parser.add_argument('--repeat', action='store', type=int,
+        default=2,
+        help='Runs of each size.  The fastest run is kept. [DEFAULT: 2]')
+    parser.add_argument('--write', action='store_true',
+        default=False,
+        help='Write the best size back to the configuration file.')
+    return parser.parse_args()
+
+
+
+def drop_cache(filename):
+    '''Ask the kernel to drop the cached pages of a file so that each run
+    reads from the disk.  Not every platform supports this.
+    '''
+    if not hasattr(os, 'posix_fadvise'): return
+    with open(filename, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    f.close()
+    return
+
+
+
+def time_size(workdir, testfile, cfg, setting, kbytes):
+    '''Encrypt the test file and decrypt the result with a copy of the
+    configuration which has the chunk or segment size set to kbytes.
+
+    RETURN
+            Seconds taken.
+    '''
+    conf = copy.copy(cfg)
+    if setting == 'segment_size_kbytes':
+        conf.set_segment_size_kbytes(kbytes)
+    else:
+        conf.set_chunk_size_kbytes(kbytes)
+    crypt = AESCrypt(config=conf)
+    roundtrip = os.path.join(workdir, 'roundtrip')
+
+    drop_cache(testfile)
+    start = time.time()
+    crypt.set_filename(testfile)
+    crypt.encrypt()
+    os.rename(testfile + '.enc', roundtrip + '.enc')
+    drop_cache(roundtrip + '.enc')
+    crypt.set_filename(roundtrip + '.enc')
+    crypt.decrypt()
+    os.sync()
+    seconds = time.time() - start
+
+    os.remove(roundtrip + '.enc')
+    os.remove(roundtrip)
+    return seconds
+
+
+
+def main():
+    args = parse_arguments()
+    l = MyLog(debug=args.debug, loglevel=args.loglevel)
+    log = l.log
+    cfg = EncConf(debug=args.debug, loglevel=args.loglevel)
+    cfg.read()
+    sizes = [int(s) for s in args.sizes.split(',')]
+    setting = 'chunk_size_kbytes'
+    if cfg.file_format_version == 2: setting = 'segment_size_kbytes'
+
+    workdir = tempfile.mkdtemp(prefix='autotune.', dir=args.dir)
+    try:
+        testfile = os.path.join(workdir, 'testfile')
+        log.info('Writing {} MB test file in "{}"'.format(args.size, workdir))
+        with open(testfile, 'wb') as f:
+            for i in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+        f.close()
+
+        results = {}
+        for kbytes in sizes:
+            results[kbytes] = min([time_size(workdir, testfile, cfg, setting,
+                                             kbytes)
+                                   for i in range(args.repeat)])
+            log.debug('{} = {} took {:0.2f}s'.format(setting, kbytes,
+                                                      results[kbytes]))
+    finally:
+        shutil.rmtree(workdir)
+
+    best = min(results, key=results.get)
+    rpt = '\n{}\n'.format('='*76)
+    rpt += '{:<20} {:>10} {:>10}\n'.format(setting, 'Seconds', 'MB/s')
+    rpt += '{:<20} {:>10} {:>10}\n'.format('-'*20, '-'*10, '-'*10)
+    for kbytes in sizes:
+        rpt += '{:<20} {:>10.2f} {:>10.1f}{}\n'.format(
+            kbytes, results[kbytes], 2 * args.size / results[kbytes],
+            '  <- best' if kbytes == best else '')
+    rpt += '{}\n'.format('='*76)
+    log.info('Encrypt and decrypt of {} MB{}'.format(args.size, rpt))
+
+    if args.write == True:
+        if setting == 'segment_size_kbytes':
+            cfg.set_segment_size_kbytes(best)
+        else:
+            cfg.set_chunk_size_kbytes(best)
+        with open(cfg.filename, 'w') as c:
+            c.write(cfg.build())
+        c.close()
+        log.info('Set {} = {} in "{}"'.format(setting, best, cfg.filename))
+    return
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
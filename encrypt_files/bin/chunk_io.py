@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import os
+import stat
+import mmap
+import queue
+import threading
+
+
+
+class ChunkReader(object):
+    '''Read a file object in chunks on a background thread so that reading
+    the next chunk overlaps with whatever is done with the current one.
+
+    Chunks are read into a ring of 'depth' buffers allocated up front and
+    reused for the whole file.  Every chunk is full except the last.  With a
+    depth of 1 there is no thread and each chunk is read when it is asked for.
+
+    With use_mmap a regular file is mapped into memory instead and the chunks
+    are views straight into the map, so no copy is made at all.  Anything
+    which cannot be mapped, such as a pipe, is read as usual.
+
+    ATTRIBUTES
+        fileobj            File object opened for reading in binary mode.
+
+        chunk_size         Size of each chunk in bytes.
+
+        depth              Number of buffers.  Up to depth - 1 chunks are
+                           read ahead of the one being worked on.
+
+        use_mmap           Map regular files into memory rather than reading
+                           them.
+
+    USAGE
+        Iterating returns a memoryview of each chunk.  The view is only
+        valid until the next chunk is asked for, when its buffer is handed
+        back to the reader.
+
+            for chunk in ChunkReader(in_file, 64 * 1024, 3):
+                out_file.write(encryptor.update(chunk))
+
+    '''
+    def __init__(self, fileobj=None, chunk_size=64 * 1024, depth=3,
+                 use_mmap=False):
+        self.fileobj = fileobj
+        self.chunk_size = int(chunk_size)
+        self.depth = max(1, int(depth))
+        self.use_mmap = use_mmap
+        return
+
+
+
+    def _fill(self, buf):
+        '''Fill the buffer from the file.  Short reads from pipes are
+        retried so only the last chunk is ever short.
+
+        RETURN
+                Number of bytes read.  0 at the end of the file.
+        '''
+        view = memoryview(buf)
+        filled = 0
+        while filled < len(buf):
+            n = self.fileobj.readinto(view[filled:])
+            if not n: break
+            filled += n
+        return filled
+
+
+
+    def __iter__(self):
+        if self.use_mmap == True and self._can_map():
+            yield from self._mapped()
+        elif self.depth == 1:
+            buf = bytearray(self.chunk_size)
+            while True:
+                n = self._fill(buf)
+                if n == 0: return
+                yield memoryview(buf)[:n]
+        else:
+            yield from self._read_ahead()
+
+
+
+    def _can_map(self):
+        '''Return True if the rest of the file can be mapped into memory.
+        '''
+        try:
+            st = os.fstat(self.fileobj.fileno())
+            return stat.S_ISREG(st.st_mode) and st.st_size > self.fileobj.tell()
+        except (AttributeError, OSError, ValueError):
+            return False
+
+
+
+    def _mapped(self):
+        '''Yield views of the map from the current position of the file to
+        its end.  The map is closed once the last view is dropped.
+        '''
+        start = self.fileobj.tell()
+        mm = mmap.mmap(self.fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'): mm.madvise(mmap.MADV_SEQUENTIAL)
+        size = len(mm)
+        view = memoryview(mm)
+        for offset in range(start, size, self.chunk_size):
+            yield view[offset:offset + self.chunk_size]
+        self.fileobj.seek(size)
+        return
+
+
+
+    def _read_ahead(self):
+        free = queue.Queue()
+        filled = queue.Queue()
+        for i in range(self.depth):
+            free.put(bytearray(self.chunk_size))
+        error = []
+
+        def reader():
+            try:
+                while True:
+                    buf = free.get()
+                    if buf is None: break
+                    n = self._fill(buf)
+                    if n == 0: break
+                    filled.put((buf, n))
+            except Exception as e:
+                error.append(e)
+            filled.put(None)
+            return
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        buf = None
+        try:
+            while True:
+                if buf is not None: free.put(buf)
+                item = filled.get()
+                if item == None: break
+                (buf, n) = item
+                yield memoryview(buf)[:n]
+        finally:
+            # Let the reader stop early if the caller gave up on the file.
+            free.put(None)
+        thread.join()
+        if len(error) > 0: raise error[0]
+        return
+
+
+
+class ChunkWriter(object):
+    '''Write to a file object on a background thread so that writing
+    overlaps with producing the next chunk.  Up to 'depth' chunks wait in the
+    queue before write() blocks.  With a depth of 1 data is written straight
+    through without a thread.
+
+    Data passed to write() must not be changed afterwards, so pass bytes and
+    not a buffer which is going to be reused.  To avoid allocating a new
+    output chunk every time, set buffer_size and fill the preallocated
+    buffers from buffer() instead.  Each goes back to the pool once written.
+
+    ATTRIBUTES
+        fileobj            File object, or anything with a write() method.
+
+        depth              Number of chunks queued for writing.
+
+        buffer_size        Size of each preallocated buffer in bytes.
+                           [DEFAULT: 0, no buffers]
+
+    METHODS
+        write              Queue data for writing.
+
+        buffer             Return a free preallocated buffer to fill.
+
+        write_buffer       Queue the first bytes of a buffer from buffer() for
+                           writing.
+
+        flush              Wait for all queued data to be written and flush
+                           the file object, keeping the thread running.
+
+        finish             Wait for all queued data to be written.  Raises any
+                           error hit while writing.
+
+    Use as a context manager to call finish() at the end.
+    '''
+    def __init__(self, fileobj=None, depth=3, buffer_size=0):
+        self.fileobj = fileobj
+        self.depth = max(1, int(depth))
+        self.buffer_size = int(buffer_size)
+        self._error = None
+        self._thread = None
+        self._free = queue.Queue()
+        if self.buffer_size > 0:
+            for i in range(self.depth + 1):
+                self._free.put(bytearray(self.buffer_size))
+        if self.depth > 1:
+            self._queue = queue.Queue(maxsize=self.depth)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type == None:
+            self.finish()
+        else:
+            self._stop()
+        return False
+
+
+
+    def write(self, data):
+        if self._thread == None: return self.fileobj.write(data)
+        if self._error != None: raise self._error
+        self._queue.put((data, None))
+        return len(data)
+
+
+
+    def buffer(self):
+        '''Return a preallocated buffer of buffer_size bytes.  Blocks until
+        one has been written and is free again.
+        '''
+        if self.buffer_size == 0:
+            raise Exception('No buffers without a buffer_size')
+        return self._free.get()
+
+
+
+    def write_buffer(self, buf, nbytes):
+        '''Write the first nbytes of a buffer returned by buffer().  The
+        buffer must not be touched again until buffer() hands it out again.
+        '''
+        if self._thread == None:
+            try:
+                self.fileobj.write(memoryview(buf)[:nbytes])
+            finally:
+                self._free.put(buf)
+            return nbytes
+        if self._error != None: raise self._error
+        self._queue.put((buf, nbytes))
+        return nbytes
+
+
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: break
+            (data, nbytes) = item
+            # Keep draining after an error so write() never blocks forever.
+            if self._error == None:
+                try:
+                    if nbytes == None:
+                        self.fileobj.write(data)
+                    else:
+                        self.fileobj.write(memoryview(data)[:nbytes])
+                except Exception as e:
+                    self._error = e
+            if nbytes != None: self._free.put(data)
+            self._queue.task_done()
+        return
+
+
+
+    def flush(self):
+        '''Wait for everything queued so far to be written, then flush the
+        file object if it can be flushed.
+        '''
+        if self._thread != None: self._queue.join()
+        if self._error != None: raise self._error
+        if hasattr(self.fileobj, 'flush'): self.fileobj.flush()
+        return
+
+
+
+    def _stop(self):
+        if self._thread != None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        return
+
+
+
+    def finish(self):
+        '''Wait for all queued data to be written.
+        '''
+        self._stop()
+        if self._error != None: raise self._error
+        return
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
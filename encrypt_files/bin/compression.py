@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import os
+import zlib
+import lzma
+import math
+from collections import Counter
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Names of the compression methods understood.  'zstd' also needs the
+# zstandard package installed.
+METHODS = ['none', 'zlib', 'lzma', 'zstd']
+
+# Files with these extensions are already compressed and never sampled.
+COMPRESSED_EXTENSIONS = ['.7z', '.asc', '.avi', '.bz2', '.enc', '.gif',
+                         '.gz', '.heic', '.jpeg', '.jpg', '.m4a', '.m4v',
+                         '.mkv', '.mov', '.mp3', '.mp4', '.png', '.rar',
+                         '.tgz', '.webm', '.webp', '.xz', '.zip', '.zst']
+
+
+
+def _check_method(method):
+    if method not in METHODS:
+        raise Exception('Compression method "{}" not understood'.format(method))
+    if method == 'zstd' and zstandard == None:
+        raise Exception('Compression method "zstd" needs the zstandard package')
+    return
+
+
+
+def compressor(method=None):
+    '''Return a new compression object with compress() and flush() methods.
+    '''
+    _check_method(method)
+    if method == 'zlib': return zlib.compressobj(6)
+    if method == 'lzma': return lzma.LZMACompressor(preset=1)
+    if method == 'zstd': return zstandard.ZstdCompressor(level=3).compressobj()
+    raise Exception('No compressor for "{}"'.format(method))
+
+
+
+def decompressor(method=None):
+    '''Return a new decompression object with a decompress() method and an
+    eof attribute.
+    '''
+    _check_method(method)
+    if method == 'zlib': return zlib.decompressobj()
+    if method == 'lzma': return lzma.LZMADecompressor()
+    if method == 'zstd': return zstandard.ZstdDecompressor().decompressobj()
+    raise Exception('No decompressor for "{}"'.format(method))
+
+
+
+def entropy(data=None):
+    '''Return the Shannon entropy of the bytes in bits per byte, from 0 for
+    a single repeated byte to 8 for random data.
+    '''
+    if len(data) == 0: return 0.0
+    total = len(data)
+    return -sum([(n / total) * math.log2(n / total)
+                 for n in Counter(data).values()])
+
+
+
+def sample_entropy(filename=None, samples=4, sample_size=64 * 1024):
+    '''Return the entropy of up to 'samples' blocks of sample_size bytes
+    spread evenly through a file.  The highest entropy of the blocks is
+    returned so a file which is only partly compressible counts as
+    incompressible.
+    '''
+    size = os.path.getsize(filename)
+    if size == 0: return 0.0
+    step = max(sample_size, size // samples)
+    highest = 0.0
+    with open(filename, 'rb') as f:
+        for offset in range(0, size, step)[:samples]:
+            f.seek(offset)
+            highest = max(highest, entropy(f.read(sample_size)))
+    f.close()
+    return highest
+
+
+
+def should_compress(filename=None, max_entropy=7.5):
+    '''Return True if a file looks worth compressing.  Files with an
+    extension of an already compressed format are skipped without being
+    read.  Otherwise samples of the file must have an entropy below
+    max_entropy bits per byte.
+    '''
+    (root, ext) = os.path.splitext(filename)
+    if ext.lower() in COMPRESSED_EXTENSIONS: return False
+    return sample_entropy(filename) < max_entropy
+
+
+
+class CompressingReader(object):
+    '''File object wrapper whose read() returns the compressed contents of
+    the file object it wraps.
+
+    ATTRIBUTES
+        fileobj            File object opened for reading in binary mode.
+
+        method             Compression method.  One of METHODS except 'none'.
+
+        callback           Optional callable passed the number of
+                           uncompressed bytes read each time.
+
+    '''
+    def __init__(self, fileobj=None, method='zlib', callback=None):
+        self.fileobj = fileobj
+        self.method = method
+        self.callback = callback
+        self._compressor = compressor(method)
+        self._buffer = bytearray()
+        self._eof = False
+        return
+
+
+
+    def read(self, size=-1):
+        '''Return up to size bytes of compressed data.  Returns b'' once
+        everything has been read.
+        '''
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self.fileobj.read(max(size, 1024 * 1024))
+            if not data:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+            else:
+                self._buffer += self._compressor.compress(data)
+                if self.callback: self.callback(len(data))
+        if size < 0: size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+
+class DecompressingWriter(object):
+    '''File object wrapper which decompresses everything written to it
+    before passing it on to the file object it wraps.
+
+    ATTRIBUTES
+        fileobj            File object, or anything with a write() method.
+
+        method             Compression method.  One of METHODS except 'none'.
+
+    METHODS
+        write              Decompress data and write the result.
+
+        finish             Check the end of the compressed data was reached.
+
+    '''
+    def __init__(self, fileobj=None, method='zlib'):
+        self.fileobj = fileobj
+        self.method = method
+        self._decompressor = decompressor(method)
+        return
+
+
+
+    def write(self, data):
+        if self._decompressor.eof and len(data) > 0:
+            raise Exception('Data found after the end of the compressed data')
+        self.fileobj.write(self._decompressor.decompress(data))
+        return len(data)
+
+
+
+    def finish(self):
+        '''Raise an exception if the compressed data ended early.
+        '''
+        if not self._decompressor.eof:
+            raise Exception('Compressed data is incomplete')
+        return
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
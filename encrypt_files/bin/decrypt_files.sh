@@ -24,7 +24,7 @@ case "${ENCRYPTION_METHOD}" in
     GPG) 
         "${TOP_DIR}/bin/gpg_decrypt.sh" "$@"
         ;;
-    AES-GCM)
+    AES-GCM|ChaCha20-Poly1305|auto)
         "${TOP_DIR}/bin/aes_decrypt.sh" "$@"
         ;;
     *)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import os
+import io
+import copy
+import json
+import hmac
+import time
+import hashlib
+import sqlite3
+import bisect
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from mylog import MyLog
+from enc_conf import EncConf
+from aes_crypt import AESCrypt
+from compression import should_compress
+
+
+
+class ContentChunker(object):
+    '''Split a file object into chunks at boundaries picked by the content
+    (FastCDC).  A rolling gear hash runs over the data and a chunk ends
+    where the top bits of the hash are all zero.  Inserting or removing
+    bytes only moves the boundaries close to the change, so an edited file
+    still shares most of its chunks with the original.
+
+    Chunking is normalized: a stricter mask is used before the average size
+    is reached and a looser one after, which keeps most chunks close to the
+    average.  No chunk is smaller than min_size, except the last, or larger
+    than max_size.
+
+    With the numpy package installed the gear hash of each buffer read is
+    calculated for every byte at once, which is far faster than the pure
+    Python loop used without it.  Both find the same boundaries.
+
+    ATTRIBUTES
+        avg_size           Average chunk size in bytes.  Must be a power of 2.
+
+        seed               Bytes used to build the gear table.  A secret seed
+                           stops chunk sizes from giving away the content.
+
+        debug              Enable debug mode.
+
+        loglevel           Set the python log level.
+
+    '''
+    # Bytes hashed by numpy at a time.  Small enough for the hashes to stay
+    # in the CPU cache while they are built.
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, avg_size=1024 * 1024, seed=b'', debug=False,
+                 loglevel='WARNING'):
+        program=__class__.__name__
+        l = MyLog(program=program, debug=debug, loglevel=loglevel)
+        self.log = l.log
+        bits = avg_size.bit_length() - 1
+        if avg_size != 1 << bits or bits < 8:
+            raise Exception('Average chunk size must be a power of 2 of at '
+                            'least 256 bytes not "{}"'.format(avg_size))
+        self.avg_size = avg_size
+        self.min_size = avg_size // 4
+        self.max_size = avg_size * 8
+        self._mask_s = ((1 << (bits + 1)) - 1) << (63 - bits)
+        self._mask_l = ((1 << (bits - 1)) - 1) << (65 - bits)
+        self._gear = [int.from_bytes(
+            hmac.new(seed, bytes([i]), hashlib.sha256).digest()[:8], 'big')
+            for i in range(256)]
+        self._numpy_gear = None
+        if numpy == None:
+            self.log.warning('numpy not installed.  Chunking in pure Python '
+                             'at a few MB/s.')
+        else:
+            self._numpy_gear = numpy.array(self._gear, dtype=numpy.uint64)
+        return
+
+
+
+    def _cut(self, data, start, end):
+        '''Return the offset of the end of the chunk starting at start.
+        '''
+        if end - start <= self.min_size: return end
+        normal = min(start + self.avg_size, end)
+        limit = min(start + self.max_size, end)
+        gear = self._gear
+        h = 0
+        i = start + self.min_size
+        for (mask, stop) in [(self._mask_s, normal), (self._mask_l, limit)]:
+            for b in data[i:stop]:
+                h = ((h << 1) + gear[b]) & 0xFFFFFFFFFFFFFFFF
+                i += 1
+                if not h & mask: return i
+        return limit
+
+
+
+    def _candidates(self, data, first=0):
+        '''Return the offsets in data from first on where the gear hash of
+        the 64 bytes ending there is zero under the looser mask, and the
+        hashes at those offsets.  The hash only depends on the last 64
+        bytes because each byte is shifted out after 64 more, so it is
+        built by doubling: the hash of 2w bytes is the hash of the last w
+        plus the hash of the w before shifted left by w.
+        '''
+        mask = numpy.uint64(self._mask_l)
+        data = numpy.frombuffer(data, dtype=numpy.uint8)
+        offsets = []
+        hashes = []
+        for start in range(first, len(data), self.BLOCK_SIZE):
+            lead = min(start, 63)
+            h = self._numpy_gear[data[start - lead:start + self.BLOCK_SIZE]]
+            w = 1
+            while w < 64:
+                h[w:] += h[:-w] << numpy.uint64(w)
+                w *= 2
+            h = h[lead:]
+            found = numpy.flatnonzero((h & mask) == 0)
+            offsets.extend((found + start).tolist())
+            hashes.extend(h[found].tolist())
+        return (offsets, hashes)
+
+
+
+    def _cut_candidates(self, data, start, end, candidates):
+        '''Return the offset of the end of the chunk starting at start, the
+        same as _cut() but using the hashes from _candidates().
+        '''
+        if end - start <= self.min_size: return end
+        normal = min(start + self.avg_size, end)
+        limit = min(start + self.max_size, end)
+        gear = self._gear
+        h = 0
+        i = start + self.min_size
+
+        # The hash restarts at min_size, so it covers fewer than 64 bytes
+        # for the first 63 and differs from the one in candidates.
+        for b in data[i:min(i + 63, limit)]:
+            h = ((h << 1) + gear[b]) & 0xFFFFFFFFFFFFFFFF
+            mask = self._mask_s if i < normal else self._mask_l
+            i += 1
+            if not h & mask: return i
+        (offsets, hashes) = candidates
+        for n in range(bisect.bisect_left(offsets, i), len(offsets)):
+            if offsets[n] >= limit: break
+            if offsets[n] >= normal or not hashes[n] & self._mask_s:
+                return offsets[n] + 1
+        return limit
+
+
+
+    def chunks(self, fileobj=None):
+        '''Yield the chunks of the file object as bytes.
+        '''
+        data = b''
+        start = 0
+        eof = False
+        candidates = ([], [])
+        while True:
+            if not eof and len(data) - start < self.max_size:
+                more = fileobj.read(self.max_size * 2)
+                eof = len(more) == 0
+                kept = len(data) - start
+                data = data[start:] + more
+                if numpy != None:
+                    # Only the new data is hashed.  The candidates kept move
+                    # down with the data.
+                    (offsets, hashes) = candidates
+                    n = bisect.bisect_left(offsets, start)
+                    (new_offsets, new_hashes) = self._candidates(data, kept)
+                    offsets = [o - start for o in offsets[n:]]
+                    candidates = (offsets + new_offsets,
+                                  hashes[n:] + new_hashes)
+                start = 0
+                continue
+            if start >= len(data): return
+            if numpy == None:
+                end = self._cut(data, start, len(data))
+            else:
+                end = self._cut_candidates(data, start, len(data), candidates)
+            yield data[start:end]
+            start = end
+
+
+
+class DedupStore(object):
+    '''Store files as deduplicated, encrypted chunks.  Each file is split
+    with ContentChunker and every chunk not stored before is encrypted with
+    AESCrypt to its own file, chunk-ID.enc, next to the original.  The file
+    itself becomes FILENAME.recipe.enc, an encrypted list of its chunks.  A
+    file which is mostly the same as one stored before, such as this week's
+    tar file against last week's, therefore only adds its changed chunks.
+
+    Chunk IDs are an HMAC-SHA256 of the chunk keyed from the master key, so
+    they give nothing away about the content.  The gear table of the chunker
+    is keyed the same way.
+
+    The SQLite index records each chunk handed on for upload.  A chunk is
+    only added once the recipe of its file is written, so an interrupted run
+    stores its chunks again the next time.  If the index is lost or a chunk
+    never reached S3, delete the index and every chunk is stored again.
+
+    To restore, the recipe and all its chunk files must be in one directory.
+    Each chunk is authenticated and its ID checked before it is written, and
+    the checksum of the whole file is checked at the end.
+
+    ATTRIBUTES
+        debug              Enable debug mode.
+
+        loglevel           Set the python log level.
+
+        config             EncConf instance to use instead of reading the
+                           configuration file.
+
+    METHODS
+        store              Store a file as a recipe and new chunks.
+
+        restore            Rebuild a file from its recipe and chunks.
+
+        close              Close the index.
+
+    '''
+    RECIPE_EXTENSION = '.recipe.enc'
+    CHUNK_PREFIX = 'chunk-'
+    RECIPE_VERSION = 1
+
+    def __init__(self, debug=False, loglevel='WARNING', config=None):
+        self.debug = debug
+        self.loglevel = loglevel
+        program=__class__.__name__
+        l = MyLog(program=program, debug=debug, loglevel=loglevel)
+        self.log = l.log
+        cfg = config
+        if cfg == None:
+            cfg = EncConf(debug=debug, loglevel=loglevel)
+            cfg.read()
+        self._crypt = AESCrypt(debug=debug, loglevel=loglevel, config=cfg)
+
+        # Chunks of files which look already compressed are not compressed.
+        raw = copy.copy(cfg)
+        raw.set_compression('none')
+        self._raw_crypt = AESCrypt(debug=debug, loglevel=loglevel, config=raw)
+        self._compression = cfg.compression
+        self._compression_max_entropy = cfg.compression_max_entropy
+
+        self._id_key = self._crypt.derive_key(b'encrypt_files dedup chunk id')
+        self._chunker = ContentChunker(
+            cfg.dedup_chunk_kbytes * 1024,
+            self._crypt.derive_key(b'encrypt_files dedup gear table'),
+            debug=debug, loglevel=loglevel)
+        self._index = sqlite3.connect(cfg.dedup_index)
+        self._index.execute('''CREATE TABLE IF NOT EXISTS chunks (
+            id         TEXT PRIMARY KEY,
+            size       INTEGER NOT NULL,
+            stored     TEXT NOT NULL)''')
+        self._index.commit()
+        return
+
+
+
+    def close(self):
+        self._index.close()
+        return
+
+
+
+    def _chunk_id(self, chunk):
+        return hmac.new(self._id_key, chunk, hashlib.sha256).hexdigest()
+
+
+
+    def _chunk_file(self, directory, chunk_id):
+        return os.path.join(directory, self.CHUNK_PREFIX + chunk_id + '.enc')
+
+
+
+    def _known(self, chunk_id):
+        row = self._index.execute('SELECT 1 FROM chunks WHERE id = ?',
+                                  (chunk_id,)).fetchone()
+        return row != None
+
+
+
+    def store(self, filename=None):
+        '''Store a file.  FILENAME.recipe.enc and a chunk-ID.enc file for
+        each new chunk are written to the directory of the file.
+
+        RETURN
+                Dictionary of counts for the file.
+
+                {
+                    'chunks'    : Number of chunks in the file.
+                    'new'       : Number of chunks stored.
+                    'size'      : Size of the file in bytes.
+                    'new_bytes' : Bytes of the file in new chunks.
+                }
+        '''
+        filename = os.path.realpath(filename)
+        directory = os.path.dirname(filename)
+        crypt = self._raw_crypt
+        if (self._compression != 'none' and
+            should_compress(filename, self._compression_max_entropy)):
+            crypt = self._crypt
+        self.log.debug('Storing "{}"'.format(os.path.basename(filename)))
+
+        hasher = hashlib.sha512()
+        chunks = []
+        counts = { 'chunks' : 0, 'new' : 0, 'size' : 0, 'new_bytes' : 0 }
+        try:
+            with open(filename, 'rb') as in_file:
+                for chunk in self._chunker.chunks(in_file):
+                    hasher.update(chunk)
+                    chunk_id = self._chunk_id(chunk)
+                    chunks.append([chunk_id, len(chunk)])
+                    counts['chunks'] += 1
+                    counts['size'] += len(chunk)
+                    if self._known(chunk_id): continue
+                    with open(self._chunk_file(directory, chunk_id), 'wb') as f:
+                        crypt.encrypt_stream(io.BytesIO(chunk), f)
+                    f.close()
+                    self._index.execute(
+                        'INSERT INTO chunks (id, size, stored) VALUES (?, ?, ?)',
+                        (chunk_id, len(chunk), time.strftime('%Y-%m-%d %H:%M:%S')))
+                    counts['new'] += 1
+                    counts['new_bytes'] += len(chunk)
+            in_file.close()
+
+            recipe = { 'version' : self.RECIPE_VERSION,
+                       'file' : os.path.basename(filename),
+                       'size' : counts['size'],
+                       'sha512' : hasher.hexdigest(),
+                       'chunks' : chunks }
+            with open(filename + self.RECIPE_EXTENSION, 'wb') as f:
+                self._crypt.encrypt_stream(
+                    io.BytesIO(json.dumps(recipe).encode('utf-8')), f)
+            f.close()
+        except:
+            self._index.rollback()
+            raise
+        self._index.commit()
+        self.log.debug('Stored {} of {} chunks of "{}"'.format(
+            counts['new'], counts['chunks'], os.path.basename(filename)))
+        return counts
+
+
+
+    def restore(self, recipe_file=None):
+        '''Rebuild the file from FILENAME.recipe.enc and the chunk files in
+        the same directory.  The file is written without the recipe
+        extension.
+
+        RETURN
+                Name of the restored file.
+        '''
+        recipe_file = os.path.realpath(recipe_file)
+        if not recipe_file.endswith(self.RECIPE_EXTENSION):
+            raise Exception('Not a recipe "{}"'.format(recipe_file))
+        directory = os.path.dirname(recipe_file)
+        output_file = recipe_file[:-len(self.RECIPE_EXTENSION)]
+        if os.path.exists(output_file):
+            raise Exception('Cannot restore!  Target file already exists "{}"'.format(
+                output_file))
+        self.log.debug('Restoring "{}"'.format(os.path.basename(output_file)))
+
+        contents = io.BytesIO()
+        with open(recipe_file, 'rb') as f:
+            self._crypt.decrypt_stream(f, contents)
+        f.close()
+        recipe = json.loads(contents.getvalue().decode('utf-8'))
+        if recipe['version'] != self.RECIPE_VERSION:
+            raise Exception('Unsupported recipe version {}'.format(
+                recipe['version']))
+
+        hasher = hashlib.sha512()
+        try:
+            with open(output_file, 'wb') as out_file:
+                for (chunk_id, size) in recipe['chunks']:
+                    chunk = io.BytesIO()
+                    with open(self._chunk_file(directory, chunk_id), 'rb') as f:
+                        self._crypt.decrypt_stream(f, chunk)
+                    f.close()
+                    chunk = chunk.getvalue()
+                    if len(chunk) != size or self._chunk_id(chunk) != chunk_id:
+                        raise Exception('Chunk "{}" does not match its ID'.format(
+                            chunk_id))
+                    hasher.update(chunk)
+                    out_file.write(chunk)
+            out_file.close()
+            if hasher.hexdigest() != recipe['sha512']:
+                raise Exception('Checksum of "{}" does not match its recipe'.format(
+                    output_file))
+        except:
+            os.remove(output_file)
+            raise
+        return output_file
+
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
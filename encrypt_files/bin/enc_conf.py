@@ -8,6 +8,7 @@
 import os
 import configparser
 from mylog import MyLog
+from multi_hash import check_method, read_part_settings
 
 
 class EncConf(object):
@@ -41,6 +42,61 @@ class EncConf(object):
 
         set_nonce_size_bytes    Nonce size.
 
+        set_file_format_version Format of newly encrypted files.  Either 1
+                                for a single stream or 2 for segments which
+                                are encrypted in parallel.
+
+        set_segment_size_kbytes Size of each segment of plaintext when
+                                using file format 2.
+
+        set_io_buffers          Number of chunks buffered between the threads
+                                reading, encrypting, and writing a file.
+
+        set_use_mmap            Map files in the single stream format into
+                                memory instead of reading them.
+
+        set_auto_chunk_size     Size the chunks or segments of each file to
+                                the file, up to the configured size.
+
+        set_kdf                 Key derivation for file format 2.  It must
+                                be one of the list of understood key
+                                derivations.
+                                {}
+
+        set_compression         Compression applied before encrypting files
+                                in format 2.  It must be one of the list of
+                                understood compression methods.
+                                {}
+
+        set_compression_max_entropy
+                                Files whose sampled entropy, in bits per
+                                byte, is at or above this are not
+                                compressed.
+
+        set_dedup               Store files as recipes of deduplicated
+                                chunks instead of encrypting them whole.
+
+        set_dedup_index         SQLite index of the chunks already stored.
+
+        set_dedup_chunk_kbytes  Average size of the chunks.
+
+        set_checkpoint_segments Segments of file format 2 between
+                                checkpoints which let an interrupted file be
+                                resumed.
+
+        set_envelope            Encrypt each file in format 2 with a random
+                                data key wrapped by the master key.
+
+        set_direct_io           Read large files with O_DIRECT, bypassing
+                                the page cache.
+
+        set_stats_checksums     Checksums written to the stats file along
+                                with the sha512.
+
+        set_s3_upload_config    aws_s3.cfg of s3_upload, which sets the
+                                mp_threshold and mp_chunksize attributes
+                                the s3_etag is calculated for.
+
         print                   Print the configuration of parameters for
                                 nice logging.
 
@@ -59,9 +115,29 @@ class EncConf(object):
         'keyfile'                  : 'etc/mykey',
         'chunk_size_kbytes'        : 64,
         'key_size_bytes'           : 32,
-        'nonce_size_bytes'         : 12
+        'nonce_size_bytes'         : 12,
+        'file_format_version'      : 2,
+        'segment_size_kbytes'      : 1024,
+        'kdf'                      : 'HKDF',
+        'io_buffers'               : 3,
+        'use_mmap'                 : False,
+        'auto_chunk_size'          : False,
+        'compression'              : 'none',
+        'compression_max_entropy'  : 7.5,
+        'dedup'                    : False,
+        'dedup_index'              : 'etc/dedup_index.sqlite',
+        'dedup_chunk_kbytes'       : 1024,
+        'checkpoint_segments'      : 1024,
+        'envelope'                 : True,
+        'direct_io'                : False,
+        'stats_checksums'          : 'md5, sha256, s3_etag',
+        's3_upload_config'         : '../s3_upload/etc/aws_s3.cfg'
     }
-    ENCRYPTION_METHODS=['AES-GCM', 'GPG']
+    ENCRYPTION_METHODS=['AES-GCM', 'ChaCha20-Poly1305', 'auto', 'GPG']
+    FILE_FORMAT_VERSIONS=[1, 2]
+    KDFS=['PBKDF2', 'HKDF']
+    COMPRESSIONS=['none', 'zlib', 'lzma', 'zstd']
+    STATS_CHECKSUMS=['md5', 'sha256', 'crc32c', 's3_etag']
 
 
 
@@ -80,6 +156,24 @@ class EncConf(object):
         self.chunk_size_kbytes = self.DEF_CONFIG['chunk_size_kbytes']
         self.key_size_bytes = self.DEF_CONFIG['key_size_bytes']
         self.nonce_size_bytes = self.DEF_CONFIG['nonce_size_bytes']
+        self.file_format_version = self.DEF_CONFIG['file_format_version']
+        self.segment_size_kbytes = self.DEF_CONFIG['segment_size_kbytes']
+        self.kdf = self.DEF_CONFIG['kdf']
+        self.io_buffers = self.DEF_CONFIG['io_buffers']
+        self.use_mmap = self.DEF_CONFIG['use_mmap']
+        self.auto_chunk_size = self.DEF_CONFIG['auto_chunk_size']
+        self.compression = self.DEF_CONFIG['compression']
+        self.compression_max_entropy = self.DEF_CONFIG['compression_max_entropy']
+        self.dedup = self.DEF_CONFIG['dedup']
+        self.dedup_index = self._add_path(self.DEF_CONFIG['dedup_index'])
+        self.dedup_chunk_kbytes = self.DEF_CONFIG['dedup_chunk_kbytes']
+        self.checkpoint_segments = self.DEF_CONFIG['checkpoint_segments']
+        self.envelope = self.DEF_CONFIG['envelope']
+        self.direct_io = self.DEF_CONFIG['direct_io']
+        self.stats_checksums = []
+        self.set_stats_checksums(self.DEF_CONFIG['stats_checksums'])
+        self.set_s3_upload_config(
+            self._add_path(self.DEF_CONFIG['s3_upload_config']))
         return
 
 
@@ -103,6 +197,55 @@ class EncConf(object):
             cfg.get('DEFAULT', 'key_size_bytes'))
         self.set_nonce_size_bytes(
             cfg.get('DEFAULT', 'nonce_size_bytes'))
+
+        # Settings added after the original release fall back to their
+        # defaults so existing configuration files still work.
+        self.set_file_format_version(
+            cfg.get('DEFAULT', 'file_format_version',
+                    fallback=self.DEF_CONFIG['file_format_version']))
+        self.set_segment_size_kbytes(
+            cfg.get('DEFAULT', 'segment_size_kbytes',
+                    fallback=self.DEF_CONFIG['segment_size_kbytes']))
+        self.set_kdf(
+            cfg.get('DEFAULT', 'kdf', fallback=self.DEF_CONFIG['kdf']))
+        self.set_io_buffers(
+            cfg.get('DEFAULT', 'io_buffers',
+                    fallback=self.DEF_CONFIG['io_buffers']))
+        self.set_use_mmap(
+            cfg.get('DEFAULT', 'use_mmap',
+                    fallback=self.DEF_CONFIG['use_mmap']))
+        self.set_auto_chunk_size(
+            cfg.get('DEFAULT', 'auto_chunk_size',
+                    fallback=self.DEF_CONFIG['auto_chunk_size']))
+        self.set_compression(
+            cfg.get('DEFAULT', 'compression',
+                    fallback=self.DEF_CONFIG['compression']))
+        self.set_compression_max_entropy(
+            cfg.get('DEFAULT', 'compression_max_entropy',
+                    fallback=self.DEF_CONFIG['compression_max_entropy']))
+        self.set_dedup(
+            cfg.get('DEFAULT', 'dedup', fallback=self.DEF_CONFIG['dedup']))
+        self.set_dedup_index(self._add_path(
+            cfg.get('DEFAULT', 'dedup_index',
+                    fallback=self.DEF_CONFIG['dedup_index'])))
+        self.set_dedup_chunk_kbytes(
+            cfg.get('DEFAULT', 'dedup_chunk_kbytes',
+                    fallback=self.DEF_CONFIG['dedup_chunk_kbytes']))
+        self.set_checkpoint_segments(
+            cfg.get('DEFAULT', 'checkpoint_segments',
+                    fallback=self.DEF_CONFIG['checkpoint_segments']))
+        self.set_envelope(
+            cfg.get('DEFAULT', 'envelope',
+                    fallback=self.DEF_CONFIG['envelope']))
+        self.set_direct_io(
+            cfg.get('DEFAULT', 'direct_io',
+                    fallback=self.DEF_CONFIG['direct_io']))
+        self.set_stats_checksums(
+            cfg.get('DEFAULT', 'stats_checksums',
+                    fallback=self.DEF_CONFIG['stats_checksums']))
+        self.set_s3_upload_config(self._add_path(
+            cfg.get('DEFAULT', 's3_upload_config',
+                    fallback=self.DEF_CONFIG['s3_upload_config'])))
         return
 
 
@@ -121,6 +264,17 @@ class EncConf(object):
 
 
 
+    def _strip_path(self, path=None):
+        '''Reverse of _add_path().  Paths under the top level directory are
+        written relative to it so a configuration file which has been read
+        can be built again unchanged.
+        '''
+        if path.startswith(self.TOP_DIR + os.sep):
+            return path[len(self.TOP_DIR + os.sep):]
+        return path
+
+
+
 
     def set_encryption_method(self, encryption_method=None):
         '''Set the encryption method to one of the accepted methods understood
@@ -148,7 +302,7 @@ class EncConf(object):
 
 
     def set_keyfile(self, keyfile=None):
-        '''If encryption_method is "AES-GCM" set the file containing the
+        '''Unless encryption_method is "GPG" set the file containing the
         master key to encrypt or decrypt files.  The master key is used
         to derive another key which will be used to do the encryption.
         '''
@@ -187,6 +341,231 @@ class EncConf(object):
 
 
 
+    def set_file_format_version(self, file_format_version=None):
+        '''Set the file format of newly encrypted files.
+
+        {}
+        '''.format(self.FILE_FORMAT_VERSIONS)
+        if file_format_version == None: return
+        if int(file_format_version) not in self.FILE_FORMAT_VERSIONS:
+            raise Exception('File format version "{}" not understood'.format(
+                file_format_version))
+        self.file_format_version = int(file_format_version)
+        return
+
+
+
+    def set_segment_size_kbytes(self, segment_size_kbytes=None):
+        '''Set the kilobytes of plaintext in each segment of file format 2.
+        '''
+        if segment_size_kbytes == None: return
+        if int(segment_size_kbytes) < 1:
+            raise Exception('Segment size must be at least 1 KB')
+        self.segment_size_kbytes = int(segment_size_kbytes)
+        return
+
+
+
+    def set_kdf(self, kdf=None):
+        '''Set the key derivation used for newly encrypted files in format 2.
+
+        {}
+        '''.format(self.KDFS)
+        if kdf == None: return
+        if kdf not in self.KDFS:
+            raise Exception('Key derivation "{}" not understood'.format(kdf))
+        self.kdf = kdf
+        return
+
+
+
+    def set_io_buffers(self, io_buffers=None):
+        '''Set the number of chunks buffered between reading, encrypting, and
+        writing.  With 1 all three happen one after another in one thread.
+        '''
+        if io_buffers == None: return
+        if int(io_buffers) < 1:
+            raise Exception('Number of I/O buffers must be at least 1')
+        self.io_buffers = int(io_buffers)
+        return
+
+
+
+    def set_use_mmap(self, use_mmap=None):
+        '''Set whether to map files into memory rather than read them.
+        Accepts True or False either as a boolean or as a string.
+        '''
+        if use_mmap == None: return
+        if str(use_mmap).lower() not in ['true', 'false']:
+            raise Exception('use_mmap must be True or False not "{}"'.format(
+                use_mmap))
+        self.use_mmap = str(use_mmap).lower() == 'true'
+        return
+
+
+
+    def set_auto_chunk_size(self, auto_chunk_size=None):
+        '''Set whether the chunk size, or segment size for file format 2, is
+        picked for each file from its size.  The configured size is then the
+        largest used.  Accepts True or False either as a boolean or as a
+        string.
+        '''
+        if auto_chunk_size == None: return
+        if str(auto_chunk_size).lower() not in ['true', 'false']:
+            raise Exception(
+                'auto_chunk_size must be True or False not "{}"'.format(
+                    auto_chunk_size))
+        self.auto_chunk_size = str(auto_chunk_size).lower() == 'true'
+        return
+
+
+
+    def set_compression(self, compression=None):
+        '''Set the compression applied to files before they are encrypted in
+        format 2.
+
+        {}
+        '''.format(self.COMPRESSIONS)
+        if compression == None: return
+        if compression not in self.COMPRESSIONS:
+            raise Exception('Compression "{}" not understood'.format(
+                compression))
+        self.compression = compression
+        return
+
+
+
+    def set_compression_max_entropy(self, compression_max_entropy=None):
+        '''Set the entropy in bits per byte, from 0 to 8, at or above which a
+        file is taken to be already compressed and is not compressed again.
+        '''
+        if compression_max_entropy == None: return
+        if not 0 <= float(compression_max_entropy) <= 8:
+            raise Exception('compression_max_entropy must be from 0 to 8')
+        self.compression_max_entropy = float(compression_max_entropy)
+        return
+
+
+
+    def set_dedup(self, dedup=None):
+        '''Set whether files are stored as recipes of deduplicated chunks.
+        Accepts True or False either as a boolean or as a string.
+        '''
+        if dedup == None: return
+        if str(dedup).lower() not in ['true', 'false']:
+            raise Exception('dedup must be True or False not "{}"'.format(dedup))
+        self.dedup = str(dedup).lower() == 'true'
+        return
+
+
+
+    def set_dedup_index(self, dedup_index=None):
+        '''Set the SQLite file indexing the chunks already stored.
+        '''
+        if dedup_index == None: return
+        self.dedup_index = dedup_index
+        return
+
+
+
+    def set_dedup_chunk_kbytes(self, dedup_chunk_kbytes=None):
+        '''Set the average size of deduplicated chunks.  It must be a power
+        of 2.
+        '''
+        if dedup_chunk_kbytes == None: return
+        kbytes = int(dedup_chunk_kbytes)
+        if kbytes < 1 or kbytes & (kbytes - 1) != 0:
+            raise Exception('dedup_chunk_kbytes must be a power of 2 not "{}"'.format(
+                dedup_chunk_kbytes))
+        self.dedup_chunk_kbytes = kbytes
+        return
+
+
+
+    def set_checkpoint_segments(self, checkpoint_segments=None):
+        '''Set the number of segments between checkpoints of file format 2.
+        0 turns checkpoints off.
+        '''
+        if checkpoint_segments == None: return
+        if int(checkpoint_segments) < 0:
+            raise Exception('checkpoint_segments must be 0 or more')
+        self.checkpoint_segments = int(checkpoint_segments)
+        return
+
+
+
+    def set_envelope(self, envelope=None):
+        '''Set whether files in format 2 are encrypted with a random data key
+        which is wrapped by a key derived from the master key.  Accepts True
+        or False either as a boolean or as a string.
+        '''
+        if envelope == None: return
+        if str(envelope).lower() not in ['true', 'false']:
+            raise Exception('envelope must be True or False not "{}"'.format(
+                envelope))
+        self.envelope = str(envelope).lower() == 'true'
+        return
+
+
+
+    def set_direct_io(self, direct_io=None):
+        '''Set whether large files are read with O_DIRECT so they bypass the
+        page cache altogether.  Accepts True or False either as a boolean or
+        as a string.
+        '''
+        if direct_io == None: return
+        if str(direct_io).lower() not in ['true', 'false']:
+            raise Exception('direct_io must be True or False not "{}"'.format(
+                direct_io))
+        self.direct_io = str(direct_io).lower() == 'true'
+        return
+
+
+
+    def set_stats_checksums(self, checksums=None):
+        '''Set the checksums written to the stats file along with the sha512
+        from a comma separated list.  'none' writes no others.
+        '''
+        if checksums == None: return
+        methods = [c.strip() for c in checksums.split(',') if c.strip() != '']
+        if methods == ['none']: methods = []
+        for method in methods:
+            if method not in self.STATS_CHECKSUMS:
+                raise Exception('Stats checksum "{}" not in accepted list\n"{}"'.format(
+                    method, self.STATS_CHECKSUMS))
+            check_method(method)
+        self.stats_checksums = methods
+        return
+
+
+
+    def _join(self, checksums=None):
+        '''Reverse of set_stats_checksums().
+        '''
+        if len(checksums) == 0: return 'none'
+        return ', '.join(checksums)
+
+
+
+    def set_s3_upload_config(self, s3_upload_config=None):
+        '''Set aws_s3.cfg of s3_upload and take mp_threshold and
+        mp_chunksize from it.  Without it the s3_etag cannot be calculated
+        and is left out of stats_checksums.
+        '''
+        if s3_upload_config == None: return
+        self.s3_upload_config = s3_upload_config
+        (self.mp_threshold, self.mp_chunksize) = (None, None)
+        settings = read_part_settings(s3_upload_config)
+        if settings != None:
+            (self.mp_threshold, self.mp_chunksize) = settings
+        elif 's3_etag' in self.stats_checksums:
+            self.log.warning('Cannot read "{}".  Leaving out s3_etag.'.format(
+                s3_upload_config))
+            self.stats_checksums.remove('s3_etag')
+        return
+
+
+
     def print(self):
         '''Report on the details read from the configuration file.
         '''
@@ -197,6 +576,30 @@ class EncConf(object):
         report += '{:<25} {}\n'.format('chunk_size_kbytes', self.chunk_size_kbytes)
         report += '{:<25} {}\n'.format('key_size_bytes', self.key_size_bytes)
         report += '{:<25} {}\n'.format('nonce_size_bytes', self.nonce_size_bytes)
+        report += '{:<25} {}\n'.format('file_format_version',
+                                       self.file_format_version)
+        report += '{:<25} {}\n'.format('segment_size_kbytes',
+                                       self.segment_size_kbytes)
+        report += '{:<25} {}\n'.format('kdf', self.kdf)
+        report += '{:<25} {}\n'.format('io_buffers', self.io_buffers)
+        report += '{:<25} {}\n'.format('use_mmap', self.use_mmap)
+        report += '{:<25} {}\n'.format('auto_chunk_size',
+                                       self.auto_chunk_size)
+        report += '{:<25} {}\n'.format('compression', self.compression)
+        report += '{:<25} {}\n'.format('compression_max_entropy',
+                                       self.compression_max_entropy)
+        report += '{:<25} {}\n'.format('dedup', self.dedup)
+        report += '{:<25} {}\n'.format('dedup_index', self.dedup_index)
+        report += '{:<25} {}\n'.format('dedup_chunk_kbytes',
+                                       self.dedup_chunk_kbytes)
+        report += '{:<25} {}\n'.format('checkpoint_segments',
+                                       self.checkpoint_segments)
+        report += '{:<25} {}\n'.format('envelope', self.envelope)
+        report += '{:<25} {}\n'.format('direct_io', self.direct_io)
+        report += '{:<25} {}\n'.format('stats_checksums',
+                                       self._join(self.stats_checksums))
+        report += '{:<25} {}\n'.format('s3_upload_config',
+                                       self.s3_upload_config)
         report += '{}\n'.format('='*76)
         return report
 
@@ -215,10 +618,28 @@ class EncConf(object):
         cfg += '[DEFAULT]\n'
         cfg += 'encryption_method = {}\n'.format(self.encryption_method)
         cfg += 'gpg_key = {}\n'.format(self.gpg_key)
-        cfg += 'keyfile = {}\n'.format(self.keyfile)
+        cfg += 'keyfile = {}\n'.format(self._strip_path(self.keyfile))
         cfg += 'chunk_size_kbytes = {}\n'.format(self.chunk_size_kbytes)
         cfg += 'key_size_bytes = {}\n'.format(self.key_size_bytes)
         cfg += 'nonce_size_bytes = {}\n'.format(self.nonce_size_bytes)
+        cfg += 'file_format_version = {}\n'.format(self.file_format_version)
+        cfg += 'segment_size_kbytes = {}\n'.format(self.segment_size_kbytes)
+        cfg += 'kdf = {}\n'.format(self.kdf)
+        cfg += 'io_buffers = {}\n'.format(self.io_buffers)
+        cfg += 'use_mmap = {}\n'.format(self.use_mmap)
+        cfg += 'auto_chunk_size = {}\n'.format(self.auto_chunk_size)
+        cfg += 'compression = {}\n'.format(self.compression)
+        cfg += 'compression_max_entropy = {}\n'.format(
+            self.compression_max_entropy)
+        cfg += 'dedup = {}\n'.format(self.dedup)
+        cfg += 'dedup_index = {}\n'.format(self._strip_path(self.dedup_index))
+        cfg += 'dedup_chunk_kbytes = {}\n'.format(self.dedup_chunk_kbytes)
+        cfg += 'checkpoint_segments = {}\n'.format(self.checkpoint_segments)
+        cfg += 'envelope = {}\n'.format(self.envelope)
+        cfg += 'direct_io = {}\n'.format(self.direct_io)
+        cfg += 'stats_checksums = {}\n'.format(self._join(self.stats_checksums))
+        cfg += 's3_upload_config = {}\n'.format(
+            self._strip_path(self.s3_upload_config))
         cfg += '\n{}\n# END\n{}\n'.format(div, div)
         return cfg
 
@@ -235,6 +656,10 @@ class EncConf(object):
 #       '''.format(__class__)
         header += '''
 # encryption_method            Method used to encrypt and decrypt files.
+#                              ChaCha20-Poly1305 is faster than AES-GCM
+#                              without AES instructions in the CPU.  auto
+#                              times both and uses the faster.  Format 1
+#                              files are always AES-GCM.
 #                              ACCEPTED METHODS:
 #                              [{}]
 #                              [DEFAULT: {}]
@@ -260,6 +685,142 @@ class EncConf(object):
 # nonce_size_bytes             Nonce size.
 #                              [DEFAULT: {}]
 #       '''.format(self.DEF_CONFIG['nonce_size_bytes'])
+        header += '''
+# file_format_version          Format of newly encrypted files.  Files in
+#                              either format can always be decrypted.
+#                                1 = Single stream with tag, salt, and nonce
+#                                    at the beginning of the file.
+#                                2 = Segments encrypted in parallel, each
+#                                    with its own nonce and tag.
+#                              ACCEPTED VERSIONS:
+#                              [{}]
+#                              [DEFAULT: {}]
+#       '''.format(self.FILE_FORMAT_VERSIONS,
+                   self.DEF_CONFIG['file_format_version'])
+        header += '''
+# segment_size_kbytes          Plaintext size of each segment for file
+#                              format 2.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['segment_size_kbytes'])
+        header += '''
+# kdf                          Key derivation for file format 2.
+#                                PBKDF2 = Stretch the master key for every
+#                                         file.
+#                                HKDF   = Stretch the master key once per run
+#                                         and derive each file key with HKDF.
+#                              ACCEPTED KEY DERIVATIONS:
+#                              [{}]
+#                              [DEFAULT: {}]
+#       '''.format(self.KDFS, self.DEF_CONFIG['kdf'])
+        header += '''
+# io_buffers                   Number of chunks buffered between the threads
+#                              reading, encrypting, and writing a file so disk
+#                              and cipher work at the same time.  1 turns the
+#                              threads off.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['io_buffers'])
+        header += '''
+# use_mmap                     Map files in the single stream format into
+#                              memory rather than reading them.  True or
+#                              False.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['use_mmap'])
+        header += '''
+# auto_chunk_size              Pick the chunk size, or the segment size for
+#                              file format 2, of each file from its size.
+#                              chunk_size_kbytes and segment_size_kbytes are
+#                              then the largest sizes used.  True or False.
+#                              Run autotune.py to find the best sizes for the
+#                              local disk.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['auto_chunk_size'])
+        header += '''
+# compression                  Compress files before encrypting them in file
+#                              format 2.  zstd needs the zstandard package.
+#                              Files which look already compressed are left
+#                              alone, see compression_max_entropy.
+#                              ACCEPTED COMPRESSION METHODS:
+#                              [{}]
+#                              [DEFAULT: {}]
+#       '''.format(self.COMPRESSIONS, self.DEF_CONFIG['compression'])
+        header += '''
+# compression_max_entropy      Samples of each file are read first.  If any
+#                              has an entropy of this many bits per byte or
+#                              more (8 is random data) the file is not
+#                              compressed.  Files named like compressed
+#                              formats such as .gz or .mp4 are never
+#                              compressed.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['compression_max_entropy'])
+        header += '''
+# dedup                        Split files into chunks by their content and
+#                              encrypt only chunks not stored before.  Each
+#                              file becomes FILENAME.recipe.enc listing its
+#                              chunks plus a chunk-ID.enc file for every new
+#                              chunk.  True or False.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['dedup'])
+        header += '''
+# dedup_index                  SQLite file indexing the chunks already
+#                              stored.  Delete it to store every chunk again.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['dedup_index'])
+        header += '''
+# dedup_chunk_kbytes           Average chunk size.  A power of 2.  Chunks
+#                              are from a quarter to 8 times this size.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['dedup_chunk_kbytes'])
+        header += '''
+# checkpoint_segments          Files in format 2 larger than this many
+#                              segments are flushed to disk and checkpointed
+#                              every this many segments.  If encrypting is
+#                              interrupted, running it again on the same
+#                              unchanged file resumes from the last
+#                              checkpoint.  0 turns checkpoints off.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['checkpoint_segments'])
+        header += '''
+# envelope                     Encrypt each file in format 2 with a random
+#                              data key and store that key in the header
+#                              wrapped by the master key.  A new master key
+#                              then only needs the header of each file
+#                              rewritten, see aes_rewrap.py.  True or False.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['envelope'])
+        header += '''
+# direct_io                    Files of 64 MB or more are always streamed
+#                              with hints which keep them from filling the
+#                              page cache.  With True they are also read with
+#                              O_DIRECT, skipping the page cache altogether,
+#                              where the system and file system allow.  True
+#                              or False.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['direct_io'])
+        header += '''
+# stats_checksums              Comma separated checksums of each encrypted
+#                              file written to FILENAME.enc.stats along with
+#                              the sha512 by --write-stats, or 'none'.  They
+#                              are calculated while the file is written, so
+#                              create_metadata.py --use-stats need not read
+#                              it.  Match extra_checksums in metadata.cfg of
+#                              create_metadata.  Any of
+#                                  md5      MD5 of the file.
+#                                  sha256   SHA256 of the file.
+#                                  crc32c   CRC32C of the file.  Needs the
+#                                           crc32c package.
+#                                  s3_etag  ETag S3 gives the file once
+#                                           uploaded by s3_upload.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['stats_checksums'])
+        header += '''
+# s3_upload_config             aws_s3.cfg of s3_upload.  The s3_etag is
+#                              calculated for the part size its
+#                              mp_threshold and mp_chunksize give.  If it
+#                              cannot be read s3_etag is left out.
+#                              Relative to the top level directory unless it
+#                              starts with '/'.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['s3_upload_config'])
         return header
 
 
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import struct
+
+
+class EncHeader(object):
+    '''Header of the segmented '.enc' file format.
+
+    The plaintext is split into segments of a fixed size.  Each segment is
+    encrypted on its own with a nonce derived from the nonce prefix, the
+    segment number, and a flag marking the last segment (STREAM construction).
+    Every segment carries its own tag and the whole header is authenticated
+    with each segment.  Segments can therefore be encrypted or decrypted
+    independently and out of order, and a truncated or reordered file fails
+    authentication.
+
+    FILE LAYOUT
+        MAGIC           8 bytes
+        version         1 byte
+        cipher          1 byte    1 for AES-GCM, 2 for ChaCha20-Poly1305.
+        kdf             1 byte
+        flags           1 byte    1 for envelope encryption.
+        key_size        1 byte
+        salt_size       1 byte
+        nonce_size      1 byte
+        compression     1 byte    0 for none.  Formerly reserved.
+        segment_size    4 bytes   Plaintext bytes per segment.
+        salt            salt_size bytes
+        nonce_prefix    nonce_size - 5 bytes
+        kdf_salt        salt_size bytes, only with the HKDF key derivation.
+        wrapped_key     key_size + 8 bytes, only with envelope encryption.
+        segments        Segment ciphertext followed by a 16 byte tag.  All
+                        segments are segment_size bytes except the last
+                        which may be shorter.
+
+    SEGMENT NONCE
+        nonce_prefix + segment number (4 bytes) + last segment flag (1 byte)
+
+    COMPRESSION
+        With compression set the plaintext is compressed as a single stream
+        before it is split into segments, so segment_size counts compressed
+        bytes.  Such files cannot be decrypted by range.
+
+    KEY DERIVATION
+        PBKDF2          The file key is derived from the master key and salt
+                        with PBKDF2-HMAC-SHA256 for every file.
+
+        HKDF            The master key is stretched once per run with
+                        PBKDF2-HMAC-SHA256 and kdf_salt, which is shared by
+                        every file of the run.  The file key is then derived
+                        from the stretched key and salt with HKDF-SHA256.
+
+    ENVELOPE ENCRYPTION
+        With the envelope flag set the segments are encrypted with a random
+        data key.  The key derived as above only wraps the data key with AES
+        Key Wrap (RFC 3394) and the result is stored as wrapped_key.  The
+        wrapped key is left out of the header bytes authenticated with each
+        segment, so a new master key only needs wrapped_key rewritten.
+
+    Files in the original single stream format do not start with MAGIC.  They
+    are laid out as tag (16 bytes), salt, nonce, and ciphertext.
+
+    ATTRIBUTES
+        version            Format version.
+
+        cipher             Name of the cipher.
+
+        kdf                Name of the key derivation.
+
+        flags              Format flags.
+
+        key_size           Size of the derived key in bytes.
+
+        salt_size          Size of the salt in bytes.
+
+        nonce_size         Size of each segment nonce in bytes.
+
+        compression        Name of the compression applied before
+                           encrypting.
+
+        segment_size       Plaintext bytes per segment.
+
+        salt               Salt used to derive the key.
+
+        kdf_salt           Salt used to stretch the master key for the HKDF
+                           key derivation.
+
+        nonce_prefix       Random prefix of every segment nonce.
+
+        wrapped_key        Data key wrapped by the key derived from the
+                           master key.  Only with envelope encryption.
+
+    METHODS
+        aad                Return the header bytes authenticated with every
+                           segment.
+
+        envelope           Return True if the file uses envelope encryption.
+
+        is_segmented       Return True if the bytes start a segmented file.
+
+        pack               Return the header as bytes.
+
+        read               Read the header from the beginning of a file object.
+
+        size               Size of the header in bytes.
+
+        segment_nonce      Return the nonce for a segment.
+
+    '''
+
+    MAGIC = b'\x89ENC\r\n\x1a\n'
+    VERSION = 2
+    TAG_SIZE = 16
+    COUNTER_SIZE = 5   # 4 byte segment number + 1 byte last segment flag.
+    FLAG_ENVELOPE = 0x01
+    WRAP_OVERHEAD = 8  # AES Key Wrap adds 8 bytes to the wrapped key.
+    CIPHERS = { 'AES-GCM' : 1, 'ChaCha20-Poly1305' : 2 }
+    KDFS = { 'PBKDF2' : 1, 'HKDF' : 2 }
+    COMPRESSIONS = { 'none' : 0, 'zlib' : 1, 'lzma' : 2, 'zstd' : 3 }
+    _FIXED = struct.Struct('>8sBBBBBBBBI')
+
+
+
+    def __init__(self,
+                 cipher='AES-GCM',
+                 kdf='PBKDF2',
+                 flags=0,
+                 key_size=32,
+                 salt=b'',
+                 nonce_size=12,
+                 nonce_prefix=b'',
+                 segment_size=1024 * 1024,
+                 kdf_salt=b'',
+                 compression='none',
+                 wrapped_key=b''):
+        self.version = self.VERSION
+        self.cipher = cipher
+        self.kdf = kdf
+        self.flags = flags
+        self.key_size = key_size
+        self.salt = salt
+        self.salt_size = len(salt)
+        self.nonce_size = nonce_size
+        self.nonce_prefix = nonce_prefix
+        self.segment_size = segment_size
+        self.kdf_salt = kdf_salt
+        self.compression = compression
+        self.wrapped_key = wrapped_key
+        return
+
+
+
+    def is_segmented(self, data=None):
+        '''Return True if the bytes passed begin with the magic number of the
+        segmented format.
+        '''
+        return data[:len(self.MAGIC)] == self.MAGIC
+
+
+
+    def envelope(self):
+        '''Return True if the file uses envelope encryption.
+        '''
+        return bool(self.flags & self.FLAG_ENVELOPE)
+
+
+
+    def pack(self):
+        '''Return the header as bytes.
+        '''
+        return self.aad() + self._wrapped_key_data()
+
+
+
+    def aad(self):
+        '''Return the header bytes authenticated with every segment.  That is
+        the whole header except the wrapped key.
+        '''
+        if self.nonce_size - self.COUNTER_SIZE != len(self.nonce_prefix):
+            raise Exception('Nonce prefix must be {} bytes'.format(
+                self.nonce_size - self.COUNTER_SIZE))
+        header = self._FIXED.pack(self.MAGIC,
+                                  self.version,
+                                  self.CIPHERS[self.cipher],
+                                  self.KDFS[self.kdf],
+                                  self.flags,
+                                  self.key_size,
+                                  len(self.salt),
+                                  self.nonce_size,
+                                  self.COMPRESSIONS[self.compression],
+                                  self.segment_size)
+        if self.kdf == 'HKDF' and len(self.kdf_salt) != len(self.salt):
+            raise Exception('Key derivation salt must be {} bytes'.format(
+                len(self.salt)))
+        return header + self.salt + self.nonce_prefix + self._kdf_data()
+
+
+
+    def _kdf_data(self):
+        '''Bytes in the header specific to the key derivation.
+        '''
+        if self.kdf == 'HKDF': return self.kdf_salt
+        return b''
+
+
+
+    def _wrapped_key_data(self):
+        '''Bytes in the header holding the wrapped data key.
+        '''
+        if not self.envelope(): return b''
+        if len(self.wrapped_key) != self.key_size + self.WRAP_OVERHEAD:
+            raise Exception('Wrapped key must be {} bytes'.format(
+                self.key_size + self.WRAP_OVERHEAD))
+        return self.wrapped_key
+
+
+
+    def read(self, fileobj=None):
+        '''Read the header from the current position of a file object.
+        Return the header bytes read which are authenticated with every
+        segment, which leaves out the wrapped key.
+        '''
+        fixed = fileobj.read(self._FIXED.size)
+        if len(fixed) != self._FIXED.size or not self.is_segmented(fixed):
+            raise Exception('Not a segmented encrypted file')
+        (magic,
+         self.version,
+         cipher,
+         kdf,
+         self.flags,
+         self.key_size,
+         self.salt_size,
+         self.nonce_size,
+         compression,
+         self.segment_size) = self._FIXED.unpack(fixed)
+        if self.version != self.VERSION:
+            raise Exception('Unsupported file format version {}'.format(
+                self.version))
+        self.cipher = self._lookup(self.CIPHERS, cipher, 'cipher')
+        self.kdf = self._lookup(self.KDFS, kdf, 'key derivation')
+        self.compression = self._lookup(self.COMPRESSIONS, compression,
+                                        'compression')
+        self.salt = fileobj.read(self.salt_size)
+        self.nonce_prefix = fileobj.read(self.nonce_size - self.COUNTER_SIZE)
+        self.kdf_salt = b''
+        if self.kdf == 'HKDF':
+            self.kdf_salt = fileobj.read(self.salt_size)
+            if len(self.kdf_salt) != self.salt_size:
+                raise Exception('Truncated header')
+        if len(self.nonce_prefix) != self.nonce_size - self.COUNTER_SIZE:
+            raise Exception('Truncated header')
+        if self.flags & ~self.FLAG_ENVELOPE:
+            raise Exception('Unknown flags "{}" in header'.format(self.flags))
+        self.wrapped_key = b''
+        if self.envelope():
+            self.wrapped_key = fileobj.read(self.key_size + self.WRAP_OVERHEAD)
+            if len(self.wrapped_key) != self.key_size + self.WRAP_OVERHEAD:
+                raise Exception('Truncated header')
+        return fixed + self.salt + self.nonce_prefix + self._kdf_data()
+
+
+
+    def _lookup(self, table=None, value=None, name=None):
+        for k in table.keys():
+            if table[k] == value: return k
+        raise Exception('Unknown {} "{}" in header'.format(name, value))
+
+
+
+    def size(self):
+        '''Size of the header in bytes.
+        '''
+        wrapped = 0
+        if self.envelope(): wrapped = self.key_size + self.WRAP_OVERHEAD
+        return self._FIXED.size + self.salt_size + (
+            self.nonce_size - self.COUNTER_SIZE) + len(self._kdf_data()) + wrapped
+
+
+
+    def segment_nonce(self, index=None, last=False):
+        '''Return the nonce for segment number 'index'.  The last segment of
+        the file uses a different nonce so that truncation is detected.
+        '''
+        if index >= 2 ** 32:
+            raise Exception('Too many segments')
+        return self.nonce_prefix + struct.pack('>IB', index, int(last))
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import os
+import time
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from mylog import MyLog
+from enc_conf import EncConf
+from aes_batch import AESBatch
+
+
+
+class GPGBatch(AESBatch):
+    '''Encrypt or decrypt many files with the 'gpg' executable, running up
+    to 'jobs' gpg processes at the same time.  The user manages the GPG
+    keyring and key separately.  Files are encrypted to the 'gpg_key' set in
+    the configuration file and written next to the original as FILENAME.asc.
+
+    Each gpg process runs with its status output captured so that every file
+    gets its own result, as with AESBatch.  gpg does the work, so the pool
+    is made of threads which only wait on the processes.
+
+    ATTRIBUTES
+        debug              Enable debug mode.  The gpg status lines of each
+                           file are logged.
+
+        loglevel           Set the python log level.
+
+        showprogress       Show a single progress bar via tqdm for all files.
+                           It moves as each file finishes.
+
+        jobs               Number of gpg processes at once.
+                           [DEFAULT: number of cores]
+
+        config             EncConf instance to use instead of reading the
+                           configuration file.
+
+        results            Dictionary of per file results after run().  See
+                           AESBatch.
+
+    METHODS
+        run                Run 'encrypt' or 'decrypt' against a list of files.
+
+        failed             Return the list of files which failed.
+
+        report             Return a formatted report of the results.
+
+    '''
+    ACTIONS = ['encrypt', 'decrypt']
+    EXTENSION = '.asc'
+
+    def __init__(self, debug=False, loglevel='WARNING', showprogress=False,
+                 jobs=None, config=None):
+        super().__init__(debug=debug, loglevel=loglevel,
+                         showprogress=showprogress, jobs=jobs, config=config)
+        program=__class__.__name__
+        l = MyLog(program=program, debug=debug, loglevel=loglevel)
+        self.log = l.log
+        cfg = config
+        if cfg == None:
+            cfg = EncConf(debug=debug, loglevel=loglevel)
+            cfg.read()
+        self.recipient = cfg.gpg_key
+        self.gpg = shutil.which('gpg')
+        if self.gpg == None:
+            raise Exception('Cannot find "gpg" in the execution path')
+        return
+
+
+
+    def _command(self, action, filename):
+        '''Return the gpg command line for a single file.  Status lines go to
+        STDOUT, which is otherwise unused as the output is written to a file.
+        '''
+        cmd = [self.gpg, '--batch', '--status-fd', '1']
+        if action == 'encrypt':
+            cmd += ['--armor', '--encrypt', '--recipient', self.recipient,
+                    '--output', filename + self.EXTENSION]
+        else:
+            cmd += ['--decrypt',
+                    '--output', filename[:-len(self.EXTENSION)]]
+        cmd.append(filename)
+        return cmd
+
+
+
+    def _gpg(self, action, filename):
+        '''Run gpg against a single file.
+
+        RETURN
+                Seconds taken.  Raises an Exception with the reason gpg gave
+                if it failed.
+        '''
+        if action == 'decrypt' and not filename.endswith(self.EXTENSION):
+            raise Exception('Not encrypted with GPG "{}"'.format(filename))
+        self.log.debug('{} "{}"'.format(action.capitalize(), filename))
+        start = time.time()
+        p = subprocess.run(self._command(action, filename),
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE,
+                           text=True)
+        seconds = time.time() - start
+        for line in p.stdout.splitlines():
+            self.log.debug('{}: {}'.format(os.path.basename(filename), line))
+        if p.returncode != 0:
+            errors = [line.strip() for line in p.stderr.splitlines()
+                      if line.strip() != '']
+            reason = 'gpg exited with {}'.format(p.returncode)
+            if len(errors) > 0: reason += ': {}'.format(errors[-1])
+            raise Exception(reason)
+        return seconds
+
+
+
+    def _run_serial(self, action, files, bar):
+        for f in files:
+            try:
+                self._set_result(f, 'OK', self._gpg(action, f))
+            except Exception as e:
+                self._set_result(f, 'FAILED', None, e)
+            if bar is not None: bar.update(self.results[f]['size'])
+        return
+
+
+
+    def _run_pool(self, action, files, jobs, bar):
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {}
+            for f in files:
+                futures[pool.submit(self._gpg, action, f)] = f
+            for future in as_completed(futures):
+                f = futures[future]
+                try:
+                    self._set_result(f, 'OK', future.result())
+                except Exception as e:
+                    self._set_result(f, 'FAILED', None, e)
+                if bar is not None: bar.update(self.results[f]['size'])
+        return
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
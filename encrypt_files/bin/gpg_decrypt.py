@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import os
+import argparse
+from mylog import MyLog
+from gpg_batch import GPGBatch
+
+
+
+def parse_arguments():
+    '''Parse arguments.  decrypt_files.sh passes the same options whatever
+    the encryption method, so the options of aes_decrypt.py are accepted
+    too.  --verify-only and --range cannot be done with GPG and are an
+    error rather than decrypting whole files.  Anything else unknown is an
+    error rather than being taken for a file to decrypt.
+    '''
+    parser = argparse.ArgumentParser(description='''Decrypt multiple
+    files with GPG.  gpg prompts for the passphrase of the key through the
+    gpg-agent.''')
+    parser.add_argument('--debug', action='store_true',
+        default=False,
+        help='Verbose output.')
+    parser.add_argument('--loglevel', action='store', default='WARNING',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level.')
+    parser.add_argument('--showprogress', action='store_true',
+        default=False,
+        help='Show a progress bar which moves as each file finishes.')
+    parser.add_argument('--jobs', action='store', type=int,
+        default=os.cpu_count(),
+        help='Number of gpg processes to run at the same time.')
+    parser.add_argument('--verify-only', action='store_true',
+        default=False,
+        help='Not implemented with GPG.')
+    parser.add_argument('--range', action='store', type=str,
+        default=None,
+        help='Not implemented with GPG.')
+    parser.add_argument('--stats-file', action='store', type=str,
+        default=None,
+        help='''Append a line of JSON per file to this file with its status
+        and the seconds taken.''')
+    parser.add_argument('files', action='store', nargs='+',
+        type=str, default=None,
+        help='Files ending in ".asc" to process.')
+    args = parser.parse_args()
+    if args.verify_only == True:
+        parser.error('--verify-only is not implemented with GPG')
+    if args.range != None:
+        parser.error('--range is not implemented with GPG')
+    return args
+
+
+
+def check_file(filename):
+    if not filename.endswith(GPGBatch.EXTENSION):
+        raise Exception('Not encrypted with GPG "{}"'.format(filename))
+    decrypted_name = filename[:-len(GPGBatch.EXTENSION)]
+    if os.path.exists(decrypted_name):
+        raise Exception('Cannot decrypt!  Target file already exists "{}"'.format(
+            decrypted_name))
+    return
+
+
+
+def main():
+    args = parse_arguments()
+    l = MyLog(debug=args.debug, loglevel=args.loglevel)
+    log = l.log
+
+    batch = GPGBatch(debug=args.debug,
+                     loglevel=args.loglevel,
+                     showprogress=args.showprogress,
+                     jobs=args.jobs)
+
+    for file in args.files:
+        check_file(os.path.realpath(file))
+
+    batch.run(action='decrypt', files=args.files)
+    if args.stats_file != None: batch.append_stats_file(args.stats_file)
+    if len(batch.failed()) > 0:
+        log.error('Failed to decrypt files{}'.format(batch.report()))
+        return 1
+    log.info('Decrypted files{}'.format(batch.report()))
+    return
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
@@ -13,109 +13,23 @@ set -euf -o pipefail
 #
 # Some versions of python "activate" fail if -u is set.
 
-function print_usage() {
-    _prog=${1}
-    cat <<EOF
-Usage: ${_prog} [ OPTIONS ] FILE [FILE ...]
-
-Decrypt files using the GPG command line.
-
-This script is a wrapper around GPG and expects the user to have a GPG
-keyring which they manage separately.  The 'gpg' executible is also expected
-to be in the user execution path.
-
-
-OPTIONS
-    --help         Print this usage and exit.
-
-    --debug        Enable debug mode.
-
-The '--showprogress' and '--loglevel' are not implemented and will be
-ignored with a warning message.
-
-
-EOF
-    unset _prog
-    return 0
-}
-
-
-# usage: loggit PROGRAM_NAME PRIORITY "MESSAGE"
-function loggit() {
-    local _prog=${1}
-    shift
-    local _big_priority="$(echo ${1} | tr [:lower:] [:upper:])"
-    local _small_priority="$(echo ${1} | tr [:upper:] [:lower:])"
-    shift
-    local _msg="[$(date +"%Y-%m-%d %H:%M:%S %z")] ${_prog}(${$}) ${_big_priority} ${@}"
-    echo >&2 "${_msg}"
-    logger -p syslog.${_small_priority} -t "${_prog}" "${@}"
-    unset _prog _big_priority _small_priority _msg
-    return 0
-}
-
-
 TOP_DIR="$(dirname $(dirname $(realpath ${BASH_SOURCE[0]})))"
-PROG="$(basename ${BASH_SOURCE[0]})"
-
-# GPG requirements.
-GPG="$(which gpg)"
-
-# Pull options beginning with '-'.
-while [[ "X${1:0:1}" == "X-" ]]; do
-    case "${1}" in
-        --help)
-            print_usage ${PROG}
-            exit 0
-            ;;
-        --debug) 
-            DEBUG="True"
-            shift
-            ;;
-        *)
-            loggit ${PROG} WARNING "Option not implemented. Ignoring \"$1\"."
-            shift
-            ;;
-    esac
-done
-DEBUG=${DEBUG:="False"}
-GPG_OPTS="--batch --decrypt"
-
-# If --debug is requested, add some extra.
-if [[ "X${DEBUG}" == "XTrue" ]]; then
-    GPG_OPTS="${GPG_OPTS} --status-fd=2"
+if [[ ! -d "${TOP_DIR}/ve3" ]]; then
+    pushd ${TOP_DIR} 1>/dev/null 2>/dev/null
+    python3 -m venv ve3
+    [[ -s requirements.txt ]] && OPTS="-r requirements.txt"
+    OPTS="${OPTS:=''}"
+    # STDOUT may be carrying a stream, so keep the install output off it.
+    ./ve3/bin/pip3 install --upgrade pip ${OPTS} 1>&2
+    unset OPTS
+    popd 1>/dev/null 2>/dev/null
 fi
-
-# Cannot do anything if no files are passed.
-if [[ ${#} -eq 0 ]]; then
-    loggit ${PROG} FATAL "No files passed."
+if [[ ${#} -lt 1 ]]; then
+    source ${TOP_DIR}/ve3/bin/activate && ${TOP_DIR}/bin/gpg_decrypt.py --help
     exit 1
+else
+    source ${TOP_DIR}/ve3/bin/activate && ${TOP_DIR}/bin/gpg_decrypt.py "$@"
 fi
-
-# Check files for proper extension before decrypting.
-for _file in $@; do
-    if ! echo ${_file} | grep -q '\.asc$'; then
-        echo >&2 "FATAL: Not encrypted with GPG"
-        exit 1
-    fi
-done
-
-# Confirm that target files will not be overwritten.
-for _file in $@; do
-    _decrypted=${_file%%.asc}
-    if [[ -e ${_decrypted} ]]; then
-        loggit ${PROG} FATAL "Cannot decrypt!  Target file already exists \"${_decrypted}\""
-        exit 1
-    fi
-done
-
-# Decrypt files
-for _file in $@; do
-    OUTFILE="${_file%%.asc}"
-    _filesize="$(${TOP_DIR}/bin/prettyprint.py ${_file})"
-    loggit ${PROG} INFO "Decrypting ${_file} (${_filesize}) to ${OUTFILE}"
-    ${GPG} ${GPG_OPTS} ${_file} > ${OUTFILE}
-done
 exit ${?}
 
 
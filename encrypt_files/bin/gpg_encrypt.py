@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import os
+import argparse
+from mylog import MyLog
+from gpg_batch import GPGBatch
+
+
+
+def parse_arguments():
+    '''Parse arguments.  encrypt_files.sh passes the same options whatever
+    the encryption method, so the options of aes_encrypt.py are accepted
+    too.  Those meant only for AES-GCM, --write-stats and --dedup, are
+    ignored with a warning.  Anything else is an error rather than being
+    taken for a file to encrypt.
+    '''
+    parser = argparse.ArgumentParser(description='''Encrypt multiple
+    files with GPG to the key set as 'gpg_key' in the configuration file.
+    The user manages the GPG keyring separately.''')
+    parser.add_argument('--debug', action='store_true',
+        default=False,
+        help='Verbose output.')
+    parser.add_argument('--loglevel', action='store', default='WARNING',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level.')
+    parser.add_argument('--showprogress', action='store_true',
+        default=False,
+        help='Show a progress bar which moves as each file finishes.')
+    parser.add_argument('--jobs', action='store', type=int,
+        default=os.cpu_count(),
+        help='Number of gpg processes to run at the same time.')
+    parser.add_argument('--write-stats', action='store_true',
+        default=False,
+        help='Not implemented with GPG.  Ignored.')
+    parser.add_argument('--dedup', action='store_true',
+        default=False,
+        help='Not implemented with GPG.  Ignored.')
+    parser.add_argument('--stats-file', action='store', type=str,
+        default=None,
+        help='''Append a line of JSON per file to this file with its status
+        and the seconds taken.''')
+    parser.add_argument('files', action='store', nargs='+',
+        type=str, default=None,
+        help='Files to process.')
+    return parser.parse_args()
+
+
+
+def check_file(filename):
+    encrypted_name = filename + GPGBatch.EXTENSION
+    if os.path.exists(encrypted_name):
+        raise Exception('Cannot encrypt!  Target file already exists "{}"'.format(
+            encrypted_name))
+    return
+
+
+
+def main():
+    args = parse_arguments()
+    l = MyLog(debug=args.debug, loglevel=args.loglevel)
+    log = l.log
+    for option in ['write_stats', 'dedup']:
+        if getattr(args, option) == True:
+            log.warning('Option not implemented. Ignoring "--{}".'.format(
+                option.replace('_', '-')))
+
+    batch = GPGBatch(debug=args.debug,
+                     loglevel=args.loglevel,
+                     showprogress=args.showprogress,
+                     jobs=args.jobs)
+
+    # Confirm that a file of the same name as the encrypted one does not
+    # already exist within the same directory.
+    for file in args.files:
+        check_file(os.path.realpath(file))
+
+    log.debug('Using recipient key {}'.format(batch.recipient))
+    batch.run(action='encrypt', files=args.files)
+    if args.stats_file != None: batch.append_stats_file(args.stats_file)
+    if len(batch.failed()) > 0:
+        log.error('Failed to encrypt files{}'.format(batch.report()))
+        return 1
+    log.info('Encrypted files{}'.format(batch.report()))
+    return
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
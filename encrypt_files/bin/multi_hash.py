@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs : https://github.com/MartyCombs/public/blob/main/create_metadata/README.md
+# Ticket       :
+# Source Ctl   : https://github.com/MartyCombs/public/blob/main/create_metadata/bin/multi_hash.py
+#=============================================================================#
+
+import math
+import hashlib
+import configparser
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+# Checksums understood.  'crc32c' also needs the crc32c package installed.
+METHODS = ['sha512', 'md5', 'sha256', 'crc32c', 's3_etag']
+
+# Limits boto3 applies to the part size of a multipart upload.  See
+# ChunksizeAdjuster in s3transfer.
+MIN_PART_SIZE = 5 * (1024 ** 2)
+MAX_PART_SIZE = 5 * (1024 ** 3)
+MAX_PARTS = 10000
+
+
+
+def check_method(method=None):
+    '''Raise an exception if the checksum method cannot be used.
+    '''
+    if method not in METHODS:
+        raise Exception('Checksum method "{}" not understood'.format(method))
+    if method == 'crc32c' and crc32c == None:
+        raise Exception('Checksum method "crc32c" needs the crc32c package')
+    return
+
+
+
+def read_part_settings(filename=None):
+    '''Return (mp_threshold, mp_chunksize) from aws_s3.cfg of s3_upload, or
+    None if it cannot be read.  They decide the part size of an upload and
+    so its ETag, and are only kept in that file so the s3_etag calculated
+    is always for the part size s3_upload uses.
+    '''
+    cfg = configparser.RawConfigParser()
+    if filename == None or len(cfg.read(filename)) == 0: return None
+    return (int(cfg.get('DEFAULT', 'mp_threshold')),
+            int(cfg.get('DEFAULT', 'mp_chunksize')))
+
+
+
+def s3_part_size(size=None, mp_threshold=None, mp_chunksize=None):
+    '''Return the part size s3_upload uses for a file of size bytes, or 0 if
+    the file is uploaded in a single request.  Files larger than
+    mp_threshold are uploaded in parts of mp_chunksize, which boto3 raises
+    to at least 5 MB and doubles until there are no more than 10000 parts.
+    '''
+    if size <= mp_threshold: return 0
+    part_size = mp_chunksize
+    while int(math.ceil(size / float(part_size))) > MAX_PARTS:
+        part_size *= 2
+    return min(max(part_size, MIN_PART_SIZE), MAX_PART_SIZE)
+
+
+
+class MultiHash(object):
+    '''Calculate several checksums of a file while reading it once.  Every
+    block read is passed to each digest in turn.
+
+    The S3 ETag of a file uploaded in a single request is the MD5 of the
+    file.  For a multipart upload it is the MD5 of the MD5s of each part
+    followed by '-' and the number of parts, so the part size must match
+    the one used by s3_upload.  See s3_part_size().
+
+    ATTRIBUTES
+        methods            List of checksums to calculate.  See METHODS.
+
+        size               Size of the file in bytes.  Needed for 's3_etag'.
+
+        part_size          Part size the 's3_etag' is calculated for, or 0
+                           for a single request.
+
+    METHODS
+        update             Add a block of data to every checksum.
+
+        checksums          Return a dictionary of hex checksums by method.
+
+    '''
+    def __init__(self, methods=['sha512'], size=None,
+                 mp_threshold=32 * (1024 ** 2), mp_chunksize=32 * 1024):
+        for method in methods: check_method(method)
+        self.methods = list(methods)
+        self.size = size
+        self.part_size = 0
+        self._digests = {}
+        for method in self.methods:
+            if method in ['sha512', 'md5', 'sha256']:
+                self._digests[method] = hashlib.new(method)
+        self._crc = None
+        if 'crc32c' in self.methods: self._crc = 0
+
+        # A single request ETag is the MD5 of the file, which is shared with
+        # 'md5' when both are wanted.
+        self._parts = None
+        if 's3_etag' in self.methods:
+            if size == None: raise Exception('File size needed for "s3_etag"')
+            self.part_size = s3_part_size(size, mp_threshold, mp_chunksize)
+            if self.part_size == 0:
+                if 'md5' not in self._digests:
+                    self._digests['md5'] = hashlib.md5()
+            else:
+                self._parts = []
+                self._part = hashlib.md5()
+                self._part_left = self.part_size
+        return
+
+
+
+    def update(self, data):
+        for digest in self._digests.values(): digest.update(data)
+        if self._crc != None: self._crc = crc32c.crc32c(data, self._crc)
+        if self._parts == None: return
+        view = memoryview(data)
+        while len(view) > 0:
+            n = min(len(view), self._part_left)
+            self._part.update(view[:n])
+            view = view[n:]
+            self._part_left -= n
+            if self._part_left == 0:
+                self._parts.append(self._part.digest())
+                self._part = hashlib.md5()
+                self._part_left = self.part_size
+        return
+
+
+
+    def checksums(self):
+        '''Return a dictionary of the checksums by method as hex strings.
+        '''
+        results = {}
+        for method in self.methods:
+            if method in ['sha512', 'md5', 'sha256']:
+                results[method] = self._digests[method].hexdigest()
+        if self._crc != None:
+            results['crc32c'] = '{:08x}'.format(self._crc)
+        if 's3_etag' in self.methods:
+            if self._parts == None:
+                results['s3_etag'] = self._digests['md5'].hexdigest()
+            else:
+                parts = list(self._parts)
+                if self._part_left < self.part_size or len(parts) == 0:
+                    parts.append(self._part.digest())
+                results['s3_etag'] = '{}-{}'.format(
+                    hashlib.md5(b''.join(parts)).hexdigest(), len(parts))
+        return results
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
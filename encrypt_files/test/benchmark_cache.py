@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import os
+import copy
+import time
+import mmap
+import ctypes
+import ctypes.util
+import hashlib
+import tempfile
+import argparse
+import cache_io
+from enc_conf import EncConf
+from aes_crypt import AESCrypt
+
+MB = 1024 * 1024
+
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='''Measure how much of a large file is left in the page
+cache, and the MB/s, when it is hashed as create_metadata does and
+encrypted.  "open" reads the file with open() as before, "fadvise" streams it
+through cache_io.py dropping pages as it goes, and "direct" reads it with
+O_DIRECT.  The file is dropped from the cache before each run so every run
+reads from disk.''')
+    parser.add_argument('--size',
+        type=int,
+        default=512,
+        help='Size of the test file in MB. [DEFAULT: 512]')
+    parser.add_argument('--dir',
+        type=str,
+        default='.',
+        help='''Directory to write the test file to.  Use a directory on the
+        disk to measure, not tmpfs. [DEFAULT: current directory]''')
+    return parser.parse_args()
+
+
+
+def resident_bytes(filename=None):
+    '''Return the bytes of a file in the page cache, asking the kernel with
+    mincore() about a map of the file.
+    '''
+    size = os.path.getsize(filename)
+    if size == 0: return 0
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    vec = (ctypes.c_ubyte * pages)()
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    start = ctypes.c_char.from_buffer(mm)
+    result = libc.mincore(ctypes.c_void_p(ctypes.addressof(start)),
+                          ctypes.c_size_t(size), vec)
+    del start
+    mm.close()
+    if result != 0:
+        raise Exception('mincore failed: {}'.format(
+            os.strerror(ctypes.get_errno())))
+    return sum([1 for v in vec if v & 1]) * mmap.PAGESIZE
+
+
+
+def hash_file(filename=None, mode=None):
+    with cache_io.open_file(filename, 'rb', direct=mode == 'direct') as f:
+        hasher = hashlib.sha512()
+        while True:
+            buff = f.read(64 * 1024)
+            if not buff: break
+            hasher.update(buff)
+    return
+
+
+
+def encrypt_file(filename=None, mode=None):
+    cfg = EncConf()
+    cfg.read()
+    cfg = copy.copy(cfg)
+    cfg.set_compression('none')
+    cfg.set_checkpoint_segments(0)
+    cfg.set_direct_io(mode == 'direct')
+    crypt = AESCrypt(config=cfg)
+    crypt.set_filename(filename)
+    crypt.encrypt()
+    return
+
+
+
+def main():
+    options = parse_arguments()
+    (fd, testfile) = tempfile.mkstemp(dir=options.dir, prefix='bench-cache-')
+    os.close(fd)
+    encrypted = testfile + '.enc'
+    large_file = cache_io.LARGE_FILE
+    try:
+        with open(testfile, 'wb') as f:
+            for i in range(options.size):
+                f.write(os.urandom(MB))
+            f.flush()
+            os.fsync(f.fileno())
+
+        print('{:<8} {:<8} {:>8} {:>16} {:>16}'.format(
+            'Mode', 'Work', 'MB/s', 'Input cached MB', 'Output cached MB'))
+        for (work, func) in [('sha512', hash_file), ('encrypt', encrypt_file)]:
+            for mode in ['open', 'fadvise', 'direct']:
+                # open() is used for every file under LARGE_FILE.
+                cache_io.LARGE_FILE = large_file
+                if mode == 'open': cache_io.LARGE_FILE = options.size * MB + 1
+                cache_io.drop_cache(testfile)
+                start = time.time()
+                func(testfile, mode)
+                seconds = time.time() - start
+                output = '-'
+                if os.path.exists(encrypted):
+                    output = '{:.1f}'.format(resident_bytes(encrypted) / MB)
+                    os.remove(encrypted)
+                print('{:<8} {:<8} {:>8.1f} {:>16.1f} {:>16}'.format(
+                    mode, work, options.size / seconds,
+                    resident_bytes(testfile) / MB, output))
+    finally:
+        cache_io.LARGE_FILE = large_file
+        for f in [testfile, encrypted]:
+            if os.path.exists(f): os.remove(f)
+    return
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
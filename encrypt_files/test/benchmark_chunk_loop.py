@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+from aes_crypt import AESCrypt
+
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='''Compare the MB/s of the single stream chunk loop when
+reading and encrypting into new objects every chunk against reusing buffers
+with readinto() and update_into(), with and without the I/O threads and
+memory mapping.''')
+    parser.add_argument('--size', type=int, default=256,
+        help='Size of the test file in MB. [DEFAULT: 256]')
+    parser.add_argument('--chunk', type=int, default=64,
+        help='Chunk size in KB. [DEFAULT: 64]')
+    return parser.parse_args()
+
+
+
+def allocating_loop(input_file, output_file, chunk_size):
+    '''The original loop which allocates two new objects every chunk.
+    '''
+    encryptor = Cipher(algorithms.AES(os.urandom(32)),
+                       modes.GCM(os.urandom(12)),
+                       backend=default_backend()).encryptor()
+    with open(output_file, 'wb') as out_file:
+        with open(input_file, 'rb') as in_file:
+            while chunk := in_file.read(chunk_size):
+                out_file.write(encryptor.update(chunk))
+        out_file.write(encryptor.finalize())
+    return
+
+
+
+def main():
+    options = parse_arguments()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        input_file = os.path.join(tmpdir, 'bench')
+        with open(input_file, 'wb') as f:
+            for i in range(options.size):
+                f.write(os.urandom(1024 * 1024))
+
+        print('{:<32} {:>10} {:>10}'.format('Loop', 'Seconds', 'MB/s'))
+        runs = [('read + update', None, None),
+                ('readinto + update_into', 1, False),
+                ('  + reader/writer threads', 3, False),
+                ('  + mmap', 3, True)]
+        for (name, io_buffers, use_mmap) in runs:
+            start = time.time()
+            if io_buffers == None:
+                allocating_loop(input_file, input_file + '.enc',
+                                options.chunk * 1024)
+            else:
+                crypt = AESCrypt()
+                crypt._format_version = 1
+                crypt._chunk_size = options.chunk * 1024
+                crypt._io_buffers = io_buffers
+                crypt._use_mmap = use_mmap
+                crypt.set_filename(input_file)
+                crypt.encrypt()
+            seconds = time.time() - start
+            os.remove(input_file + '.enc')
+            print('{:<32} {:>10.2f} {:>10.1f}'.format(
+                name, seconds, options.size / seconds))
+    finally:
+        shutil.rmtree(tmpdir)
+    return
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
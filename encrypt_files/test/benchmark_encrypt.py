@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import os
+import time
+import json
+import shutil
+import socket
+import platform
+import tempfile
+import argparse
+import cryptography
+from mylog import MyLog
+from enc_conf import EncConf
+from aes_batch import AESBatch
+
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        'benchmark_baseline.json')
+
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='''Time AESCrypt encrypting and decrypting synthetic
+files across chunk sizes, key sizes, and job counts.  Results are written as
+JSON and compared with a baseline from an earlier run.  Any result slower
+than the baseline by more than the tolerance fails the run.''')
+    parser.add_argument('--debug', action='store_true', default=False,
+        help='Verbose output.')
+    parser.add_argument('--loglevel', action='store', default='INFO',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+        help='Log level.')
+    parser.add_argument('--dir', action='store', type=str,
+        default=tempfile.gettempdir(),
+        help='Directory to create the synthetic files in.')
+    parser.add_argument('--tiny-count', action='store', type=int,
+        default=1000,
+        help='Number of 4 KB files. [DEFAULT: 1000]')
+    parser.add_argument('--large-count', action='store', type=int,
+        default=2,
+        help='Number of large files of each kind. [DEFAULT: 2]')
+    parser.add_argument('--large-mb', action='store', type=int,
+        default=2048,
+        help='Size of each large file in MB. [DEFAULT: 2048]')
+    parser.add_argument('--quick', action='store_true', default=False,
+        help='Small files only for a fast check: 100 tiny and 64 MB large.')
+    parser.add_argument('--chunk-sizes', action='store', type=str,
+        default='64,1024',
+        help='''Comma separated chunk and segment sizes in KB.
+        [DEFAULT: 64,1024]''')
+    parser.add_argument('--key-sizes', action='store', type=str,
+        default='16,32',
+        help='Comma separated key sizes in bytes. [DEFAULT: 16,32]')
+    parser.add_argument('--ciphers', action='store', type=str,
+        default='AES-GCM',
+        help='''Comma separated ciphers for file format 2, AES-GCM or
+        ChaCha20-Poly1305. [DEFAULT: AES-GCM]''')
+    parser.add_argument('--jobs', action='store', type=str,
+        default='1,{}'.format(os.cpu_count() or 1),
+        help='Comma separated job counts. [DEFAULT: 1,number of cores]')
+    parser.add_argument('--format', action='store', type=int,
+        default=None, choices=EncConf.FILE_FORMAT_VERSIONS,
+        help='File format to write. [DEFAULT: from the config file]')
+    parser.add_argument('--output', action='store', type=str,
+        default=None,
+        help='''Write the JSON results to this file.  Pass {} to make the
+        results the new baseline.  [DEFAULT: STDOUT]'''.format(BASELINE))
+    parser.add_argument('--baseline', action='store', type=str,
+        default=BASELINE,
+        help='JSON results to compare against if the file exists.')
+    parser.add_argument('--tolerance', action='store', type=float,
+        default=0.20,
+        help='''Fraction slower than the baseline allowed before failing.
+        [DEFAULT: 0.20]''')
+    args = parser.parse_args()
+    if args.quick == True:
+        args.tiny_count = 100
+        args.large_mb = 64
+    return args
+
+
+
+def write_file(filename, size, compressible):
+    '''Write a file of random bytes, or of repeated text which compresses
+    well.
+    '''
+    line = b'2024-12-05 01:52:16 backup file stats OK checksum sha512\n'
+    with open(filename, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            n = min(remaining, 1024 * 1024)
+            if compressible == True:
+                f.write((line * (n // len(line) + 1))[:n])
+            else:
+                f.write(os.urandom(n))
+            remaining -= n
+    f.close()
+    return
+
+
+
+def make_datasets(args, topdir):
+    '''Create the synthetic files.
+
+    RETURN
+            Dictionary of dataset name to list of files.
+    '''
+    datasets = {}
+    kinds = [('tiny-random', args.tiny_count, 4 * 1024, False),
+             ('large-random', args.large_count, args.large_mb * 1024 ** 2,
+              False),
+             ('large-text', args.large_count, args.large_mb * 1024 ** 2,
+              True)]
+    for (name, count, size, compressible) in kinds:
+        if count < 1: continue
+        os.makedirs(os.path.join(topdir, name))
+        datasets[name] = []
+        for i in range(count):
+            datasets[name].append(os.path.join(topdir, name,
+                                               'file{:06d}'.format(i)))
+            write_file(datasets[name][-1], size, compressible)
+    return datasets
+
+
+
+def run_one(files, config, jobs, scratch):
+    '''Encrypt the files, move the results to a scratch directory, and
+    decrypt them there.
+
+    RETURN
+            (encrypt seconds, decrypt seconds)
+    '''
+    batch = AESBatch(jobs=jobs, config=config)
+    start = time.time()
+    batch.run(action='encrypt', files=files)
+    encrypt_seconds = time.time() - start
+    if len(batch.failed()) > 0:
+        raise Exception('Encrypt failed{}'.format(batch.report()))
+
+    encrypted = []
+    for f in files:
+        encrypted.append(os.path.join(scratch, os.path.basename(f) + '.enc'))
+        os.rename(f + '.enc', encrypted[-1])
+    start = time.time()
+    batch.run(action='decrypt', files=encrypted)
+    decrypt_seconds = time.time() - start
+    if len(batch.failed()) > 0:
+        raise Exception('Decrypt failed{}'.format(batch.report()))
+    for f in encrypted:
+        os.remove(f)
+        os.remove(f[:-4])
+    return (encrypt_seconds, decrypt_seconds)
+
+
+
+def result_key(result):
+    # Baselines from before ciphers were compared are all AES-GCM.
+    return (result['dataset'], result['format'],
+            result.get('cipher', 'AES-GCM'), result['chunk_kbytes'],
+            result['key_bytes'], result['jobs'])
+
+
+
+def compare(results, baseline, tolerance):
+    '''Compare results against the baseline.
+
+    RETURN
+            (report, number of regressions)
+    '''
+    old = {}
+    for r in baseline['results']: old[result_key(r)] = r
+    rpt = '\n{}\n'.format('='*76)
+    rpt += '{:<52} {:>7} {:>7} {:>7}  {}\n'.format('Run', 'Metric',
+                                                    'Baseline', 'Now', '')
+    rpt += '{:<52} {:>7} {:>7} {:>7}\n'.format('-'*52, '-'*7, '-'*7, '-'*7)
+    regressions = 0
+    for r in results:
+        if result_key(r) not in old: continue
+        for metric in ['encrypt_mbps', 'decrypt_mbps']:
+            before = old[result_key(r)][metric]
+            status = ''
+            if r[metric] < before * (1 - tolerance):
+                status = 'REGRESSION'
+                regressions += 1
+            rpt += '{:<52} {:>7} {:>7.1f} {:>7.1f}  {}\n'.format(
+                '{} f{} {} {}K k{} j{}'.format(*result_key(r)),
+                metric.split('_')[0], before, r[metric], status)
+    rpt += '{}\n'.format('='*76)
+    return (rpt, regressions)
+
+
+
+def main():
+    args = parse_arguments()
+    l = MyLog(debug=args.debug, loglevel=args.loglevel)
+    log = l.log
+    chunk_sizes = [int(s) for s in args.chunk_sizes.split(',')]
+    key_sizes = [int(s) for s in args.key_sizes.split(',')]
+    jobs_list = [int(s) for s in args.jobs.split(',')]
+    ciphers = args.ciphers.split(',')
+
+    results = []
+    topdir = tempfile.mkdtemp(prefix='benchmark.', dir=args.dir)
+    try:
+        log.info('Creating synthetic files in "{}"'.format(topdir))
+        datasets = make_datasets(args, topdir)
+        scratch = os.path.join(topdir, 'scratch')
+        os.makedirs(scratch)
+        for name in datasets.keys():
+            size = sum([os.path.getsize(f) for f in datasets[name]])
+            runs = [(cipher, chunk, key_size, jobs) for cipher in ciphers
+                    for chunk in chunk_sizes for key_size in key_sizes
+                    for jobs in jobs_list]
+            for (cipher, chunk, key_size, jobs) in runs:
+                config = EncConf()
+                config.read()
+                if args.format != None:
+                    config.set_file_format_version(args.format)
+                config.set_encryption_method(cipher)
+                config.set_chunk_size_kbytes(chunk)
+                config.set_segment_size_kbytes(chunk)
+                config.set_key_size_bytes(key_size)
+                (enc, dec) = run_one(datasets[name], config, jobs, scratch)
+                r = { 'dataset' : name,
+                      'files' : len(datasets[name]),
+                      'bytes' : size,
+                      'format' : config.file_format_version,
+                      'cipher' : cipher,
+                      'chunk_kbytes' : chunk,
+                      'key_bytes' : key_size,
+                      'jobs' : jobs,
+                      'encrypt_seconds' : round(enc, 4),
+                      'decrypt_seconds' : round(dec, 4),
+                      'encrypt_mbps' : round(size / enc / 1024 ** 2, 2),
+                      'decrypt_mbps' : round(size / dec / 1024 ** 2, 2),
+                      'files_per_second' : round(
+                          len(datasets[name]) / enc, 2) }
+                log.info('{} format {} {} chunk {}K key {} jobs {}: '
+                         'encrypt {} MB/s, decrypt {} MB/s'.format(
+                             name, r['format'], cipher, chunk, key_size,
+                             jobs, r['encrypt_mbps'], r['decrypt_mbps']))
+                results.append(r)
+    finally:
+        shutil.rmtree(topdir)
+
+    output = { 'host' : socket.gethostname(),
+               'date' : time.strftime('%Y-%m-%d %H:%M:%S %z', time.gmtime()),
+               'python' : platform.python_version(),
+               'cryptography' : cryptography.__version__,
+               'cpu_count' : os.cpu_count(),
+               'results' : results }
+    contents = json.dumps(output, indent=4, sort_keys=True)
+
+    # Compare before writing so a run can replace its own baseline.
+    regressions = 0
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        f.close()
+        (rpt, regressions) = compare(results, baseline, args.tolerance)
+        log.info('Compared with "{}"{}'.format(args.baseline, rpt))
+
+    if args.output == None:
+        print(contents)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(contents)
+        f.close()
+        log.info('Wrote "{}"'.format(args.output))
+
+    if regressions > 0:
+        log.error('{} results slower than the baseline by more than {:.0%}'.format(
+            regressions, args.tolerance))
+        return 1
+    return
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#=============================================================================#
+# Project Docs :
+# Ticket       :
+# Source Ctl   :
+#=============================================================================#
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import argparse
+from enc_conf import EncConf
+from aes_crypt import AESCrypt
+
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='''Compare the files per second encrypted with each key
+derivation.  PBKDF2 stretches the master key for every file while HKDF
+stretches it once per run.''')
+    parser.add_argument('--files',
+        type=int,
+        default=200,
+        help='Number of small files to encrypt. [DEFAULT: 200]')
+    parser.add_argument('--size',
+        type=int,
+        default=4096,
+        help='Size of each file in bytes. [DEFAULT: 4096]')
+    return parser.parse_args()
+
+
+
+def main():
+    options = parse_arguments()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = []
+        for i in range(options.files):
+            files.append(os.path.join(tmpdir, 'file{:06d}'.format(i)))
+            with open(files[-1], 'wb') as f:
+                f.write(os.urandom(options.size))
+
+        print('{:<8} {:>8} {:>10} {:>10}'.format('KDF', 'Files', 'Seconds',
+                                                 'Files/sec'))
+        for kdf in ['PBKDF2', 'HKDF']:
+            cfg = EncConf()
+            cfg.read()
+            cfg.set_kdf(kdf)
+            crypt = AESCrypt(config=cfg)
+            start = time.time()
+            for f in files:
+                crypt.set_filename(f)
+                crypt.encrypt()
+            seconds = time.time() - start
+            print('{:<8} {:>8} {:>10.2f} {:>10.1f}'.format(
+                kdf, len(files), seconds, len(files) / seconds))
+    finally:
+        shutil.rmtree(tmpdir)
+    return
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+
+#=============================================================================#
+# END
+#=============================================================================#
@@ -7,10 +7,25 @@
 
 import sys
 import os
+import errno
 import shutil
 import hashlib
+import io
+import json
+from base64 import b64decode
+import threading
 from mylog import MyLog
+import aes_crypt
 from aes_crypt import AESCrypt
+from aes_batch import AESBatch
+from enc_header import EncHeader
+from enc_conf import EncConf
+from chunk_io import ChunkReader, ChunkWriter
+from compression import should_compress
+import dedup_store
+from dedup_store import ContentChunker, DedupStore
+import cache_io
+import multi_hash
 
 
 def checksum(filename=None):
@@ -58,4 +73,820 @@ else:
     log.error('FAILED: Original file contents differ after decoding.')
 
 
+# Encrypt several copies at once with a pool of workers and decrypt them.
+log.debug('\n\nTesting parallel encryption with aes_batch.AESBatch\n')
+batchfiles = []
+for i in range(3):
+    batchfiles.append('testfile-batch{}.mp4'.format(i))
+    shutil.copyfile(testfile1, batchfiles[-1])
+b = AESBatch(debug=True, jobs=2)
+b.run(action='encrypt', files=batchfiles + [batchfiles[0],
+                                            './' + batchfiles[1]])
+log.debug('{}'.format(b.report()))
+if len(b.failed()) > 0:
+    raise Exception('FAILED: Parallel encryption of {}'.format(b.failed()))
+if sorted(b.results.keys()) != sorted(batchfiles):
+    raise Exception('FAILED: Files listed twice were not run once: {}'.format(
+        list(b.results.keys())))
+for f in batchfiles:
+    os.remove(f)
+b.run(action='decrypt', files=[f + '.enc' for f in batchfiles])
+if len(b.failed()) > 0:
+    raise Exception('FAILED: Parallel decryption of {}'.format(b.failed()))
+for f in batchfiles:
+    if checksum(f) != testfile1_sum:
+        raise Exception('FAILED: Parallel round trip of "{}"'.format(f))
+    os.remove(f)
+    os.remove(f + '.enc')
+log.info('PASSED: Parallel encryption and decryption of {} files.'.format(
+    len(batchfiles)))
+
+
+# Files written in the original single stream format must still decrypt.
+log.debug('\n\nTesting single stream and segmented file formats\n')
+legacy = AESCrypt(debug=True)
+legacy._format_version = 1
+legacy.set_filename(testfile1)
+legacy.encrypt()
+with open(testfile1 + '.enc', 'rb') as f:
+    if f.read(len(EncHeader.MAGIC)) == EncHeader.MAGIC:
+        raise Exception('FAILED: Single stream file written with a header')
+os.rename(testfile1 + '.enc', testfile2 + '.enc')
+c.set_filename(testfile2 + '.enc')
+c.decrypt()
+if checksum(testfile2) != testfile1_sum:
+    raise Exception('FAILED: Decrypting the single stream file format')
+for f in [testfile2, testfile2 + '.enc']:
+    os.remove(f)
+log.info('PASSED: Single stream file format still decrypts.')
+
+# Small segments so the test file spans many of them.  Includes an empty
+# file and one which is an exact multiple of the segment size.
+seg = AESCrypt(debug=True, threads=3)
+seg._segment_size = 4096
+sizes = [0, 1, 4096, 3 * 4096, 100000]
+data = os.urandom(max(sizes))
+for size in sizes:
+    with open(testfile2, 'wb') as f:
+        f.write(data[:size])
+    seg.set_filename(testfile2)
+    seg.encrypt()
+    os.remove(testfile2)
+    seg.set_filename(testfile2 + '.enc')
+    seg.decrypt()
+    with open(testfile2, 'rb') as f:
+        if f.read() != data[:size]:
+            raise Exception('FAILED: Segmented round trip of {} bytes'.format(
+                size))
+    os.remove(testfile2)
+
+    # Flipping a bit, dropping the last segment, or dropping bytes from the
+    # end must all fail authentication.
+    header = EncHeader()
+    with open(testfile2 + '.enc', 'rb') as f:
+        header.read(f)
+        f.seek(0)
+        good = f.read()
+    last_segment = 16 + (size % 4096 or min(size, 4096))
+    bad = {
+        'flipped bit'   : good[:-1] + bytes([good[-1] ^ 1]),
+        'truncated'     : good[:-5],
+        'last dropped'  : good[:max(header.size(), len(good) - last_segment)],
+    }
+    for name in bad.keys():
+        if bad[name] == good: continue
+        with open(testfile2 + '.enc', 'wb') as f:
+            f.write(bad[name])
+        try:
+            seg.decrypt()
+        except Exception as e:
+            log.debug('Expected failure for {}: {}'.format(name, e))
+        else:
+            raise Exception('FAILED: {} file of {} bytes decrypted'.format(
+                name, size))
+        if os.path.exists(testfile2): os.remove(testfile2)
+    os.remove(testfile2 + '.enc')
+log.info('PASSED: Segmented file format round trip and tamper checks.')
+
+# Decrypt ranges of bytes which start and end inside, on, and across segment
+# boundaries.
+with open(testfile2, 'wb') as f:
+    f.write(data)
+seg.set_filename(testfile2)
+seg.encrypt()
+seg.set_filename(testfile2 + '.enc')
+for (start, end) in [(0, 1), (0, 4096), (4095, 4097), (5000, 50000),
+                     (99990, None), (len(data) - 1, len(data) + 10),
+                     (10, 10), (0, None)]:
+    out = io.BytesIO()
+    seg.decrypt_range(start=start, end=end, out_fileobj=out)
+    if out.getvalue() != data[start:end]:
+        raise Exception('FAILED: Decrypting range {}:{}'.format(start, end))
+for f in [testfile2, testfile2 + '.enc']:
+    os.remove(f)
+log.info('PASSED: Decrypting byte ranges of a segmented file.')
+
+
+log.debug('\n\nTesting key derivations\n')
+# Files written with either key derivation decrypt with a new instance.  With
+# HKDF every file of a run shares the salt used to stretch the master key.
+with open(testfile2, 'wb') as f:
+    f.write(data)
+headers = {}
+for kdf in ['PBKDF2', 'HKDF']:
+    writer = AESCrypt(debug=True)
+    writer._kdf = kdf
+    headers[kdf] = []
+    for i in range(2):
+        writer.set_filename(testfile2)
+        writer.encrypt()
+        header = EncHeader()
+        with open(testfile2 + '.enc', 'rb') as f:
+            header.read(f)
+        headers[kdf].append(header)
+    os.rename(testfile2, testfile2 + '.orig')
+    reader = AESCrypt(debug=True)
+    reader.set_filename(testfile2 + '.enc')
+    reader.decrypt()
+    with open(testfile2, 'rb') as f:
+        if f.read() != data:
+            raise Exception('FAILED: Round trip with {}'.format(kdf))
+    os.remove(testfile2 + '.orig')
+    os.remove(testfile2 + '.enc')
+if headers['PBKDF2'][0].kdf_salt != b'':
+    raise Exception('FAILED: PBKDF2 header has a key derivation salt')
+if (headers['HKDF'][0].kdf_salt != headers['HKDF'][1].kdf_salt
+    or headers['HKDF'][0].salt == headers['HKDF'][1].salt
+    or len(headers['HKDF'][0].kdf_salt) != 16):
+    raise Exception('FAILED: HKDF salts not shared per run and unique per file')
+if len(writer._stretched_keys) != 1:
+    raise Exception('FAILED: Master key stretched more than once')
+os.remove(testfile2)
+log.info('PASSED: Key derivations round trip and stretch once per run.')
+
+
+log.debug('\n\nTesting checksum of the encrypted file while writing it\n')
+with open(testfile2, 'wb') as f:
+    f.write(data)
+writer = AESCrypt(debug=True, write_stats=True)
+writer.set_filename(testfile2)
+writer.encrypt()
+with open(testfile2 + '.enc' + AESCrypt.STATS_EXTENSION, 'r') as f:
+    stats = json.load(f)
+if (stats['file_checksum'] != checksum(testfile2 + '.enc')
+    or stats['file_checksum'] != writer.file_stats['file_checksum']
+    or stats['file_size_bytes'] != os.path.getsize(testfile2 + '.enc')
+    or stats['file_mtime_ns'] != os.stat(testfile2 + '.enc').st_mtime_ns):
+    raise Exception('FAILED: Stats file does not match the encrypted file')
+with open(testfile2 + '.enc', 'rb') as f:
+    encrypted = f.read()
+if (stats['file_md5'] != hashlib.md5(encrypted).hexdigest()
+    or stats['file_sha256'] != hashlib.sha256(encrypted).hexdigest()
+    or stats['s3_etag'] != stats['file_md5'] or stats['s3_part_size'] != 0):
+    raise Exception('FAILED: Extra checksums in the stats file')
+
+# Above mp_threshold the ETag is of the parts.  The part size is taken
+# from aws_s3.cfg of s3_upload.
+with open('aws_s3.cfg', 'w') as f:
+    f.write('[DEFAULT]\nmp_threshold = 1000\nmp_chunksize = 32768\n')
+etag_conf = EncConf()
+etag_conf.read()
+etag_conf.set_s3_upload_config(os.path.realpath('aws_s3.cfg'))
+os.remove('aws_s3.cfg')
+writer = AESCrypt(debug=True, write_stats=True, config=etag_conf)
+writer.set_filename(testfile2)
+writer.encrypt()
+with open(testfile2 + '.enc' + AESCrypt.STATS_EXTENSION, 'r') as f:
+    stats = json.load(f)
+with open(testfile2 + '.enc', 'rb') as f:
+    encrypted = f.read()
+etag = '{}-1'.format(hashlib.md5(hashlib.md5(encrypted).digest()).hexdigest())
+if (stats['s3_etag'] != etag
+    or stats['s3_part_size'] != multi_hash.MIN_PART_SIZE):
+    raise Exception('FAILED: Multipart ETag in the stats file')
+for f in [testfile2, testfile2 + '.enc',
+          testfile2 + '.enc' + AESCrypt.STATS_EXTENSION]:
+    os.remove(f)
+log.info('PASSED: Checksum of the encrypted file computed while writing.')
+
+
+log.debug('\n\nTesting encryption through pipes\n')
+# Write through a pipe from a thread so neither side can seek.
+stream = AESCrypt(debug=True, threads=2)
+stream._segment_size = 4096
+for size in [0, 4096, 100000]:
+    (r, w) = os.pipe()
+    with os.fdopen(r, 'rb') as reader, os.fdopen(w, 'wb') as writer:
+        feeder = threading.Thread(target=lambda: (writer.write(data[:size]),
+                                                  writer.close()))
+        feeder.start()
+        encrypted = io.BytesIO()
+        stream.encrypt_stream(in_fileobj=reader, out_fileobj=encrypted)
+        feeder.join()
+    decrypted = io.BytesIO()
+    stream.decrypt_stream(in_fileobj=io.BytesIO(encrypted.getvalue()),
+                          out_fileobj=decrypted)
+    if decrypted.getvalue() != data[:size]:
+        raise Exception('FAILED: Stream round trip of {} bytes'.format(size))
+    try:
+        stream.decrypt_stream(
+            in_fileobj=io.BytesIO(encrypted.getvalue()[:-1]),
+            out_fileobj=io.BytesIO())
+    except Exception as e:
+        log.debug('Expected failure for truncated stream: {}'.format(e))
+    else:
+        raise Exception('FAILED: Truncated stream of {} bytes decrypted'.format(
+            size))
+log.info('PASSED: Encrypting and decrypting streams.')
+
+
+log.debug('\n\nTesting encrypting bytes and file objects\n')
+# Bytes round trip in both formats and fail if tampered with.
+for version in [1, 2]:
+    mem = AESCrypt(debug=True)
+    mem._format_version = version
+    for size in [0, 100000]:
+        encrypted = mem.encrypt_bytes(data[:size])
+        if (EncHeader().is_segmented(encrypted[:len(EncHeader.MAGIC)]) !=
+                (version == 2)):
+            raise Exception('FAILED: Bytes not in format {}'.format(version))
+        if mem.decrypt_bytes(encrypted) != data[:size]:
+            raise Exception('FAILED: Bytes round trip in format {}'.format(
+                version))
+        try:
+            mem.decrypt_bytes(encrypted[:-1] + bytes([encrypted[-1] ^ 1]))
+            raise Exception('FAILED: Tampered bytes decrypted')
+        except Exception as e:
+            if str(e).startswith('FAILED'): raise
+
+    # File objects are read and written from where they are positioned.
+    out_fileobj = io.BytesIO()
+    out_fileobj.write(b'prefix')
+    mem.encrypt_fileobj(io.BytesIO(data), out_fileobj)
+    out_fileobj.write(b'suffix')
+    in_fileobj = io.BytesIO(out_fileobj.getvalue()[:-len(b'suffix')])
+    in_fileobj.seek(len(b'prefix'))
+    decrypted = io.BytesIO()
+    mem.decrypt_fileobj(in_fileobj, decrypted)
+    if decrypted.getvalue() != data:
+        raise Exception('FAILED: File object round trip in format {}'.format(
+            version))
+
+# An output which cannot seek is written in the segmented format.
+class Unseekable(io.BytesIO):
+    def seekable(self):
+        return False
+mem = AESCrypt(debug=True)
+mem._format_version = 1
+out_fileobj = Unseekable()
+mem.encrypt_fileobj(io.BytesIO(data), out_fileobj)
+if mem._stats['format'] != 2:
+    raise Exception('FAILED: Format 1 written to an unseekable file object')
+decrypted = io.BytesIO()
+mem.decrypt_fileobj(Unseekable(out_fileobj.getvalue()), decrypted)
+if decrypted.getvalue() != data:
+    raise Exception('FAILED: Unseekable file object round trip')
+log.info('PASSED: Encrypting bytes and file objects.')
+
+
+log.debug('\n\nTesting verification without decrypting to disk\n')
+with open(testfile2, 'wb') as f:
+    f.write(data)
+verifyfiles = []
+for version in [1, 2]:
+    writer = AESCrypt(debug=True)
+    writer._format_version = version
+    writer.set_filename(testfile2)
+    writer.encrypt()
+    verifyfiles.append('testfile-verify{}.mp4.enc'.format(version))
+    os.rename(testfile2 + '.enc', verifyfiles[-1])
+os.remove(testfile2)
+b.run(action='verify', files=verifyfiles)
+if len(b.failed()) > 0 or os.path.exists(verifyfiles[0][:-4]):
+    raise Exception('FAILED: Verifying {}'.format(verifyfiles))
+for f in verifyfiles:
+    with open(f, 'r+b') as fh:
+        fh.seek(-1, os.SEEK_END)
+        last = fh.read(1)
+        fh.seek(-1, os.SEEK_END)
+        fh.write(bytes([last[0] ^ 1]))
+b.run(action='verify', files=verifyfiles)
+if sorted(b.failed()) != sorted(verifyfiles):
+    raise Exception('FAILED: Tampered files verified {}'.format(b.report()))
+for f in verifyfiles:
+    os.remove(f)
+log.info('PASSED: Verifying files in both formats.')
+
+
+log.debug('\n\nTesting overlapped reading and writing\n')
+# Every chunk but the last is full even when reading a pipe in small pieces.
+for depth in [1, 3]:
+    (r, w) = os.pipe()
+    with os.fdopen(r, 'rb', buffering=0) as reader:
+        def feed():
+            for i in range(0, 10000, 333):
+                os.write(w, data[i:min(i + 333, 10000)])
+            os.close(w)
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        chunks = [bytes(c) for c in ChunkReader(reader, 4096, depth)]
+        feeder.join()
+    if (b''.join(chunks) != data[:10000]
+        or [len(c) for c in chunks] != [4096, 4096, 1808]):
+        raise Exception('FAILED: Reading chunks with depth {}'.format(depth))
+    out = io.BytesIO()
+    with ChunkWriter(out, depth) as writer:
+        for c in chunks:
+            writer.write(c)
+    if out.getvalue() != data[:10000]:
+        raise Exception('FAILED: Writing chunks with depth {}'.format(depth))
+
+# Single stream files round trip with and without the reader and writer
+# threads, and read from a memory map.
+for size in [0, 100000]:
+    for (depth, mapped) in [(1, False), (3, False), (1, True), (3, True)]:
+        with open(testfile2, 'wb') as f:
+            f.write(data[:size])
+        overlap = AESCrypt(debug=True)
+        overlap._format_version = 1
+        overlap._chunk_size = 1000
+        overlap._io_buffers = depth
+        overlap._use_mmap = mapped
+        overlap.set_filename(testfile2)
+        overlap.encrypt()
+        os.remove(testfile2)
+        overlap.set_filename(testfile2 + '.enc')
+        overlap.decrypt()
+        with open(testfile2, 'rb') as f:
+            if f.read() != data[:size]:
+                raise Exception(
+                    'FAILED: Single stream of {} bytes with {} buffers, '
+                    'mmap {}'.format(size, depth, mapped))
+        os.remove(testfile2)
+        os.remove(testfile2 + '.enc')
+log.info('PASSED: Overlapped reading, encrypting, and writing.')
+
+
+log.debug('\n\nTesting chunk sizes picked for each file\n')
+sized = AESCrypt(debug=True, threads=4)
+sized._auto_chunk_size = True
+KB = 1024
+for (configured, file_size, parts, expected) in [
+        (1024 * KB, 1, 1, 64 * KB),
+        (1024 * KB, 100 * KB, 1, 128 * KB),
+        (1024 * KB, 10 * 1024 * KB, 1, 1024 * KB),
+        (1024 * KB, 1024 * KB, 4, 256 * KB),
+        (16 * KB, 1024 * KB, 1, 16 * KB),
+        (1024 * KB, None, 1, 1024 * KB)]:
+    got = sized._size_for_file(configured, file_size, parts)
+    if got != expected:
+        raise Exception('FAILED: Size for {} byte file is {} not {}'.format(
+            file_size, got, expected))
+with open(testfile2, 'wb') as f:
+    f.write(data)
+sized.set_filename(testfile2)
+sized.encrypt()
+header = EncHeader()
+with open(testfile2 + '.enc', 'rb') as f:
+    header.read(f)
+if header.segment_size != 64 * KB:
+    raise Exception('FAILED: Segment size {} not picked for the file'.format(
+        header.segment_size))
+os.remove(testfile2)
+sized.set_filename(testfile2 + '.enc')
+sized.decrypt()
+if checksum(testfile2) != hashlib.sha512(data).hexdigest():
+    raise Exception('FAILED: Round trip with a segment size for the file')
+os.remove(testfile2)
+os.remove(testfile2 + '.enc')
+
+# A configuration which has been read builds back to the same file.
+conf = EncConf()
+conf.read()
+with open(conf.filename, 'r') as f:
+    if f.read() != conf.build():
+        raise Exception('FAILED: Configuration changed by read and build')
+log.info('PASSED: Chunk sizes picked for each file.')
+
+
+log.debug('\n\nTesting compression before encrypting\n')
+text = ''.join(['line {} of a log file which compresses well\n'.format(i)
+               for i in range(20000)]).encode()
+if should_compress(testfile1) or not should_compress(__file__):
+    raise Exception('FAILED: Picking files to compress by extension')
+logfile = 'testfile-compress.log'
+for method in ['zlib', 'lzma']:
+    packed = AESCrypt(debug=True)
+    packed._compression = method
+    packed._segment_size = 16 * 1024
+    for (contents, expected) in [(text, method), (data, 'none')]:
+        with open(logfile, 'wb') as f:
+            f.write(contents)
+        if should_compress(logfile) != (expected != 'none'):
+            raise Exception('FAILED: Sampled entropy of the file')
+        packed.set_filename(logfile)
+        packed.encrypt()
+        header = EncHeader()
+        with open(logfile + '.enc', 'rb') as f:
+            header.read(f)
+        if header.compression != expected:
+            raise Exception('FAILED: Compression {} not {}'.format(
+                header.compression, expected))
+        if (expected != 'none' and
+            os.path.getsize(logfile + '.enc') > len(contents) // 4):
+            raise Exception('FAILED: {} did not compress the file'.format(
+                method))
+        os.remove(logfile)
+        packed.set_filename(logfile + '.enc')
+        packed.decrypt()
+        if checksum(logfile) != hashlib.sha512(contents).hexdigest():
+            raise Exception('FAILED: Round trip compressed with {}'.format(
+                method))
+        os.remove(logfile)
+        if expected != 'none':
+            try:
+                packed.decrypt_range(0, 10, io.BytesIO())
+                raise Exception('FAILED: Range of a compressed file')
+            except Exception as e:
+                if str(e).startswith('FAILED'): raise
+        os.remove(logfile + '.enc')
+
+    # Streams are compressed without sampling.
+    encrypted = io.BytesIO()
+    packed.encrypt_stream(io.BytesIO(text), encrypted)
+    decrypted = io.BytesIO()
+    packed.decrypt_stream(io.BytesIO(encrypted.getvalue()), decrypted)
+    if decrypted.getvalue() != text:
+        raise Exception('FAILED: Compressed stream with {}'.format(method))
+log.info('PASSED: Compression before encrypting.')
+
+
+log.debug('\n\nTesting deduplicated chunks\n')
+chunker = ContentChunker(4096, b'seed')
+edited = data[:30000] + b'inserted' + data[30000:]
+first = list(chunker.chunks(io.BytesIO(data)))
+second = list(chunker.chunks(io.BytesIO(edited)))
+if b''.join(first) != data or b''.join(second) != edited:
+    raise Exception('FAILED: Chunks do not join back into the file')
+if max([len(c) for c in first[:-1]]) > chunker.max_size or min(
+        [len(c) for c in first[:-1]]) < chunker.min_size:
+    raise Exception('FAILED: Chunk sizes out of bounds')
+if len(set(first) & set(second)) < len(first) - 2:
+    raise Exception('FAILED: Edited file shares too few chunks')
+
+# numpy, when installed, must find the same boundaries as the Python loop.
+mixed = os.urandom(300000) + bytes(100000) + os.urandom(300000)
+for size in [256, 4096, 65536]:
+    chunker = ContentChunker(size, b'seed')
+    fast = [len(c) for c in chunker.chunks(io.BytesIO(mixed))]
+    saved_numpy = dedup_store.numpy
+    dedup_store.numpy = None
+    slow = [len(c) for c in chunker.chunks(io.BytesIO(mixed))]
+    dedup_store.numpy = saved_numpy
+    if fast != slow:
+        raise Exception('FAILED: Chunk boundaries differ with numpy at '
+                        'average size {}'.format(size))
+
+dedup_dir = 'dedup-test'
+os.makedirs(dedup_dir)
+dedup_conf = EncConf()
+dedup_conf.read()
+dedup_conf.set_dedup_index(os.path.join(dedup_dir, 'index.sqlite'))
+dedup_conf.set_dedup_chunk_kbytes(4)
+store = DedupStore(debug=True, config=dedup_conf)
+stored = []
+for (name, contents) in [('week1', data), ('week2', edited)]:
+    with open(os.path.join(dedup_dir, name), 'wb') as f:
+        f.write(contents)
+    stored.append(store.store(os.path.join(dedup_dir, name)))
+    os.remove(os.path.join(dedup_dir, name))
+if stored[0]['new'] != stored[0]['chunks'] or stored[1]['new'] > 3:
+    raise Exception('FAILED: Chunks stored {}'.format(stored))
+for (name, contents) in [('week1', data), ('week2', edited)]:
+    store.restore(os.path.join(dedup_dir, name + DedupStore.RECIPE_EXTENSION))
+    if checksum(os.path.join(dedup_dir, name)) != hashlib.sha512(
+            contents).hexdigest():
+        raise Exception('FAILED: Restored {} does not match'.format(name))
+    os.remove(os.path.join(dedup_dir, name))
+
+# A chunk file swapped for another fails to restore.
+chunk_files = sorted([f for f in os.listdir(dedup_dir)
+                      if f.startswith(DedupStore.CHUNK_PREFIX)])
+shutil.copyfile(os.path.join(dedup_dir, chunk_files[0]),
+                os.path.join(dedup_dir, chunk_files[1]))
+try:
+    store.restore(os.path.join(dedup_dir, 'week1' + DedupStore.RECIPE_EXTENSION))
+    store.restore(os.path.join(dedup_dir, 'week2' + DedupStore.RECIPE_EXTENSION))
+    raise Exception('FAILED: Restored with a swapped chunk')
+except Exception as e:
+    if str(e).startswith('FAILED'): raise
+store.close()
+shutil.rmtree(dedup_dir)
+log.info('PASSED: Deduplicated chunks.')
+
+
+log.debug('\n\nTesting resuming from a checkpoint\n')
+class Interrupt(object):
+    '''Progress callback which stops encrypting after some bytes.'''
+    def __init__(self, limit):
+        self.limit = limit
+        self.seen = 0
+    def __call__(self, nbytes):
+        self.seen += nbytes
+        if self.seen > self.limit: raise KeyboardInterrupt('Interrupted')
+
+def resumable(callback=None):
+    r = AESCrypt(debug=True, threads=2, progress_callback=callback)
+    r._segment_size = 1000
+    r._checkpoint_segments = 8
+    r.set_filename(testfile2)
+    return r
+
+for touch in [False, True]:
+    with open(testfile2, 'wb') as f:
+        f.write(data)
+    try:
+        resumable(Interrupt(50000)).encrypt()
+        raise Exception('FAILED: Encrypting was not interrupted')
+    except KeyboardInterrupt:
+        pass
+    saved = json.load(open(testfile2 + '.enc' + AESCrypt.CHECKPOINT_EXTENSION))
+    if saved['segments'] < 8 or saved['segments'] % 8 != 0:
+        raise Exception('FAILED: Checkpoint at segment {}'.format(
+            saved['segments']))
+    if touch: os.utime(testfile2)
+    r = resumable()
+    r.encrypt()
+    if os.path.exists(testfile2 + '.enc' + AESCrypt.CHECKPOINT_EXTENSION):
+        raise Exception('FAILED: Checkpoint left after encrypting')
+    resumed = r._stats['segments'] < len(data) // 1000
+    if resumed == touch:
+        raise Exception('FAILED: Resumed {} after touching {}'.format(
+            resumed, touch))
+    if r.file_stats['file_checksum'] != checksum(testfile2 + '.enc'):
+        raise Exception('FAILED: Checksum of a resumed file')
+    os.remove(testfile2)
+    r.set_filename(testfile2 + '.enc')
+    r.decrypt()
+    if checksum(testfile2) != hashlib.sha512(data).hexdigest():
+        raise Exception('FAILED: Resumed file does not decrypt')
+    os.remove(testfile2)
+    os.remove(testfile2 + '.enc')
+log.info('PASSED: Resuming from a checkpoint.')
+
+
+# Rewriting the input with the same size and modification time, as 'rsync -t'
+# or 'touch -r' would, must start over rather than reuse the nonces.
+log.debug('\n\nTesting a rewritten input is not resumed\n')
+with open(testfile2, 'wb') as f:
+    f.write(data)
+try:
+    resumable(Interrupt(50000)).encrypt()
+    raise Exception('FAILED: Encrypting was not interrupted')
+except KeyboardInterrupt:
+    pass
+saved = json.load(open(testfile2 + '.enc' + AESCrypt.CHECKPOINT_EXTENSION))
+st = os.stat(testfile2)
+changed = bytes(reversed(data))
+with open(testfile2, 'wb') as f:
+    f.write(changed)
+os.utime(testfile2, ns=(st.st_atime_ns, st.st_mtime_ns))
+r = resumable()
+r.encrypt()
+if r._stats['segments'] < len(data) // 1000:
+    raise Exception('FAILED: Resumed after the input was rewritten')
+with open(testfile2 + '.enc', 'rb') as f:
+    if f.read(len(b64decode(saved['header']))) == b64decode(saved['header']):
+        raise Exception('FAILED: Header reused after the input was rewritten')
+os.remove(testfile2)
+r.set_filename(testfile2 + '.enc')
+r.decrypt()
+if checksum(testfile2) != hashlib.sha512(changed).hexdigest():
+    raise Exception('FAILED: Rewritten file does not decrypt')
+os.remove(testfile2)
+os.remove(testfile2 + '.enc')
+log.info('PASSED: Rewritten input starts over.')
+
+
+log.debug('\n\nTesting timing of each phase\n')
+# Every phase is timed for both formats and the statistics written as JSON
+# lines never include the key.
+stats_file = 'testfile-stats.jsonl'
+for version in [1, 2]:
+    with open(testfile2, 'wb') as f:
+        f.write(data)
+    r = AESCrypt(debug=True)
+    r._format_version = version
+    r.set_filename(testfile2)
+    r.encrypt()
+    r.append_stats_file(stats_file)
+    os.remove(testfile2)
+    r.set_filename(testfile2 + '.enc')
+    r.decrypt()
+    r.append_stats_file(stats_file)
+    os.remove(testfile2)
+    os.remove(testfile2 + '.enc')
+lines = [json.loads(line) for line in open(stats_file)]
+os.remove(stats_file)
+if [(s['action'], s['format']) for s in lines] != [
+        ('encrypt', 1), ('decrypt', 1), ('encrypt', 2), ('decrypt', 2)]:
+    raise Exception('FAILED: Stats lines {}'.format(lines))
+for s in lines:
+    if 'key' in s or 'salt' in s or s['file'] == None:
+        raise Exception('FAILED: Stats line {}'.format(s))
+    for phase in ['kdf', 'read', 'cipher', 'write', 'finalize']:
+        if not 0 < s[phase + '_seconds'] <= s['total_seconds'] + 1:
+            raise Exception('FAILED: No time for {} in {}'.format(phase, s))
+    if s['mbps'] == None or s['cipher_mbps'] == None:
+        raise Exception('FAILED: No MB/s in {}'.format(s))
+log.info('PASSED: Timing of each phase.')
+
+
+log.debug('\n\nTesting ChaCha20-Poly1305 and picking the faster cipher\n')
+# The cipher is recorded in the header and any instance decrypts it.
+for method in ['AES-GCM', 'ChaCha20-Poly1305', 'auto']:
+    with open(testfile2, 'wb') as f:
+        f.write(data)
+    c = AESCrypt(debug=True)
+    c._encryption_method = method
+    c._key_size = 16
+    c.set_filename(testfile2)
+    c.encrypt()
+    os.remove(testfile2)
+    header = EncHeader()
+    with open(testfile2 + '.enc', 'rb') as f:
+        header.read(f)
+    expected = method
+    if method == 'auto': expected = aes_crypt._fastest['cipher']
+    if header.cipher != expected or expected not in aes_crypt.AEADS:
+        raise Exception('FAILED: Cipher {} recorded for {}'.format(
+            header.cipher, method))
+    if header.key_size != {'AES-GCM' : 16, 'ChaCha20-Poly1305' : 32}[expected]:
+        raise Exception('FAILED: Key size {} with {}'.format(header.key_size,
+                                                            expected))
+    c = AESCrypt(debug=True)
+    c.set_filename(testfile2 + '.enc')
+    c.decrypt()
+    if checksum(testfile2) != hashlib.sha512(data).hexdigest():
+        raise Exception('FAILED: {} round trip'.format(method))
+    os.remove(testfile2)
+    os.remove(testfile2 + '.enc')
+c = AESCrypt(debug=True)
+c._encryption_method = 'ChaCha20-Poly1305'
+encrypted = c.encrypt_bytes(data)
+try:
+    c.decrypt_bytes(encrypted[:-1] + bytes([encrypted[-1] ^ 1]))
+    raise Exception('FAILED: Tampered ChaCha20-Poly1305 bytes decrypted')
+except Exception as e:
+    if str(e).startswith('FAILED'): raise
+log.info('PASSED: ChaCha20-Poly1305 and picking the faster cipher.')
+
+
+log.debug('\n\nTesting envelope encryption and rewrapping\n')
+# Only the wrapped key in the header changes, after which the file only
+# decrypts with the new master key.
+new_keyfile = 'test-newkey'
+with open(new_keyfile, 'w') as f:
+    f.write('a new master key for the test\n')
+for kdf in ['PBKDF2', 'HKDF']:
+    with open(testfile2, 'wb') as f:
+        f.write(data)
+    c = AESCrypt(debug=True)
+    c._kdf = kdf
+    c.set_filename(testfile2)
+    c.encrypt()
+    os.remove(testfile2)
+    with open(testfile2 + '.enc', 'rb') as f:
+        before = f.read()
+    header = EncHeader()
+    header.read(io.BytesIO(before))
+    if not header.envelope() or header.size() != len(header.pack()):
+        raise Exception('FAILED: No wrapped key with {}'.format(kdf))
+    c.set_filename(testfile2 + '.enc')
+    if c.rewrap(new_keyfile=new_keyfile) != True:
+        raise Exception('FAILED: Not rewrapped with {}'.format(kdf))
+    if c.rewrap(new_keyfile=new_keyfile) != False:
+        raise Exception('FAILED: Rewrapped twice with {}'.format(kdf))
+    with open(testfile2 + '.enc', 'rb') as f:
+        after = f.read()
+    wrapped = header.size() - len(header.wrapped_key)
+    if (len(after) != len(before) or after[:wrapped] != before[:wrapped] or
+        after[header.size():] != before[header.size():] or
+        after[wrapped:header.size()] == before[wrapped:header.size()]):
+        raise Exception('FAILED: More than the wrapped key changed with {}'.format(
+            kdf))
+    try:
+        AESCrypt(debug=True).decrypt_bytes(after)
+        raise Exception('FAILED: Decrypted with the old key after rewrapping')
+    except Exception as e:
+        if str(e).startswith('FAILED'): raise
+    n = AESCrypt(debug=True)
+    n._keyfile = new_keyfile
+    if n.decrypt_bytes(after) != data:
+        raise Exception('FAILED: Rewrapped file with {} does not decrypt'.format(
+            kdf))
+    os.remove(testfile2 + '.enc')
+c = AESCrypt(debug=True)
+c._envelope = False
+encrypted = c.encrypt_bytes(data)
+header = EncHeader()
+header.read(io.BytesIO(encrypted))
+if header.envelope() or c.decrypt_bytes(encrypted) != data:
+    raise Exception('FAILED: Without envelope encryption')
+with open(testfile2 + '.enc', 'wb') as f:
+    f.write(encrypted)
+c.set_filename(testfile2 + '.enc')
+try:
+    c.rewrap(new_keyfile=new_keyfile)
+    raise Exception('FAILED: Rewrapped a file without a wrapped key')
+except Exception as e:
+    if str(e).startswith('FAILED'): raise
+os.remove(testfile2 + '.enc')
+os.remove(new_keyfile)
+log.info('PASSED: Envelope encryption and rewrapping.')
+
+
+log.debug('\n\nTesting large files kept out of the page cache\n')
+# Every file counts as large here and the window is small so pages are
+# dropped many times per file.
+(large_file, window) = (cache_io.LARGE_FILE, cache_io.WINDOW)
+(cache_io.LARGE_FILE, cache_io.WINDOW) = (1, 64 * 1024)
+for version in [1, 2]:
+    for direct in [False, True]:
+        with open(testfile2, 'wb') as f:
+            f.write(data)
+        c = AESCrypt(debug=True)
+        c._format_version = version
+        c._direct_io = direct
+        c.set_filename(testfile2)
+        c.encrypt()
+        os.remove(testfile2)
+        c.set_filename(testfile2 + '.enc')
+        c.verify()
+        c.decrypt()
+        if checksum(testfile2) != hashlib.sha512(data).hexdigest():
+            raise Exception('FAILED: Format {} round trip with direct {}'.format(
+                version, direct))
+        os.remove(testfile2)
+        os.remove(testfile2 + '.enc')
+with cache_io.open_file(testfile1, 'rb', direct=True) as f:
+    f.seek(-1000, os.SEEK_END)
+    tail = f.read()
+    f.seek(12345)
+    middle = f.read(100000)
+with open(testfile1, 'rb') as f:
+    f.seek(-1000, os.SEEK_END)
+    if tail != f.read():
+        raise Exception('FAILED: Reading the end of the file')
+    f.seek(12345)
+    if middle != f.read(100000):
+        raise Exception('FAILED: Reading after seeking')
+(cache_io.LARGE_FILE, cache_io.WINDOW) = (large_file, window)
+log.info('PASSED: Large files kept out of the page cache.')
+
+
+log.debug('\n\nTesting a failed encrypt leaves no partial output\n')
+class DiskFull(object):
+    '''Progress callback which fails as a full disk would.'''
+    def __init__(self, limit):
+        self.limit = limit
+        self.seen = 0
+    def __call__(self, nbytes):
+        self.seen += nbytes
+        if self.seen > self.limit:
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+for version in [1, 2]:
+    with open(testfile2, 'wb') as f:
+        f.write(data)
+    c = AESCrypt(debug=True, threads=2, progress_callback=DiskFull(50000))
+    c._format_version = version
+    c._segment_size = 1000
+    c._checkpoint_segments = 0
+    c.set_filename(testfile2)
+    try:
+        c.encrypt()
+        raise Exception('FAILED: Format {} encrypt did not fail'.format(version))
+    except OSError:
+        pass
+    if os.path.exists(testfile2 + '.enc'):
+        raise Exception('FAILED: Format {} left a partial output'.format(version))
+    os.remove(testfile2)
+
+# A checkpointed output is kept so it can be resumed.
+with open(testfile2, 'wb') as f:
+    f.write(data)
+try:
+    resumable(DiskFull(50000)).encrypt()
+    raise Exception('FAILED: Checkpointed encrypt did not fail')
+except OSError:
+    pass
+if not os.path.exists(testfile2 + '.enc'):
+    raise Exception('FAILED: Checkpointed output was removed')
+os.remove(testfile2 + '.enc')
+os.remove(testfile2 + '.enc' + AESCrypt.CHECKPOINT_EXTENSION)
+os.remove(testfile2)
+log.info('PASSED: Failed encrypt leaves no partial output.')
+
+
 sys.exit()
@@ -34,14 +34,15 @@ cfg.loglevel = args.loglevel
 l = MyLog(debug=args.debug, loglevel=args.loglevel)
 log = l.log
 
-# Get all files in the drop work directory.
+# Get all files and directories in the drop work directory.
 filelist = common.get_clean_list(directory=src_dir,
-                                 extensions=['all'])
+                                 extensions=['all'],
+                                 directories=True)
 if len(filelist) == 0:
     log.info('No files to process')
     sys.exit()
 
-# Move all files from drop directory to manifest directory.
+# Move all files and directories from drop directory to manifest directory.
 common.move_files(filelist=filelist)
 
 # The drop directory is never purged because more files may be placed here.
@@ -7,13 +7,87 @@
 
 import sys
 import os
+import json
+import tempfile
 import subprocess
+import configparser
 from mylog import MyLog
 from s3_backup_conf import S3BackupConf
 from s3_backup_common import S3BackupCommon
 
 TOP_DIR = str(os.sep).join(os.path.realpath(__file__).split(os.sep)[:-2])
-SCRIPT = TOP_DIR + os.sep + 'encrypt_files' + os.sep + 'bin' + os.sep + 'encrypt_files.sh'
+ENCRYPT_DIR = TOP_DIR + os.sep + 'encrypt_files'
+SCRIPT = ENCRYPT_DIR + os.sep + 'bin' + os.sep + 'encrypt_files.sh'
+ENC_CONFIG = ENCRYPT_DIR + os.sep + 'etc' + os.sep + 'encryption_config.cfg'
+
+# Space kept free on the encryption work directory's file system.
+RESERVE_BYTES = 256 * 1024 * 1024
+
+# Encrypted size of a file as a multiple of its size.  GPG output is ASCII
+# armored.  The AES formats only add a header and a tag per segment.
+GROWTH = { 'GPG' : 1.4 }
+DEFAULT_GROWTH = 1.01
+
+# Extensions of the encrypted files written next to each file.  Recipes are
+# written by encrypt_files with dedup set.
+ENCRYPTED_EXTENSIONS = ['.enc', '.asc', '.recipe.enc']
+
+
+
+def estimate(filename=None, growth=DEFAULT_GROWTH):
+    '''Bytes the encrypted copy of a file is expected to take when encrypting
+    makes it 'growth' times larger.
+    '''
+    return int(os.path.getsize(filename) * growth) + 64 * 1024
+
+
+
+def schedule(pending=None, free=0, growth=DEFAULT_GROWTH):
+    '''Pick the files to encrypt next.  The largest files which fit in the
+    free space go first, so smaller files fill what is left.
+    '''
+    batch = []
+    for f in sorted(pending, key=lambda x: estimate(x, growth),
+                    reverse=True):
+        if estimate(f, growth) <= free:
+            batch.append(f)
+            free -= estimate(f, growth)
+    return batch
+
+
+
+def succeeded(results_file=None):
+    '''Return the full paths of the files encrypt_files.sh reported as
+    encrypted in its --stats-file.  A file missing from it failed.
+    '''
+    ok = []
+    if not os.path.exists(results_file): return ok
+    with open(results_file, 'r') as f:
+        for line in f:
+            if line.strip() == '': continue
+            result = json.loads(line)
+            if result.get('status') == 'OK':
+                ok.append(os.path.realpath(result['file']))
+    f.close()
+    return ok
+
+
+
+def encrypted_files(filename=None):
+    '''Return the encrypted file, and its stats file if written, for a file
+    reported as encrypted.  Otherwise an empty list.  A file left with a
+    checkpoint was only partly encrypted.
+    '''
+    for ext in ENCRYPTED_EXTENSIONS:
+        encrypted = filename + ext
+        if (os.path.exists(encrypted) and
+            not os.path.exists(encrypted + '.checkpoint')):
+            if os.path.exists(encrypted + '.stats'):
+                return [encrypted, encrypted + '.stats']
+            return [encrypted]
+    return []
+
+
 
 # Read the config to create the custom description for the --help option.
 cfg = S3BackupConf()
@@ -36,6 +110,11 @@ cfg.loglevel = args.loglevel
 l = MyLog(debug=args.debug, loglevel=args.loglevel)
 log = l.log
 
+enc_cfg = configparser.RawConfigParser()
+enc_cfg.read(ENC_CONFIG)
+growth = GROWTH.get(enc_cfg.get('DEFAULT', 'encryption_method'),
+                    DEFAULT_GROWTH)
+
 # Get all files in the encryption work directory.
 filelist = common.get_clean_list(directory=src_dir,
                                  extensions=['all'])
@@ -43,31 +122,84 @@ if len(filelist) == 0:
     log.info('No files to process')
     sys.exit()
 
+# Archives of directories were encrypted by action_manifests.py while they
+# were written and are only moved on.
+filelist = [f for f in filelist
+            if os.path.splitext(f)[1] not in ['.enc', '.asc']]
+
 # Prep for running the subscript.
 #     encrypt_files.sh does not take --noop option
+#     --write-stats saves the checksum of each encrypted file, hashed while
+#     encrypting, so action_metadata.py does not read every file again.
 cmd=['bash', SCRIPT]
 subargs = sys.argv[1:]
 if '--noop' in subargs: subargs.remove('--noop')
 for a in subargs:
     cmd.append(a)
-for f in filelist:
-    cmd.append(f)
-report = 'Running\n\n{}\n\n'.format(cmd)
-if args.noop:
-    log.debug('NO-OP: {}'.format(report))
-else:
-    log.debug('{}'.format(report))
-    results = subprocess.run(cmd)
+cmd.append('--write-stats')
+
+# Encrypted files are written next to the originals, so encrypting everything
+# at once needs room for two copies of the whole batch.  Instead files are
+# encrypted in batches which fit in the space measured free, and as soon as
+# a batch finishes the encrypted files are moved on and the originals
+# deleted to make room for the next.
+#
+# Only files encrypt_files.sh reports as encrypted in its --stats-file are
+# moved on and deleted.  An encrypted file which exists is not enough, as a
+# failure such as a full disk may have left it cut short.
+failed = []
+pending = list(filelist)
+if len(pending) == 0:
+    log.debug('All files already encrypted')
+elif args.noop:
+    log.debug('NO-OP: {}'.format('Running\n\n{}\n\n'.format(cmd + pending)))
+    pending = []
+while len(pending) > 0:
+    free = common.free_space(src_dir) - RESERVE_BYTES
+    batch = schedule(pending, free, growth)
+    if len(batch) == 0:
+        for f in pending:
+            log.error('Not enough free space to encrypt "{}".  Needs {} '
+                      'bytes with {} free.'.format(f, estimate(f, growth),
+                                                  free))
+        failed += pending
+        break
+    (fd, results_file) = tempfile.mkstemp(prefix='s3_backup-encrypt-',
+                                          suffix='.jsonl')
+    os.close(fd)
+    batch_cmd = cmd + ['--stats-file', results_file] + batch
+    log.debug('Running\n\n{}\n\n'.format(batch_cmd))
+    try:
+        results = subprocess.run(batch_cmd)
+        ok = succeeded(results_file)
+    finally:
+        os.remove(results_file)
     if results.returncode != 0:
         log.error('Failed to encrypt files!')
-        sys.exit(results.returncode)
+    for f in batch:
+        pending.remove(f)
+        encrypted = []
+        if os.path.realpath(f) in ok: encrypted = encrypted_files(f)
+        if len(encrypted) == 0:
+            log.error('Failed to encrypt "{}"'.format(f))
+            failed.append(f)
+            continue
+        common.move_files(filelist=encrypted)
+        # Unencrypted manifests are moved on below with the rest.
+        if os.path.splitext(f)[1] != '.manifest': common.remove_file(f)
+
+# Files which failed are kept to try again along with anything else left.
+if len(failed) > 0:
+    log.error('Failed to encrypt {} files'.format(len(failed)))
+    sys.exit(1)
 
 # After successful encryption, the following files are moved from the
 # encryption work directory to the metadata work directory:
 #    - encrypted files (.asc, .enc)
 #    - manifest files  (.manifest)
+#    - stats files     (.stats)
 filelist = common.get_clean_list(directory=src_dir,
-                                 extensions=['.enc', '.asc', '.manifest'])
+    extensions=['.enc', '.asc', '.manifest', '.stats'])
 common.move_files(filelist=filelist)
 
 # The encryption work directory is then purged.  This should be
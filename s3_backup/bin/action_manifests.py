@@ -9,11 +9,15 @@ import sys
 import os
 import re
 import tarfile
+import configparser
 from mylog import MyLog
 from s3_backup_conf import S3BackupConf
 from s3_backup_common import S3BackupCommon
 
 TOP_DIR = str(os.sep).join(os.path.realpath(__file__).split(os.sep)[:-2])
+ENCRYPT_DIR = TOP_DIR + os.sep + 'encrypt_files'
+SCRIPT = ENCRYPT_DIR + os.sep + 'bin' + os.sep + 'encrypt_files.sh'
+ENC_CONFIG = ENCRYPT_DIR + os.sep + 'etc' + os.sep + 'encryption_config.cfg'
 
 # Read the config to create the custom description for the --help option.
 cfg = S3BackupConf()
@@ -26,7 +30,8 @@ common = S3BackupCommon(src_dir=src_dir, dst_dir=dst_dir)
 
 # Custom help for argparse.
 custom_help = '''Create manifests for any archives in "{}" and move all files
-over to "{}".'''.format(str(os.sep).join(src_dir.split(os.sep)[-3:]),
+over to "{}".  Directories are archived, listed, and encrypted in a single
+pass.'''.format(str(os.sep).join(src_dir.split(os.sep)[-3:]),
                         str(os.sep).join(dst_dir.split(os.sep)[-3:]))
 args = common.parse_arguments(description=custom_help)
 
@@ -37,15 +42,45 @@ l = MyLog(debug=args.debug, loglevel=args.loglevel)
 log = l.log
 
 re_targz = re.compile(r'^.*\.tar\.gz$')
-# Examine all files in the manifest work directory.
+# Examine all files and directories in the manifest work directory.
 filelist = common.get_clean_list(directory=src_dir,
-                                 extensions=['all'])
+                                 extensions=['all'],
+                                 directories=True)
 if len(filelist) == 0:
     log.info('No files to process')
     sys.exit()
 
-# Build manifests
+# Directories are archived and the manifest listed as each member is added.
+# Unless GPG is used, the archive is also encrypted as it is written by
+# piping it through encrypt_files.sh so the files are only read once.  The
+# encrypted archive is passed over by action_encrypt.py.
+enc_cfg = configparser.RawConfigParser()
+enc_cfg.read(ENC_CONFIG)
+encrypt_cmd = None
+if enc_cfg.get('DEFAULT', 'encryption_method', fallback='GPG') != 'GPG':
+    encrypt_cmd = ['bash', SCRIPT]
+    for a in sys.argv[1:]:
+        if a != '--noop': encrypt_cmd.append(a)
+    encrypt_cmd.append('-')
+
+# A directory which fails is left where it is for the next run.
 manifests = {}
+failed = []
+for d in [f for f in filelist if os.path.isdir(f)]:
+    if args.noop == True:
+        log.debug('NO-OP: Archiving "{}" with {}'.format(d, encrypt_cmd))
+        continue
+    try:
+        (archive, names) = common.archive_directory(directory=d,
+                                                    encrypt_cmd=encrypt_cmd)
+    except Exception as e:
+        log.error('Failed to archive "{}": {}'.format(d, e))
+        failed.append(d)
+        continue
+    manifests[re.sub(r'\.enc$', '', archive)] = names
+    common.remove_directory(d)
+
+# Build manifests
 for f in filelist:
     if not re.match(re_targz, f): continue
     if args.noop == False:
@@ -85,6 +120,7 @@ common.move_files(filelist=filelist)
 
 # Clean the manifest work directory of any stragglers.
 common.clean_src()
+if len(failed) > 0: sys.exit(1)
 
 
 
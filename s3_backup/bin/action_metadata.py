@@ -47,11 +47,14 @@ if len(filelist) == 0:
 
 # Prep for running the subscript.
 #     create_metadata.sh does not take --noop option
+#     --use-stats takes checksums from the stats files written while
+#     encrypting.  The stats files are purged with the stragglers below.
 cmd=['bash', SCRIPT]
 subargs = sys.argv[1:]
 if '--noop' in subargs: subargs.remove('--noop')
 for a in subargs:
     cmd.append(a)
+cmd.append('--use-stats')
 for f in filelist:
     cmd.append(f)
 report = 'Running\n\n{}\n\n'.format(cmd)
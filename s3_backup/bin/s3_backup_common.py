@@ -7,7 +7,10 @@
 
 import sys
 import os
+import shutil
+import tarfile
 import argparse
+import subprocess
 from mylog import MyLog
 from s3_backup_conf import S3BackupConf
 
@@ -62,9 +65,10 @@ class S3BackupCommon(object):
 
 
 
-    def get_clean_list(self, directory=None, extensions=['all']):
-        '''Examine directory for files to process.  Exclude directories and
-        special files.
+    def get_clean_list(self, directory=None, extensions=['all'],
+                       directories=False):
+        '''Examine directory for files to process.  Exclude special files,
+        and directories unless directories is True.
 
         RETURN
                 List of full paths to files.
@@ -85,6 +89,9 @@ class S3BackupCommon(object):
                 'all' in extensions or ext in extensions):
                 cleaned_list.append(fullpath)
                 report += '        {}\n'.format(f)
+            elif directories == True and os.path.isdir(fullpath):
+                cleaned_list.append(fullpath)
+                report += '        {}{}\n'.format(f, os.sep)
             else:
                 self.log.warning('Excluding {}'.format(f))
         self.log.debug('{}'.format(report))
@@ -92,6 +99,92 @@ class S3BackupCommon(object):
 
 
 
+    def archive_directory(self, directory=None, encrypt_cmd=None):
+        '''Archive a directory to DIRECTORY.tar.gz next to it, listing the
+        members as they are added so the archive never needs reopening for
+        its manifest.  With encrypt_cmd, a command which encrypts STDIN to
+        STDOUT, the archive is streamed through it to DIRECTORY.tar.gz.enc
+        instead, so every file in the directory is read once and no
+        unencrypted archive is written.
+
+        RETURN
+                (archive file, sorted list of member names)
+        '''
+        directory = directory.rstrip(os.sep)
+        archive = directory + '.tar.gz'
+        if encrypt_cmd != None: archive += '.enc'
+        self.log.info('Archiving "{}" to "{}"'.format(
+            directory, os.path.basename(archive)))
+        names = []
+        def record(tarinfo):
+            # Exclude special files as get_clean_list() does.
+            if os.path.basename(tarinfo.name) == '.DS_Store': return None
+            names.append(tarinfo.name)
+            return tarinfo
+
+        if encrypt_cmd == None:
+            with tarfile.open(archive, 'w:gz') as tar:
+                tar.add(directory, arcname=os.path.basename(directory),
+                        filter=record)
+            return (archive, sorted(names))
+
+        with open(archive, 'wb') as out_file:
+            p = subprocess.Popen(encrypt_cmd, stdin=subprocess.PIPE,
+                                 stdout=out_file)
+            try:
+                with tarfile.open(fileobj=p.stdin, mode='w|gz') as tar:
+                    tar.add(directory, arcname=os.path.basename(directory),
+                            filter=record)
+                p.stdin.close()
+            except:
+                p.kill()
+                p.wait()
+                os.remove(archive)
+                raise
+            returncode = p.wait()
+        if returncode != 0:
+            os.remove(archive)
+            raise Exception('Encrypting "{}" exited with {}'.format(
+                os.path.basename(archive), returncode))
+        return (archive, sorted(names))
+
+
+
+    def remove_directory(self, directory=None):
+        '''Remove a directory once it has been archived.
+        '''
+        if self.noop == True:
+            self.log.debug('NO-OP: Removing "{}"'.format(directory))
+            return
+        self.log.info('Removing "{}"'.format(directory))
+        shutil.rmtree(directory)
+        return
+
+
+
+    def free_space(self, directory=None):
+        '''Measure the space on the file system holding directory.
+
+        RETURN
+                Bytes free to a user without root.
+        '''
+        st = os.statvfs(directory)
+        return st.f_bavail * st.f_frsize
+
+
+
+    def remove_file(self, filename=None):
+        '''Remove a single file once it has been dealt with.
+        '''
+        if self.noop == True:
+            self.log.debug('NO-OP: Removing "{}"'.format(filename))
+            return
+        self.log.debug('Removing "{}"'.format(filename))
+        os.remove(filename)
+        return
+
+
+
     def move_files(self, filelist=None):
         self.log.info('Moving files from "{}" to "{}"'.format(
             self.src_dir, self.dst_dir))
@@ -126,6 +219,10 @@ class S3BackupCommon(object):
         self.log.info('{}'.format(report))
         for f in os.listdir(self.src_dir):
             filename = self.src_dir + os.sep + f
+            # Directories which failed to archive are kept to try again.
+            if os.path.isdir(filename):
+                self.log.warning('Keeping directory "{}"'.format(filename))
+                continue
             os.remove(filename)
         return
 
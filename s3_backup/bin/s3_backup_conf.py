@@ -21,14 +21,15 @@ class S3BackupConf(object):
                                 Archives are assumed to be compressed with
                                 .tar.gz extension.
 
-        drop_dir                Directory where files to be archived are
-                                dropped.
+        drop_dir                Directory where files and directories to be
+                                archived are dropped.
 
         drop_script             Script to move files from drop directory to
                                 begin the process.
 
         manifest_dir            Directory where manifest files for archives
-                                are created.
+                                are created.  Directories are archived and
+                                encrypted here.
 
         manifest_script         Script used to create the archive manifests.
 
@@ -264,6 +265,11 @@ class S3BackupConf(object):
 #                              are moved to the next directory.  Files are simply
 #                              moved to the next directory in the process.
 #
+#                              Directories are archived to DIR.tar.gz.enc in a
+#                              single pass which also lists the manifest, then
+#                              removed.  With GPG encryption the archive is
+#                              DIR.tar.gz and is encrypted in the next step.
+#
 #                              See NOTES section about archives in the README.
 #                              [DEFAULT: {}]
 #       '''.format(self.DEF_CONFIG['manifest_dir'])
@@ -275,7 +281,11 @@ class S3BackupConf(object):
 # encrypt_dir                  Files, archives, and manifest files - if present
 #                              in this directory are encrypted.
 #
-#                              After successful encryption:
+#                              Files are encrypted in batches which fit in the
+#                              space free on this directory's file system, so
+#                              the whole drop never needs room for two copies.
+#
+#                              As soon as each batch is encrypted:
 #
 #                              * The original, unencrypted file is delete.
 #
@@ -31,6 +31,9 @@ class AWSConf(object):
 
         set_mp_chunksize       Chunk size for multipart upload.
 
+        set_check_etag         Check the ETag of each file uploaded against
+                               the s3_etag in its metadata file.
+
 
         print                  Print the values of the configuration for
                                debug logging.
@@ -45,7 +48,8 @@ class AWSConf(object):
     DEF_CONFIG = {
         'mp_threshold'         : 32 * (1024 ** 2),
         'max_concurrency'      : 10,
-        'mp_chunksize'         : 32 * 1024
+        'mp_chunksize'         : 32 * 1024,
+        'check_etag'           : False
     }
 
     def __init__(self, debug=None, loglevel='WARNING'):
@@ -61,6 +65,7 @@ class AWSConf(object):
         self.mp_threshold = self.DEF_CONFIG['mp_threshold']
         self.max_concurrency = self.DEF_CONFIG['max_concurrency']
         self.mp_chunksize = self.DEF_CONFIG['mp_chunksize']
+        self.check_etag = self.DEF_CONFIG['check_etag']
         return
 
 
@@ -77,6 +82,9 @@ class AWSConf(object):
             cfg.get('DEFAULT', 'max_concurrency'))
         self.set_mp_chunksize(
             cfg.get('DEFAULT', 'mp_chunksize'))
+        self.set_check_etag(
+            cfg.get('DEFAULT', 'check_etag',
+                    fallback=self.DEF_CONFIG['check_etag']))
         return
 
 
@@ -111,6 +119,21 @@ class AWSConf(object):
 
 
 
+    def set_check_etag(self, check_etag=None):
+        '''Set whether the ETag of each file uploaded is checked against the
+        s3_etag in its metadata file.  Accepts True or False either as a
+        boolean or as a string.
+        '''
+        if check_etag == None: return
+        if str(check_etag).lower() not in ['true', 'false']:
+            raise Exception('check_etag must be True or False not "{}"'.format(
+                check_etag))
+        self.check_etag = str(check_etag).lower() == 'true'
+        self.log.debug('Set check_etag to {}'.format(self.check_etag))
+        return
+
+
+
     def print(self):
         '''Report on the details read from the configuration file.
         '''
@@ -118,6 +141,7 @@ class AWSConf(object):
         rpt += '{:<25} {}\n'.format('mp_threshold', self.mp_threshold)
         rpt += '{:<25} {}\n'.format('max_concurrency', self.max_concurrency)
         rpt += '{:<25} {}\n'.format('mp_chunksize', self.mp_chunksize)
+        rpt += '{:<25} {}\n'.format('check_etag', self.check_etag)
         rpt += '{}\n'.format('='*76)
         return rpt
 
@@ -136,6 +160,7 @@ class AWSConf(object):
         cfg += 'mp_threshold = {}\n'.format(self.mp_threshold)
         cfg += 'max_concurrency = {}\n'.format(self.max_concurrency)
         cfg += 'mp_chunksize = {}\n'.format(self.mp_chunksize)
+        cfg += 'check_etag = {}\n'.format(self.check_etag)
         cfg += '\n\n{}\n# END\n{}\n'.format(div, div)
         return cfg
 
@@ -165,6 +190,14 @@ class AWSConf(object):
 #                              upload.
 #                              [DEFAULT: {}] (32 KB)
 #       '''.format(self.DEF_CONFIG['mp_threshold'])
+        header += '''
+# check_etag                   After each upload check the ETag S3 gives the
+#                              file against the s3_etag in its metadata file
+#                              and fail if they differ.  Buckets encrypted
+#                              with SSE-KMS give ETags which are not MD5s, so
+#                              leave this False for them.  True or False.
+#                              [DEFAULT: {}]
+#       '''.format(self.DEF_CONFIG['check_etag'])
         return header
 
 
@@ -12,6 +12,7 @@ import boto3
 from botocore.exceptions import ClientError
 from tqdm import tqdm
 from mylog import MyLog
+from cache_io import open_file
 
 # Extras for multipart upload.
 import threading
@@ -79,6 +80,10 @@ class AWSS3(object):
 
         upload             Upload a file to S3.
 
+        check_etag         Raise an exception if the ETag of an object in S3
+                           is not the one expected.  Only run by upload()
+                           with 'check_etag' set in the configuration.
+
     '''
 
     TOP_DIR = str(os.sep).join(os.path.realpath(__file__).split(os.sep)[:-2])
@@ -207,19 +212,26 @@ class AWSS3(object):
 
 
 
-    def upload(self, srcfile=None, bucket=None, key=None, showprogress=False):
+    def upload(self, srcfile=None, bucket=None, key=None, showprogress=False,
+               etag=None):
         '''Upload a file to S3 through a single stream.  Show progress if requested
         (i.e. showprogress=True) using the ProgressPercentage class.
+
+        If etag is given, such as the 's3_etag' from the metadata file, and
+        'check_etag' is set in the configuration, the ETag of the uploaded
+        object is checked against it.
         '''
+        if self.cfg.check_etag != True: etag = None
 
         # If file size is larger than 'mp_threshold' in the config, use
         # multipart upload with threading instead.
         if os.path.getsize(srcfile) > self.cfg.mp_threshold:
-            response = self._mp_upload(srcfile=srcfile,
-                                       bucket=bucket,
-                                       key=key,
-                                       showprogress=showprogress)
-            return response
+            self._mp_upload(srcfile=srcfile,
+                            bucket=bucket,
+                            key=key,
+                            showprogress=showprogress)
+            if etag != None: self.check_etag(bucket=bucket, key=key, etag=etag)
+            return
 
         if self.client == None: self.connect()
         size_bytes = os.path.getsize(srcfile)
@@ -233,16 +245,25 @@ class AWSS3(object):
                 self.prettyprint(size_bytes),
                 s3_url))
 
+        # The file is read once in order through open_file() so a large file
+        # does not fill the page cache.  It is sent in a single request, as
+        # boto3 would otherwise use multipart upload from 8 MB, so its ETag
+        # is the MD5 of the file.
+        config = TransferConfig(multipart_threshold=size_bytes + 1,
+                                use_threads=False)
         try:
-            if showprogress == True:
-                response = self.client.upload_file(srcfile,
-                                                   bucket,
-                                                   key,
-                                                   Callback=progress)
-            else:
-                response = self.client.upload_file(srcfile,
-                                                   bucket,
-                                                   key)
+            with open_file(srcfile, 'rb') as f:
+                if showprogress == True:
+                    self.client.upload_fileobj(f,
+                                               bucket,
+                                               key,
+                                               Config=config,
+                                               Callback=progress)
+                else:
+                    self.client.upload_fileobj(f,
+                                               bucket,
+                                               key,
+                                               Config=config)
         except ClientError as e:
             raise Exception(e)
         finally:
@@ -251,6 +272,27 @@ class AWSS3(object):
             else:
                 self.log.debug('Successfully uploaded {} to {}'.format(
                     os.path.basename(srcfile), s3_url))
+        if etag != None: self.check_etag(bucket=bucket, key=key, etag=etag)
+        return
+
+
+
+    def check_etag(self, bucket=None, key=None, etag=None):
+        '''Raise an exception if the ETag S3 has for the object differs from
+        the one expected.  Objects in buckets encrypted with SSE-KMS have
+        ETags which are not MD5s and cannot be checked this way.
+        '''
+        if self.client == None: self.connect()
+        s3_url = 's3://{}/{}'.format(bucket, key)
+        try:
+            response = self.client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            raise Exception(e)
+        s3_etag = response['ETag'].strip('"')
+        if s3_etag != etag:
+            raise Exception('ETag of "{}" is "{}" not "{}"'.format(
+                s3_url, s3_etag, etag))
+        self.log.debug('ETag of {} matches "{}"'.format(s3_url, etag))
         return
 
 
@@ -277,20 +319,24 @@ class AWSS3(object):
                 self.prettyprint(size_bytes),
                 s3_url))
 
+        # Parts are read one after another from the file object, rather than
+        # by each thread opening the file, so it is read in order and can be
+        # dropped from the page cache as it goes.
         try:
-            if showprogress == True:
-                response = self.resource.meta.client.upload_file(
-                    srcfile,
-                    bucket,
-                    key,
-                    Config=config,
-                    Callback=progress)
-            else:
-                response = self.resource.meta.client.upload_file(
-                    srcfile,
-                    bucket,
-                    key,
-                    Config=config)
+            with open_file(srcfile, 'rb') as f:
+                if showprogress == True:
+                    response = self.resource.meta.client.upload_fileobj(
+                        f,
+                        bucket,
+                        key,
+                        Config=config,
+                        Callback=progress)
+                else:
+                    response = self.resource.meta.client.upload_fileobj(
+                        f,
+                        bucket,
+                        key,
+                        Config=config)
         except ClientError as e:
             raise Exception(e)
         finally:
@@ -47,13 +47,16 @@ def build_list(args=None, filelist=None):
         FULLPATH_TO_SRC {
             'dst_url' : S3_URL,
             'bucket'  : BUCKET_NAME,
-            'key'     : S3_KEY
+            'key'     : S3_KEY,
+            'etag'    : ETAG_EXPECTED or None
         }
 
     '''
     upload_list = {}
-    md = MetaData(debug=args.debug, loglevel=args.loglevel)
     for md_file in filelist:
+        # A new instance for each file so nothing is carried over from a
+        # metadata file written without some of the keys.
+        md = MetaData(debug=args.debug, loglevel=args.loglevel)
 
         if not os.path.isfile(md_file):
             raise Exception('Not a file "{}'.format(md_file))
@@ -84,12 +87,14 @@ def build_list(args=None, filelist=None):
             'dst_url'          : src_dst,
             'bucket'           : bucket,
             'key'              : key,
+            'etag'             : md.s3_etag,
         }
         (bucket,key) = _get_bucket_and_key(md_dst)
         upload_list[md_fullpath] = {
             'dst_url'          : md_dst,
             'bucket'           : bucket,
             'key'              : key,
+            'etag'             : None,
         }
     return upload_list
 
@@ -158,7 +163,8 @@ def main():
         s3.upload(srcfile=file,
                   bucket=upload_list[file]['bucket'],
                   key=upload_list[file]['key'],
-                  showprogress=args.showprogress)
+                  showprogress=args.showprogress,
+                  etag=upload_list[file]['etag'])
     return
 
 
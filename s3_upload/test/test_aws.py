@@ -28,6 +28,13 @@ def test_aws_conf(log):
     log.debug('Setting mp_chunksize to 1 KB (1024 B)')
     cfg.set_mp_chunksize(1024)
 
+    log.debug('Checking ETags is off unless set')
+    if cfg.check_etag != False:
+        raise Exception('check_etag on by default FAILED!')
+    cfg.set_check_etag('True')
+    if cfg.check_etag != True:
+        raise Exception('Setting check_etag FAILED!')
+
     log.debug('Printing new values\n{}'.format(cfg.print()))
     log.debug('PASSED')
     return